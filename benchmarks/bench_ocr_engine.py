@@ -0,0 +1,78 @@
+"""
+Benchmark of the OCR engines on small single-page receipts.
+
+Renders synthetic receipts of a few items, prepares them as extraction does
+and OCRs them with the tesseract binary (pytesseract, a process per page) and,
+if installed, the pooled tesserocr engine, one page at a time and then across
+a thread pool. Reports the first page, which for tesserocr includes loading
+the model, p50/p95 latency per page and pages per second.
+
+    python benchmarks/bench_ocr_engine.py [--pages 50] [--threads 4]
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from synthetic import receipt_image, receipt_lines  # noqa: E402
+
+from receipt_processor.ocr import engine as ocr_engine  # noqa: E402
+from receipt_processor.ocr.preprocess import preprocess_page  # noqa: E402
+from receipt_processor.routes.utils import OCR_DEFAULTS  # noqa: E402
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(len(sorted_values) * q / 100), len(sorted_values) - 1)]
+
+
+def pages(count, dpi, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        image, _ = preprocess_page(receipt_image(receipt_lines(rng.randint(3, 8), rng), dpi), OCR_DEFAULTS)
+        yield image
+
+
+def timed_page(engine, image):
+    start = time.perf_counter()
+    engine.image_to_data(image)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--dpi', type=int, default=OCR_DEFAULTS['OCR_DPI'])
+    args = parser.parse_args()
+
+    images = list(pages(args.pages, args.dpi))
+    engines = [ocr_engine.ENGINE_PYTESSERACT]
+    if ocr_engine.tesserocr is not None:
+        engines.append(ocr_engine.ENGINE_TESSEROCR)
+    else:
+        print('tesserocr is not installed; timing the tesseract binary only')
+
+    print(f"{'engine':<14}{'threads':>8}{'first ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'pages/s':>9}")
+    for name in engines:
+        for threads in sorted({1, args.threads}):
+            options = dict(OCR_DEFAULTS, OCR_ENGINE=name, OCR_CONCURRENCY=threads)
+            start = time.perf_counter()
+            engine = ocr_engine._create_engine(options)
+            engine.image_to_data(images[0])
+            first = time.perf_counter() - start
+            with contextlib.closing(engine), ThreadPoolExecutor(max_workers=threads) as executor:
+                start = time.perf_counter()
+                samples = sorted(executor.map(lambda image: timed_page(engine, image), images))
+                elapsed = time.perf_counter() - start
+            print(f"{name:<14}{threads:>8}{first * 1000:>10.0f}{percentile(samples, 50) * 1000:>9.0f}"
+                  f"{percentile(samples, 95) * 1000:>9.0f}{len(images) / elapsed:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark for receipt text parsing, plus a worst-case runtime check on
+pathological OCR output. Exits non-zero if any pathological input takes longer
+than the limit.
+
+    python benchmarks/bench_parser.py [--iterations 2000] [--limit-ms 250]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from receipt_processor.nlp.extractor import receipt_extractor  # noqa: E402
+
+SAMPLE_RECEIPT = """CORNER MARKET
+123 Main Street, Springfield
+12/03/2024 14:32
+Receipt #A-10293
+
+2 x Whole Milk            $6.98
+Bread.....................$3.49
+Bananas                   $1.99
+Coffee Beans - $12.50
+
+Subtotal                 $24.96
+Tax                       $2.00
+Total                    $26.96
+Paid by VISA **** 4242
+Thank you for shopping!
+"""
+
+SIZE = 20000
+
+# Shapes of OCR garbage that made the previous patterns backtrack for seconds or minutes
+PATHOLOGICAL_INPUTS = {
+    'letters_and_spaces': 'a ' * (SIZE // 2) + '!',
+    'quantity_then_spaces': '1' + ' ' * SIZE + '! 9.99',
+    'long_name_without_price': 'x' * SIZE + ' 9.9',
+    'digit_run': '1' * SIZE,
+    'digit_run_before_keyword': '1' * SIZE + ' tota',
+    'digits_and_dots': '1.' * (SIZE // 2),
+    'digits_and_spaces': '1 ' * (SIZE // 2) + 'x',
+    'separators': '.-' * (SIZE // 2) + 'x',
+    'mixed_garbage_lines': '\n'.join(['Il1 l1I .,.- 0O0 ' * 40] * 30),
+}
+
+
+def time_call(text):
+    start = time.perf_counter()
+    receipt_extractor.extract(text)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--limit-ms', type=float, default=250.0, help='worst-case bound per pathological input')
+    args = parser.parse_args()
+
+    receipt_extractor.extract(SAMPLE_RECEIPT)  # warm up dateutil
+    timings = sorted(time_call(SAMPLE_RECEIPT) for _ in range(args.iterations))
+    print(f"sample receipt: {args.iterations} runs, "
+          f"mean {statistics.mean(timings):.3f} ms, "
+          f"p50 {timings[len(timings) // 2]:.3f} ms, "
+          f"p99 {timings[int(len(timings) * 0.99) - 1]:.3f} ms")
+
+    failures = 0
+    for name, text in PATHOLOGICAL_INPUTS.items():
+        elapsed = max(time_call(text) for _ in range(3))
+        status = 'ok' if elapsed <= args.limit_ms else 'TOO SLOW'
+        failures += status != 'ok'
+        print(f"{name:<26} {len(text):>6} chars {elapsed:>9.2f} ms  {status}")
+
+    if failures:
+        print(f"{failures} pathological inputs exceeded {args.limit_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+End-to-end benchmark of the receipt pipeline over the PDFs in uploads/ and
+synthetic receipts of varying page counts and sizes.
+
+Times each stage per file (PDF validation, text extraction, parsing, the
+database insert) and the /upload, /validate and /process routes through the
+Flask test client, then reports p50/p95/p99 latency per stage, receipts per
+second, peak RSS and CPU utilization. Results are written as JSON so runs can
+be compared with --baseline.
+
+    python benchmarks/bench_pipeline.py [--iterations 3] [--synthetic 12] [--output results.json]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from synthetic import synthetic_receipts  # noqa: E402
+
+from receipt_processor import create_app, db  # noqa: E402
+from receipt_processor.models.receipt import ReceiptFile  # noqa: E402
+from receipt_processor.pipeline import store_receipts  # noqa: E402
+from receipt_processor.routes.utils import (  # noqa: E402
+    extract_text_from_pdf, get_ocr_options, is_valid_pdf, parse_receipt_text
+)
+
+PIPELINE_STAGES = ['is_valid_pdf', 'extract_text_from_pdf', 'parse_receipt_text', 'db_insert']
+ROUTE_STAGES = ['route_upload', 'route_validate', 'route_process']
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class StageTimes:
+    """Latency samples and error counts per stage."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def time(self, stage, func, *args):
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception:
+            result = None
+        self.add(stage, time.perf_counter() - start, ok=result is not None)
+        return result
+
+    def add(self, stage, seconds, ok=True):
+        self.samples.setdefault(stage, []).append(seconds)
+        self.errors.setdefault(stage, 0)
+        if not ok:
+            self.errors[stage] += 1
+
+    def summary(self, stages):
+        summary = {}
+        for stage in stages:
+            if stage not in self.samples:
+                continue
+            samples = sorted(self.samples[stage])
+            summary[stage] = {
+                'count': len(samples),
+                'errors': self.errors[stage],
+                'mean_ms': sum(samples) / len(samples) * 1000,
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p95_ms': percentile(samples, 95) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000,
+                'max_ms': samples[-1] * 1000
+            }
+        return summary
+
+
+def usage():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)  # Tesseract and pdftoppm run as subprocesses
+    return {
+        'cpu_seconds': self_usage.ru_utime + self_usage.ru_stime + children.ru_utime + children.ru_stime,
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        'max_rss_mb': max(self_usage.ru_maxrss, children.ru_maxrss) / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    }
+
+
+def load_inputs(upload_dir, synthetic_count, seed):
+    """Return (name, pdf bytes) for the bundled sample PDFs and the synthetic receipts."""
+    inputs = []
+    if os.path.isdir(upload_dir):
+        for name in sorted(os.listdir(upload_dir)):
+            if name.lower().endswith('.pdf'):
+                with open(os.path.join(upload_dir, name), 'rb') as f:
+                    inputs.append((name, f.read()))
+    inputs.extend(synthetic_receipts(synthetic_count, seed))
+    return inputs
+
+
+def run_pipeline_stages(app, inputs, work_dir, times):
+    """Run each pipeline stage directly on every input."""
+    options = get_ocr_options(app.config)
+    with app.app_context():
+        for name, data in inputs:
+            file_path = os.path.join(work_dir, f"{uuid.uuid4().hex}.pdf")
+            with open(file_path, 'wb') as f:
+                f.write(data)
+
+            times.time('is_valid_pdf', lambda: is_valid_pdf(file_path)[0] or None)
+            text = times.time('extract_text_from_pdf', extract_text_from_pdf, file_path, options)
+            parsed = times.time('parse_receipt_text', parse_receipt_text, text) if text else None
+
+            def insert():
+                receipt_file = ReceiptFile(
+                    id=str(uuid.uuid4()), file_name=name, file_path=file_path, is_valid=True, is_processed=False
+                )
+                db.session.add(receipt_file)
+                store_receipts([(receipt_file, parsed or {})])
+                db.session.commit()
+                return True
+            times.time('db_insert', insert)
+
+
+def run_route_stages(app, inputs, times):
+    """Upload, validate and process every input through the routes, with jobs run inline."""
+    client = app.test_client()
+    for name, data in inputs:
+        # A unique trailing comment keeps deduplication from short-circuiting repeat iterations
+        data += f"\n% benchmark {uuid.uuid4().hex}\n".encode('ascii')
+
+        start = time.perf_counter()
+        response = client.post('/upload', data={'file': (io.BytesIO(data), name)})
+        times.add('route_upload', time.perf_counter() - start, ok=response.status_code == 201)
+        if response.status_code != 201:
+            continue
+        receipt_file_id = response.json['receipt_file']['id']
+
+        start = time.perf_counter()
+        response = client.post('/validate', json={'receipt_file_id': receipt_file_id})
+        times.add('route_validate', time.perf_counter() - start, ok=response.status_code == 200 and response.json['is_valid'])
+
+        start = time.perf_counter()
+        response = client.post('/process', json={'receipt_file_id': receipt_file_id})
+        ok = response.status_code == 202 and response.json['job']['status'] == 'completed'
+        times.add('route_process', time.perf_counter() - start, ok=ok)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    print(f"{'stage':<24}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          + (f"{'p95 vs base':>13}" if baseline else ''))
+    for stage, stats in results['stages'].items():
+        line = (f"{stage:<24}{stats['count']:>7}{stats['errors']:>8}{stats['p50_ms']:>10.1f}"
+                f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+        base = (baseline or {}).get('stages', {}).get(stage)
+        if base and base['p95_ms']:
+            line += f"{(stats['p95_ms'] / base['p95_ms'] - 1) * 100:>+12.1f}%"
+        print(line)
+    for mode, stats in results['throughput'].items():
+        print(f"{mode}: {stats['receipts_per_sec']:.2f} receipts/s, "
+              f"{stats['cpu_utilization'] * 100:.0f}% CPU over {stats['wall_seconds']:.1f} s")
+    print(f"peak RSS: {results['resources']['max_rss_mb']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=3, help='passes over the inputs')
+    parser.add_argument('--synthetic', type=int, default=12, help='synthetic receipts to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--uploads', default=os.path.join(REPO_DIR, 'uploads'), help='directory of sample PDFs')
+    parser.add_argument('--ocr-cache', action='store_true', help='keep the OCR cache on (off by default to time OCR)')
+    parser.add_argument('--skip-routes', action='store_true')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare p95 latency with')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='receipt-bench-')
+    try:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(work_dir, 'bench.db')}",
+            'UPLOAD_FOLDER': os.path.join(work_dir, 'uploads'),
+            'OCR_CACHE_DIR': os.path.join(work_dir, 'ocr_cache') if args.ocr_cache else None,
+            'OCR_STORE_DIR': os.path.join(work_dir, 'ocr_store'),
+            'JOBS_AUTOSTART': False,
+            'JOBS_EAGER': True
+        })
+        inputs = load_inputs(args.uploads, args.synthetic, args.seed)
+        pipeline_times = StageTimes()
+        route_times = StageTimes()
+        throughput = {}
+
+        for mode, run, times in (
+            ('pipeline', lambda: run_pipeline_stages(app, inputs, work_dir, pipeline_times), pipeline_times),
+            ('routes', lambda: run_route_stages(app, inputs, route_times), route_times),
+        ):
+            if mode == 'routes' and args.skip_routes:
+                continue
+            before = usage()
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                run()
+            wall = time.perf_counter() - start
+            cpu = usage()['cpu_seconds'] - before['cpu_seconds']
+            receipts = len(inputs) * args.iterations
+            throughput[mode] = {
+                'receipts': receipts,
+                'wall_seconds': wall,
+                'receipts_per_sec': receipts / wall if wall else None,
+                'cpu_seconds': cpu,
+                'cpu_utilization': cpu / wall if wall else None
+            }
+
+        results = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'inputs': len(inputs),
+                'iterations': args.iterations,
+                'ocr_options': get_ocr_options(app.config)
+            },
+            'stages': {**pipeline_times.summary(PIPELINE_STAGES), **route_times.summary(ROUTE_STAGES)},
+            'throughput': throughput,
+            'resources': {'max_rss_mb': usage()['max_rss_mb']}
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
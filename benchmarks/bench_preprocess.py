@@ -0,0 +1,168 @@
+"""
+Benchmark of OCR with and without page preprocessing.
+
+OCRs the distinct sample PDFs in uploads/, which are real scans, and
+synthetic receipts scanned crooked on a flatbed page, once as pages used to
+be OCR'd by default (the colour page as rendered, Tesseract's default
+segmentation and no character whitelist) and once with the preprocessing
+settings (grayscale, cropped, deskewed, scaled and binarized pages, single
+column segmentation and the receipt whitelist). Reports per page the pixels Tesseract was given
+and the time spent preprocessing and in Tesseract, and per document how many
+fields parse_receipt_text got right and how many expected strings the text
+holds, against benchmarks/sample_truth.json for the samples. Needs poppler
+and Tesseract; --preprocess-only skips Tesseract and times the preprocessing.
+
+    python benchmarks/bench_preprocess.py [--dpi 200] [--synthetic 6] [--iterations 1] [--preprocess-only]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+import pdf2image
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from synthetic import flatbed_pdf, receipt_lines  # noqa: E402
+
+from receipt_processor.ocr.engine import get_ocr_engine  # noqa: E402
+from receipt_processor.ocr.preprocess import preprocess_page  # noqa: E402
+from receipt_processor.ocr.store import text_from_words, words_from_data  # noqa: E402
+from receipt_processor.routes.utils import OCR_DEFAULTS, RECEIPT_CHARACTERS, get_ocr_options, parse_receipt_text  # noqa: E402
+
+TRUTH_PATH = os.path.join(BENCHMARKS_DIR, 'sample_truth.json')
+FIELDS = ['merchant_name', 'purchased_at', 'total_amount', 'tax_amount']
+MODES = {
+    'raw': get_ocr_options({}),
+    'preprocessed': dict(get_ocr_options({}), OCR_PREPROCESS=True, OCR_PSM=4, OCR_CHAR_WHITELIST=RECEIPT_CHARACTERS),
+}
+AMOUNT_LINE_RE = re.compile(r'^(Total|Tax) \$(\d+\.\d\d)$')
+
+
+def sample_inputs(upload_dir):
+    """(name, pdf bytes, truth) for each distinct sample PDF that has a truth entry."""
+    with open(TRUTH_PATH) as f:
+        truth = json.load(f)
+    seen = set()
+    for filename in sorted(os.listdir(upload_dir)):
+        if not filename.lower().endswith('.pdf'):
+            continue
+        with open(os.path.join(upload_dir, filename), 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in truth and digest not in seen:
+            seen.add(digest)
+            yield truth[digest]['name'], data, truth[digest]
+
+
+def synthetic_inputs(count, dpi, seed=0):
+    """(name, pdf bytes, truth) for receipts placed on a flatbed page at up to 4 degrees of skew."""
+    rng = random.Random(seed)
+    for index in range(count):
+        lines = receipt_lines(rng.randint(5, 15), rng)
+        angle = rng.uniform(-4, 4)
+        truth = {'merchant_name': lines[0], 'text': [line for line in lines[5:-1] if line]}
+        for line in lines:
+            match = AMOUNT_LINE_RE.match(line)
+            if match:
+                truth[f"{match.group(1).lower()}_amount"] = float(match.group(2))
+        yield f"flatbed-{index}-{angle:+.1f}deg", flatbed_pdf(lines, angle, dpi), truth
+
+
+def field_matches(parsed, truth):
+    """(fields parsed as in the truth, fields in the truth)."""
+    expected = [field for field in FIELDS if truth.get(field) is not None]
+    matched = 0
+    for field in expected:
+        value = parsed.get(field)
+        if value is None:
+            continue
+        if field == 'merchant_name':
+            matched += ' '.join(truth[field].lower().split()) in ' '.join(value.lower().split())
+        elif field == 'purchased_at':
+            matched += value.date().isoformat() == truth[field]
+        else:
+            matched += abs(value - truth[field]) < 0.005
+    return matched, len(expected)
+
+
+def text_matches(text, truth):
+    """(expected strings found in the text, expected strings), ignoring case and runs of whitespace."""
+    normalized = ' '.join(text.lower().split())
+    expected = truth.get('text', [])
+    return sum(' '.join(item.lower().split()) in normalized for item in expected), len(expected)
+
+
+def ocr_page(image, options, preprocess_only):
+    """OCR one rendered page as _ocr_page does, timing each step. Returns (text, pixels, preprocess s, tesseract s)."""
+    start = time.perf_counter()
+    if options['OCR_PREPROCESS']:
+        image, _ = preprocess_page(image, options)
+    prepared = time.perf_counter()
+    pixels = image.width * image.height
+    if preprocess_only:
+        return '', pixels, prepared - start, 0.0
+    data = get_ocr_engine(options).image_to_data(image)
+    return text_from_words(words_from_data(data)), pixels, prepared - start, time.perf_counter() - prepared
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--uploads', default=os.path.join(REPO_DIR, 'uploads'), help='folder of sample PDFs')
+    parser.add_argument('--dpi', type=int, default=OCR_DEFAULTS['OCR_DPI'])
+    parser.add_argument('--synthetic', type=int, default=6, help='generated flatbed scans to add')
+    parser.add_argument('--iterations', type=int, default=1, help='timed runs per page; the median is reported')
+    parser.add_argument('--preprocess-only', action='store_true', help='time preprocessing without running Tesseract')
+    args = parser.parse_args()
+
+    inputs = list(sample_inputs(args.uploads)) + list(synthetic_inputs(args.synthetic, args.dpi))
+    totals = {mode: {'pages': 0, 'pixels': 0, 'preprocess': 0.0, 'tesseract': 0.0, 'fields': [0, 0], 'text': [0, 0]}
+              for mode in MODES}
+    print(f"{'input':<28}{'mode':<14}{'pages':>6}{'Mpx/page':>10}{'prep ms':>9}{'tess ms':>9}{'fields':>8}{'text':>8}")
+    for name, data, truth in inputs:
+        for mode, options in MODES.items():
+            images = pdf2image.convert_from_bytes(data, dpi=args.dpi, grayscale=options['OCR_PREPROCESS'])
+            texts = []
+            pixels = preprocess_seconds = tesseract_seconds = 0
+            for image in images:
+                runs = [ocr_page(image, options, args.preprocess_only) for _ in range(args.iterations)]
+                texts.append(runs[0][0])
+                pixels += runs[0][1]
+                preprocess_seconds += statistics.median(run[2] for run in runs)
+                tesseract_seconds += statistics.median(run[3] for run in runs)
+                image.close()
+            text = ''.join(page_text + '\n' for page_text in texts)
+            fields = field_matches(parse_receipt_text(text), truth) if not args.preprocess_only else (0, 0)
+            found = text_matches(text, truth) if not args.preprocess_only else (0, 0)
+
+            total = totals[mode]
+            total['pages'] += len(images)
+            total['pixels'] += pixels
+            total['preprocess'] += preprocess_seconds
+            total['tesseract'] += tesseract_seconds
+            total['fields'] = [a + b for a, b in zip(total['fields'], fields)]
+            total['text'] = [a + b for a, b in zip(total['text'], found)]
+            pages = len(images)
+            print(f"{name[:27]:<28}{mode:<14}{pages:>6}{pixels / pages / 1e6:>10.2f}"
+                  f"{preprocess_seconds / pages * 1000:>9.0f}{tesseract_seconds / pages * 1000:>9.0f}"
+                  f"{'%d/%d' % fields:>8}{'%d/%d' % found:>8}")
+
+    print()
+    print(f"{'mode':<14}{'Mpx/page':>10}{'ms/page':>9}{'fields':>9}{'text':>9}")
+    for mode, total in totals.items():
+        pages = total['pages'] or 1
+        per_page = (total['preprocess'] + total['tesseract']) / pages * 1000
+        fields = total['fields'][0] / total['fields'][1] if total['fields'][1] else 0
+        found = total['text'][0] / total['text'][1] if total['text'][1] else 0
+        print(f"{mode:<14}{total['pixels'] / pages / 1e6:>10.2f}{per_page:>9.0f}{fields:>9.0%}{found:>9.0%}")
+
+
+if __name__ == '__main__':
+    main()
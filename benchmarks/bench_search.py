@@ -0,0 +1,131 @@
+"""
+Benchmark of full-text receipt search at scale.
+
+Fills a temporary SQLite database with synthetic search documents (merchant,
+receipt number, item names and receipt text) through the same incremental
+indexing path /process uses, then times a mix of queries through
+search_receipts, by relevance and by recency: rare and common item names,
+merchant fragments, prefixes, receipt numbers and multi-term queries.
+Reports indexing throughput, the index size and p50/p95/max latency per query.
+
+    python benchmarks/bench_search.py [--receipts 200000] [--items 10] [--queries 50]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from synthetic import MERCHANTS, PAYMENTS, PRODUCTS  # noqa: E402
+
+from receipt_processor import create_app, db  # noqa: E402
+from receipt_processor.search import (  # noqa: E402
+    SEARCH_SORTS, build_match_query, index_receipts, search_receipts
+)
+
+BRANDS = ['Acme', 'Golden', 'Valley', 'Organic', 'Fresh', 'Hillside', 'Northern', 'Family', 'Prime', 'Urban']
+SIZES = ['Small', 'Large', '500g', '1kg', '1L', '2L', '6pk', '12oz']
+CITIES = ['Springfield', 'Riverton', 'Lakeside', 'Fairview', 'Greenville', 'Kingston']
+INSERT_BATCH_SIZE = 2000
+
+
+def product_names(rng, count):
+    """A catalogue of distinct product names, so item frequencies follow a long tail like real receipts."""
+    names = set()
+    while len(names) < count:
+        names.add(f"{rng.choice(BRANDS)} {rng.choice(PRODUCTS)} {rng.choice(SIZES)} {rng.randint(1, 999)}")
+    return sorted(names)
+
+
+def documents(count, items_per_receipt, rng):
+    catalogue = product_names(rng, 20000)
+    merchants = [f"{merchant} {city}" for merchant in MERCHANTS for city in CITIES] + [
+        f"STORE {number}" for number in range(500)
+    ]
+    for index in range(count):
+        merchant = rng.choice(merchants)
+        # Zipf-like popularity: a few products appear on many receipts, most on few
+        items = [{'item_name': catalogue[min(int(rng.paretovariate(1.1)) - 1, len(catalogue) - 1) * 7 % len(catalogue)]}
+                 for _ in range(items_per_receipt)]
+        receipt_number = f"A-{index:08d}"
+        text = '\n'.join([merchant, f"{rng.randint(1, 999)} Main Street, {rng.choice(CITIES)}", f"Receipt #{receipt_number}"]
+                         + [f"{item['item_name']} ${rng.uniform(0.5, 30):.2f}" for item in items]
+                         + [f"Total ${rng.uniform(5, 300):.2f}", f"Paid by {rng.choice(PAYMENTS)}"])
+        yield str(uuid.uuid4()), {'merchant_name': merchant, 'receipt_number': receipt_number, 'items': items, 'text': text}
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(len(sorted_values) * q / 100), len(sorted_values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--receipts', type=int, default=200000)
+    parser.add_argument('--items', type=int, default=10, help='items per receipt')
+    parser.add_argument('--queries', type=int, default=50, help='timed runs of each query')
+    parser.add_argument('--limit', type=int, default=20, help='results per page')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='receipt-search-bench-')
+    try:
+        database = os.path.join(work_dir, 'search.db')
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{database}",
+            'UPLOAD_FOLDER': os.path.join(work_dir, 'uploads'),
+            'JOBS_AUTOSTART': False
+        })
+        with app.app_context():
+            start = time.perf_counter()
+            batch = []
+            for entry in documents(args.receipts, args.items, rng):
+                batch.append(entry)
+                if len(batch) == INSERT_BATCH_SIZE:
+                    index_receipts(batch)
+                    db.session.commit()
+                    batch = []
+            index_receipts(batch)
+            db.session.commit()
+            index_seconds = time.perf_counter() - start
+            print(f"indexed {args.receipts} receipts / {args.receipts * args.items} items in {index_seconds:.1f} s "
+                  f"({args.receipts / index_seconds:.0f} receipts/s), database {os.path.getsize(database) / 1024 ** 2:.0f} MB")
+
+            sample_items = [entry[1]['items'][0]['item_name'] for entry in documents(50, 1, random.Random(args.seed + 1))]
+            queries = {
+                'common item': sample_items[0].split()[1],
+                'item name': ' '.join(sample_items[1].split()[:3]),
+                'exact item': sample_items[2],
+                'merchant fragment': 'blue bott',
+                'short prefix': 'gr',
+                'receipt number': f"A-{args.receipts // 2:08d}",
+                'two terms': f"{sample_items[3].split()[0]} {CITIES[2]}",
+                'no match': 'zzyzx',
+            }
+            rank_window = app.config['SEARCH_RANK_WINDOW']
+            print(f"{'query':<20}{'q':<30}{'sort':<11}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+            for label, query in queries.items():
+                match = build_match_query(query)
+                for sort in SEARCH_SORTS:
+                    search_receipts(match, args.limit, sort=sort, rank_window=rank_window)  # warm the page cache
+                    samples = []
+                    for _ in range(args.queries):
+                        start = time.perf_counter()
+                        search_receipts(match, args.limit, sort=sort, rank_window=rank_window)
+                        samples.append(time.perf_counter() - start)
+                    samples.sort()
+                    print(f"{label:<20}{query[:28]:<30}{sort:<11}{percentile(samples, 50) * 1000:>9.2f}"
+                          f"{percentile(samples, 95) * 1000:>9.2f}{samples[-1] * 1000:>9.2f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
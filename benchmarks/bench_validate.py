@@ -0,0 +1,107 @@
+"""
+Benchmark of PDF validation by file size and page count.
+
+Times the fast structural tier of is_valid_pdf, a full in-process PyPDF2
+parse (what validation used to do) and the deep tier, a full parse in a child
+process, over generated PDFs from one page to thousands and up to hundreds of
+megabytes. Exits non-zero if the fast tier takes longer than the limit on any
+file whose structure it follows, or if it accepts or rejects a file the deep
+tier does not.
+
+    python benchmarks/bench_validate.py [--iterations 20] [--limit-ms 10] [--padding-mb 200]
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import PyPDF2
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from synthetic import text_pdf  # noqa: E402
+
+from receipt_processor.validation import (  # noqa: E402
+    VALIDATION_DEEP, VALIDATION_DEFAULTS, VALIDATION_FAST, is_valid_pdf
+)
+
+
+def padded_pdf(pdf, padding):
+    """Insert a comment of padding bytes before the cross-reference table, as a large scan is mostly image data."""
+    body, rest = pdf.split(b'xref\n', 1)
+    comment = b'%' + b'x' * padding + b'\n'
+    rest = re.sub(rb'startxref\n\d+', b'startxref\n%d' % (len(body) + len(comment)), rest)
+    return body + comment + b'xref\n' + rest
+
+
+def inputs(padding_mb):
+    """Yield (name, data, whether the fast tier follows its structure rather than falling through to a full parse)."""
+    page = [f"Item {line} $1.00" for line in range(30)]
+    one_page = text_pdf([page])
+    yield '1 page', one_page, True
+    # PyPDF2 finds the end-of-file marker however far from the end it is
+    yield '1 page + 2000 spaces', one_page + b' ' * 2000, False
+    yield '500 pages', text_pdf([page] * 500), True
+    yield '5000 pages', text_pdf([page] * 5000), True
+    large = padded_pdf(one_page, padding_mb * 1024 * 1024)
+    yield f"{padding_mb} MB", large, True
+    yield f"{padding_mb} MB truncated", large[:len(large) // 2], False
+
+
+def best_ms(func, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def pypdf2_page_count(path):
+    try:
+        return len(PyPDF2.PdfReader(path).pages)
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20, help='timed runs of the fast tier per input')
+    parser.add_argument('--limit-ms', type=float, default=10.0, help='bound on the fast tier per input')
+    parser.add_argument('--padding-mb', type=int, default=200, help='size of the large input')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='receipt-validate-bench-')
+    failures = 0
+    try:
+        print(f"{'input':<22}{'size MB':>9}{'result':>9}{'fast ms':>10}{'PyPDF2 ms':>11}{'deep ms':>10}")
+        for name, data, follows in inputs(args.padding_mb):
+            path = os.path.join(work_dir, 'input.pdf')
+            with open(path, 'wb') as f:
+                f.write(data)
+            result = is_valid_pdf(path, VALIDATION_FAST, VALIDATION_DEFAULTS)
+            fast_ms = best_ms(lambda: is_valid_pdf(path, VALIDATION_FAST, VALIDATION_DEFAULTS), args.iterations)
+            pypdf2_ms = best_ms(lambda: pypdf2_page_count(path), 1)
+            deep_ms = best_ms(lambda: is_valid_pdf(path, VALIDATION_DEEP, VALIDATION_DEFAULTS), 1)
+            if result[0] != is_valid_pdf(path, VALIDATION_DEEP, VALIDATION_DEFAULTS)[0]:
+                status = 'MISMATCH'
+            else:
+                status = 'ok' if fast_ms <= args.limit_ms or not follows else 'TOO SLOW'
+            failures += status != 'ok'
+            print(f"{name:<22}{len(data) / 1024 ** 2:>9.1f}{'valid' if result[0] else 'invalid':>9}"
+                  f"{fast_ms:>10.2f}{pypdf2_ms:>11.1f}{deep_ms:>10.1f}  {status}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failures:
+        print(f"{failures} inputs exceeded {args.limit_ms} ms in the fast tier or disagreed with the deep tier")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Concurrency check for the database setup: several processes, like gunicorn
+workers, start the app against one database at the same time and then upload,
+validate, queue and list receipts as fast as they can.
+
+Every process runs the startup migrations concurrently, and every request
+writes, so lock contention shows up as failed requests ("database is locked"
+on SQLite). The check passes when no request fails. By default it uses a fresh
+SQLite database in a temporary directory, so it runs offline; pass
+--database-url to check a server database instead.
+
+    python benchmarks/check_concurrency.py [--processes 8] [--requests 50] [--journal-mode WAL]
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from synthetic import text_pdf  # noqa: E402
+
+
+def worker(index, config, requests, start_event, results):
+    from receipt_processor import create_app
+
+    start_event.wait()
+    try:
+        app = create_app(config)
+    except Exception as e:
+        results.put({'worker': index, 'startup_error': repr(e), 'failures': {}, 'latencies': []})
+        return
+
+    client = app.test_client()
+    failures = {}
+    latencies = []
+
+    def call(name, method, url, expected, **kwargs):
+        start = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code not in expected:
+            failures[name] = failures.get(name, 0) + 1
+        return response
+
+    pdf = text_pdf([['CONCURRENCY CHECK', f"Worker {index}", 'Total $1.00']])
+    for _ in range(requests):
+        # Unique content so every upload inserts a new row
+        data = pdf + f"\n% {uuid.uuid4().hex}\n".encode('ascii')
+        response = call('upload', 'post', '/upload', (201,), data={'file': (io.BytesIO(data), 'receipt.pdf')})
+        if response.status_code != 201:
+            continue
+        receipt_file_id = response.json['receipt_file']['id']
+        call('validate', 'post', '/validate', (200,), json={'receipt_file_id': receipt_file_id})
+        call('process', 'post', '/process', (202,), json={'receipt_file_id': receipt_file_id})
+        call('list', 'get', '/receipt-files?limit=20', (200,))
+
+    results.put({'worker': index, 'startup_error': None, 'failures': failures, 'latencies': latencies})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8, help='concurrent app processes')
+    parser.add_argument('--requests', type=int, default=50, help='upload/validate/process/list rounds per process')
+    parser.add_argument('--database-url', help='database to check instead of a temporary SQLite file')
+    parser.add_argument('--journal-mode', default='WAL', help='SQLite journal mode, e.g. DELETE to compare with the old default')
+    parser.add_argument('--busy-timeout', type=float, default=30, help='seconds SQLite writers wait for the lock')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='receipt-concurrency-')
+    try:
+        config = {
+            'SQLALCHEMY_DATABASE_URI': args.database_url or f"sqlite:///{os.path.join(work_dir, 'receipts.db')}",
+            'UPLOAD_FOLDER': os.path.join(work_dir, 'uploads'),
+            'SQLITE_JOURNAL_MODE': args.journal_mode,
+            'DB_BUSY_TIMEOUT': args.busy_timeout,
+            'JOBS_AUTOSTART': False
+        }
+        context = multiprocessing.get_context('spawn')
+        start_event = context.Event()
+        results = context.Queue()
+        processes = [
+            context.Process(target=worker, args=(index, config, args.requests, start_event, results))
+            for index in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+
+        start = time.perf_counter()
+        start_event.set()
+        reports = [results.get() for _ in processes]
+        wall = time.perf_counter() - start
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    startup_errors = [report for report in reports if report['startup_error']]
+    failures = {}
+    for report in reports:
+        for name, count in report['failures'].items():
+            failures[name] = failures.get(name, 0) + count
+    latencies = sorted(latency for report in reports for latency in report['latencies'])
+
+    print(f"{args.processes} processes, {len(latencies)} requests in {wall:.1f} s "
+          f"({len(latencies) / wall:.0f} requests/s)")
+    if latencies:
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+              f"p95 {p95 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    for report in startup_errors:
+        print(f"worker {report['worker']} failed to start: {report['startup_error']}")
+    for name, count in sorted(failures.items()):
+        print(f"failed {name} requests: {count}")
+
+    if startup_errors or failures:
+        sys.exit(1)
+    print('OK: no failed requests')
+
+
+if __name__ == '__main__':
+    main()
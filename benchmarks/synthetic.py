@@ -0,0 +1,149 @@
+"""Synthetic receipt PDFs for the benchmarks: digital ones with a text layer and scanned, image-only ones."""
+import io
+import random
+
+MERCHANTS = ['CORNER MARKET', 'ACME SUPERMARKET', 'GREEN GROCER', 'CITY PHARMACY', 'BLUE BOTTLE CAFE']
+PRODUCTS = ['Whole Milk', 'Bread', 'Bananas', 'Coffee Beans', 'Eggs', 'Butter', 'Orange Juice', 'Pasta',
+            'Tomatoes', 'Cheddar', 'Rice', 'Apples', 'Yogurt', 'Chicken Breast', 'Olive Oil']
+PAYMENTS = ['VISA', 'MASTERCARD', 'CASH', 'DEBIT']
+
+PAGE_WIDTH = 226   # points, an 80 mm till roll
+LINE_HEIGHT = 10
+MARGIN = 20
+
+
+def receipt_lines(items, rng):
+    """Text lines of a receipt with the given number of items."""
+    lines = [
+        rng.choice(MERCHANTS),
+        f"{rng.randint(1, 999)} Main Street, Springfield",
+        f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2019, 2025)} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}",
+        f"Receipt #A-{rng.randint(10000, 99999)}",
+        ''
+    ]
+    subtotal = 0.0
+    for _ in range(items):
+        quantity = rng.randint(1, 3)
+        price = round(rng.uniform(0.5, 25) * quantity, 2)
+        subtotal += price
+        name = rng.choice(PRODUCTS)
+        lines.append(f"{quantity} x {name} ${price:.2f}" if quantity > 1 else f"{name} ${price:.2f}")
+    tax = round(subtotal * 0.08, 2)
+    lines += [
+        '',
+        f"Subtotal ${subtotal:.2f}",
+        f"Tax ${tax:.2f}",
+        f"Total ${subtotal + tax:.2f}",
+        f"Paid by {rng.choice(PAYMENTS)}",
+        'Thank you for shopping!'
+    ]
+    return lines
+
+
+def paginate_lines(lines, pages):
+    per_page = -(-len(lines) // pages)
+    return [lines[start:start + per_page] for start in range(0, len(lines), per_page)] or [[]]
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def text_pdf(page_lines):
+    """Build a PDF whose pages carry the given lines as a text layer."""
+    objects = []
+    page_ids = []
+    for lines in page_lines:
+        height = MARGIN * 2 + LINE_HEIGHT * max(len(lines), 1)
+        operators = [f"BT /F1 8 Tf {LINE_HEIGHT} TL {MARGIN // 2} {height - MARGIN} Td"]
+        operators += [f"({_escape(line)}) Tj T*" for line in lines]
+        operators.append('ET')
+        stream = '\n'.join(operators).encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects) + 3
+        objects.append((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {height}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode('latin-1'))
+        page_ids.append(len(objects) + 3)
+
+    kids = ' '.join(f"{page_id} 0 R" for page_id in page_ids)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode('latin-1'),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>"
+    ] + objects
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def receipt_image(lines, dpi=200):
+    """Render lines as a grayscale image of a till roll at the given resolution."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    scale = dpi / 72
+    try:
+        font = ImageFont.load_default(size=int(8 * scale))
+    except TypeError:  # Pillow < 10.1 has a single fixed-size default font
+        font = ImageFont.load_default()
+    height = MARGIN * 2 + LINE_HEIGHT * max(len(lines), 1)
+    image = Image.new('L', (int(PAGE_WIDTH * scale), int(height * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    for index, line in enumerate(lines):
+        draw.text((MARGIN // 2 * scale, (MARGIN + index * LINE_HEIGHT) * scale), line, fill=0, font=font)
+    return image
+
+
+def _images_pdf(images, dpi):
+    out = io.BytesIO()
+    images[0].save(out, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+    return out.getvalue()
+
+
+def scanned_pdf(page_lines, dpi=200):
+    """Build an image-only PDF of the given lines, like a scanner without OCR produces."""
+    return _images_pdf([receipt_image(lines, dpi) for lines in page_lines], dpi)
+
+
+def flatbed_pdf(lines, angle, dpi=200, background=235):
+    """
+    Build an image-only PDF of a receipt laid crooked on a US Letter flatbed:
+    the strip is rotated by angle degrees and placed off centre on a page of
+    slightly grey margins, with a dark band along one edge where the lid did
+    not meet the glass.
+    """
+    from PIL import Image, ImageDraw
+
+    strip = receipt_image(lines, dpi).convert('LA')
+    strip = strip.rotate(angle, Image.BICUBIC, expand=True)
+    page = Image.new('L', (int(8.5 * dpi), max(int(11 * dpi), strip.height + dpi)), background)
+    ImageDraw.Draw(page).rectangle((0, 0, page.width, dpi // 8), fill=40)
+    page.paste(strip.convert('L'), (dpi, dpi // 2), strip.getchannel('A'))
+    return _images_pdf([page], dpi)
+
+
+def synthetic_receipts(count, seed=0):
+    """
+    Yield (name, pdf bytes) for count receipts of varying item and page counts,
+    alternating between digital and scanned receipts.
+    """
+    rng = random.Random(seed)
+    for index in range(count):
+        items = rng.choice([5, 15, 40, 120])
+        pages = rng.choice([1, 1, 2, 4])
+        page_lines = paginate_lines(receipt_lines(items, rng), pages)
+        if index % 2 == 0:
+            yield f"synthetic-text-{index}-{items}items-{len(page_lines)}p.pdf", text_pdf(page_lines)
+        else:
+            yield f"synthetic-scan-{index}-{items}items-{len(page_lines)}p.pdf", scanned_pdf(page_lines)
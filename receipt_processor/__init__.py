@@ -1,30 +1,85 @@
 import os
-from flask import Flask
+from flask import Flask, Request, current_app
 from flask_sqlalchemy import SQLAlchemy
 
+from receipt_processor.database import DATABASE_DEFAULTS, configure_engine, database_uri, engine_options
+
 db = SQLAlchemy()
 
-def create_app():
+class ReceiptRequest(Request):
+    """Request that streams uploaded files into the upload folder and allows larger bodies on upload endpoints."""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'receipt.upload_receipts_batch':
+            return current_app.config['BATCH_MAX_CONTENT_LENGTH']
+        if self.endpoint == 'receipt.upload_receipt':
+            return current_app.config['UPLOAD_MAX_CONTENT_LENGTH']
+        return current_app.config['MAX_CONTENT_LENGTH']
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Write each file part to a temporary file next to its final path while hashing it,
+        # instead of spooling it elsewhere and copying it into the upload folder
+        from receipt_processor.routes.utils import UploadFile
+        upload = UploadFile(current_app.config['UPLOAD_FOLDER'])
+        self.__dict__.setdefault('_uploads', []).append(upload)
+        return upload
+
+    def close(self):
+        super().close()
+        # Also removes parts left behind when parsing the body failed part way
+        for upload in self.__dict__.get('_uploads', ()):
+            upload.close()
+
+def create_app(config=None):
     app = Flask(__name__)
+    app.request_class = ReceiptRequest
     
     # Config
     app.config['UPLOAD_FOLDER'] = 'uploads'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///receipts.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
+    app.config['UPLOAD_MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024  # 256MB per /upload request and file in a batch
+    app.config['BATCH_MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024  # 512MB per batch upload request, and extracted from its zip archives
+    app.config['BATCH_MAX_FILES'] = 500
+    app.config['SEARCH_RANK_WINDOW'] = 1000  # most recent matches ranked by relevance per /search query
+    app.config['RESPONSE_CACHE_MAX_BYTES'] = 32 * 1024 * 1024  # serialized receipt and receipt file responses kept per process
+    app.config['AUTO_MIGRATE'] = True  # apply pending migrations on startup
+    app.config.update(DATABASE_DEFAULTS)
+
+    # Overrides from RECEIPTS_* environment variables, then from scripts, benchmarks and deployments
+    app.config.from_prefixed_env('RECEIPTS')
+    if config:
+        app.config.update(config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
 
     # Ensure upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
     # Initialize extensions
     db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config)
 
     # Import and register blueprints
     from receipt_processor.routes.receipt import receipt_bp
     app.register_blueprint(receipt_bp)
 
-    # Create tables
-    with app.app_context():
-        db.create_all()
+    # Count database queries per request and job for /metrics and profiling
+    from receipt_processor import metrics
+    metrics.init_app(app)
+
+    # Apply pending schema migrations; with AUTO_MIGRATE off, run `flask receipts migrate` on deploy
+    from receipt_processor.cli import receipts_cli
+    from receipt_processor.migrations import run_migrations
+    app.cli.add_command(receipts_cli)
+    if app.config['AUTO_MIGRATE']:
+        with app.app_context():
+            run_migrations()
+
+    # Start draining the processing job queue
+    from receipt_processor.jobs import job_queue
+    job_queue.init_app(app)
 
     return app
\ No newline at end of file
@@ -0,0 +1,405 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from receipt_processor import db
+from receipt_processor.migrations import MIGRATIONS, applied_migrations, run_migrations
+from receipt_processor.models.receipt import Receipt, ReceiptFile, ReceiptItem
+from receipt_processor.pipeline import (
+    load_stored_text, receipt_fields, reprocess_file, store_receipts, update_receipts
+)
+from receipt_processor.routes.utils import get_ocr_options, parse_receipt_texts
+from receipt_processor.stats import rebuild_rollups
+from receipt_processor.validation import validation_options
+
+receipts_cli = AppGroup('receipts', help='Receipt processor maintenance commands.')
+
+CHECKPOINT_NAME = 'reprocess-checkpoint.json'
+STATUS_FILTERS = ('all', 'processed', 'unprocessed')
+ITEM_FIELDS = ('item_name', 'quantity', 'unit_price', 'total_price')
+
+
+@receipts_cli.command('migrate')
+def migrate_command():
+    """Apply pending database migrations."""
+    applied = run_migrations()
+    if applied:
+        click.echo(f"Applied migrations {', '.join(str(version) for version in applied)}")
+    else:
+        click.echo('Database is up to date')
+
+
+@receipts_cli.command('migrations')
+def migrations_command():
+    """List migrations and whether each has been applied."""
+    done = applied_migrations()
+    for version, name, _ in MIGRATIONS:
+        applied_at = done.get(version)
+        status = f"applied {applied_at.isoformat()}" if applied_at else 'pending'
+        click.echo(f"{version:>4}  {status:<36}  {name}")
+
+
+@receipts_cli.command('reparse')
+@click.option('--batch-size', default=500, show_default=True, help='Receipts parsed and committed together.')
+def reparse_command(batch_size):
+    """Rerun extraction for every receipt from its stored text, without OCR."""
+    query = db.session.query(Receipt, ReceiptFile).join(ReceiptFile, Receipt.receipt_file_id == ReceiptFile.id)
+    query = query.filter(ReceiptFile.ocr_path.isnot(None))
+    total = query.count()
+    reparsed = skipped = 0
+    position = None
+    while True:
+        batch_query = query
+        if position is not None:
+            batch_query = batch_query.filter(db.tuple_(Receipt.created_at, Receipt.id) > db.tuple_(*position))
+        batch = batch_query.order_by(Receipt.created_at, Receipt.id).limit(batch_size).all()
+        if not batch:
+            break
+        position = (batch[-1][0].created_at, batch[-1][0].id)
+
+        stored = [(receipt, load_stored_text(receipt_file)) for receipt, receipt_file in batch]
+        stored = [(receipt, text) for receipt, text in stored if text]
+        skipped += len(batch) - len(stored)
+        results = parse_receipt_texts([text for _, text in stored])
+        update_receipts([(receipt, dict(parsed, text=text)) for (receipt, text), parsed in zip(stored, results)])
+        db.session.commit()
+        db.session.expunge_all()
+
+        reparsed += len(stored)
+        click.echo(f"Reparsed {reparsed} of {total} receipts")
+    if skipped:
+        click.echo(f"Skipped {skipped} receipts whose stored text is missing or unreadable")
+
+
+@receipts_cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the /stats rollups from the stored receipts."""
+    receipts = rebuild_rollups()
+    db.session.commit()
+    click.echo(f"Rebuilt rollups over {receipts} receipts")
+
+
+def _reprocess_query(since, until, merchant, status, file_ids):
+    query = db.session.query(ReceiptFile)
+    if since:
+        query = query.filter(ReceiptFile.created_at >= since)
+    if until:
+        query = query.filter(ReceiptFile.created_at < until)
+    if file_ids:
+        query = query.filter(ReceiptFile.id.in_(file_ids))
+    if merchant:
+        query = query.filter(ReceiptFile.id.in_(
+            db.session.query(Receipt.receipt_file_id).filter(Receipt.merchant_name.ilike(f"%{merchant}%"))
+        ))
+    if status == 'processed':
+        query = query.filter(ReceiptFile.is_processed.is_(True))
+    elif status == 'unprocessed':
+        query = query.filter(db.or_(ReceiptFile.is_processed.is_(False), ReceiptFile.is_processed.is_(None)))
+    return query
+
+
+def _load_checkpoint(path, filters):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['position'] is not None and checkpoint['filters'] != filters:
+        raise click.ClickException(
+            f"{path} belongs to a run with other filters ({checkpoint['filters']}); pass --restart to discard it"
+        )
+    return checkpoint
+
+
+def _save_checkpoint(path, checkpoint):
+    """Write the checkpoint atomically, so an interrupted run never leaves half a file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+
+def _item_tuples(items):
+    return [tuple(item.get(field) for field in ITEM_FIELDS) for item in items]
+
+
+def _display(value):
+    return value.isoformat() if isinstance(value, datetime) else repr(value)
+
+
+def _receipt_changes(receipt, items, parsed):
+    """(field, old, new) for every stored value the new parse would change."""
+    changes = [
+        (field, getattr(receipt, field), value)
+        for field, value in receipt_fields(parsed).items()
+        if getattr(receipt, field) != value
+    ]
+    old_items = _item_tuples([item.to_dict() for item in items])
+    new_items = _item_tuples(parsed.get('items', []))
+    if old_items != new_items:
+        changes.append(('items', len(old_items), len(new_items)))
+    return changes
+
+
+def _store_reprocessed(batch, outcomes, dry_run, changed_fields):
+    """
+    Write the outcomes of a batch of receipt files in one transaction: record
+    validity, update the receipts of files that have one and store new ones
+    for the rest. In a dry run, print what would change instead.
+    Returns (processed, invalid, failed) counts.
+    """
+    receipts = {
+        receipt.receipt_file_id: receipt
+        for receipt in Receipt.query.filter(Receipt.receipt_file_id.in_([receipt_file.id for receipt_file in batch]))
+    }
+    items = {}
+    if dry_run and receipts:
+        for item in ReceiptItem.query.filter(ReceiptItem.receipt_id.in_([r.id for r in receipts.values()])):
+            items.setdefault(item.receipt_id, []).append(item)
+
+    to_update, to_store = [], []
+    processed = invalid = failed = 0
+    for receipt_file, (outcome, error) in zip(batch, outcomes):
+        if error is not None:
+            failed += 1
+            click.echo(f"Failed {receipt_file.id} ({receipt_file.file_name}): {error}", err=True)
+            continue
+        if not dry_run:
+            receipt_file.is_valid = outcome['is_valid']
+            receipt_file.invalid_reason = outcome['invalid_reason']
+        if not outcome['is_valid']:
+            invalid += 1
+            click.echo(f"Invalid {receipt_file.id} ({receipt_file.file_name}): {outcome['invalid_reason']}", err=True)
+            continue
+        processed += 1
+        result = outcome['result']
+        parsed = dict(result['parsed'], timings=result['timings'], text=result['text'])
+        receipt = receipts.get(receipt_file.id)
+        if dry_run:
+            changes = _receipt_changes(receipt, items.get(receipt.id, []), parsed) if receipt else [('receipt', None, 'new')]
+            if changes:
+                click.echo(f"{receipt_file.id} ({receipt_file.file_name})")
+            for field, old, new in changes:
+                changed_fields[field] += 1
+                click.echo(f"  {field}: {_display(old)} -> {_display(new)}")
+            continue
+        if result.get('ocr_path'):
+            receipt_file.ocr_path = result['ocr_path']
+        if receipt is not None:
+            to_update.append((receipt, parsed))
+        else:
+            to_store.append((receipt_file, parsed))
+
+    if not dry_run:
+        update_receipts(to_update)
+        store_receipts(to_store)
+        db.session.commit()
+    db.session.expunge_all()
+    return processed, invalid, failed
+
+
+def _format_duration(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+
+@receipts_cli.command('reprocess')
+@click.option('--since', type=click.DateTime(), help='Only files uploaded at or after this time.')
+@click.option('--until', type=click.DateTime(), help='Only files uploaded before this time.')
+@click.option('--merchant', help='Only files whose receipt merchant name contains this text.')
+@click.option('--status', type=click.Choice(STATUS_FILTERS), default='all', show_default=True,
+              help='Only files that have or have not been processed.')
+@click.option('--file-id', 'file_ids', multiple=True, help='Only these receipt files; repeatable.')
+@click.option('--workers', type=int, help='Worker processes for validation, OCR and parsing.  [default: OCR_WORKERS]')
+@click.option('--batch-size', default=100, show_default=True, help='Files written and checkpointed together.')
+@click.option('--ocr-cache/--no-ocr-cache', default=True, show_default=True,
+              help='Serve pages OCR\'d before with the same settings from the OCR cache.')
+@click.option('--checkpoint', 'checkpoint_path', type=click.Path(dir_okay=False),
+              help=f"Progress file for resuming.  [default: {CHECKPOINT_NAME} in the instance folder]")
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an earlier run and start over.')
+@click.option('--dry-run', is_flag=True,
+              help='Print how receipts would change without updating them; newly OCR\'d pages still go to the OCR cache.')
+def reprocess_command(since, until, merchant, status, file_ids, workers, batch_size, ocr_cache,
+                      checkpoint_path, restart, dry_run):
+    """
+    Validate, OCR and parse receipt files again and update their receipts.
+
+    Files are taken in upload order across a pool of worker processes. After
+    each batch is written, the position is saved to a checkpoint, so an
+    interrupted run picks up where it stopped when run again with the same
+    filters. Files that already have a receipt are updated in place; the
+    others get a new one.
+    """
+    filters = {
+        'since': since.isoformat() if since else None,
+        'until': until.isoformat() if until else None,
+        'merchant': merchant,
+        'status': status,
+        'file_ids': sorted(file_ids),
+    }
+    checkpoint_path = checkpoint_path or os.path.join(current_app.instance_path, CHECKPOINT_NAME)
+    checkpoint = None if restart or dry_run else _load_checkpoint(checkpoint_path, filters)
+    if checkpoint is None or checkpoint['position'] is None:
+        # No earlier run, or it finished
+        checkpoint = {'filters': filters, 'position': None, 'processed': 0, 'invalid': 0, 'failed': 0}
+    else:
+        click.echo(f"Resuming after {checkpoint['processed'] + checkpoint['invalid'] + checkpoint['failed']} files "
+                   f"from {checkpoint_path}")
+
+    query = _reprocess_query(since, until, merchant, status, file_ids)
+    if checkpoint['position']:
+        created_at, file_id = checkpoint['position']
+        query = query.filter(
+            db.tuple_(ReceiptFile.created_at, ReceiptFile.id) > db.tuple_(datetime.fromisoformat(created_at), file_id)
+        )
+    query = query.order_by(ReceiptFile.created_at, ReceiptFile.id)
+    total = query.count()
+    if not total:
+        click.echo('No receipt files to reprocess')
+        return
+
+    workers = max(1, workers or current_app.config['OCR_WORKERS'])
+    ocr_options = get_ocr_options(dict(current_app.config, OCR_WORKERS=workers))
+    if not ocr_cache:
+        ocr_options['OCR_CACHE_DIR'] = None
+    if dry_run:
+        # Stored pages are only referenced by the receipt files a real run updates
+        ocr_options['OCR_STORE_DIR'] = None
+    validation_settings = validation_options()
+    changed_fields = Counter()
+    done = 0
+    started = time.monotonic()
+
+    def batches():
+        position = None
+        while True:
+            batch_query = query
+            if position is not None:
+                batch_query = batch_query.filter(db.tuple_(ReceiptFile.created_at, ReceiptFile.id) > db.tuple_(*position))
+            batch = batch_query.limit(batch_size).all()
+            if not batch:
+                return
+            position = (batch[-1].created_at, batch[-1].id)
+            yield batch
+
+    def create_executor():
+        # Workers are spawned rather than forked, as for the job queue
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    pool = {'executor': create_executor()}
+
+    def replace_pool(broken):
+        # Every future in flight sees a worker's death; only the first to notice replaces the pool
+        if pool['executor'] is broken:
+            broken.shutdown(wait=False)
+            pool['executor'] = create_executor()
+
+    def submit_file(args):
+        """Submit one file to the pool, replacing the pool if it has broken. Returns (executor, future)."""
+        executor = pool['executor']
+        try:
+            return executor, executor.submit(reprocess_file, *args)
+        except BrokenProcessPool:
+            replace_pool(executor)
+            return pool['executor'], pool['executor'].submit(reprocess_file, *args)
+
+    def submit(batch):
+        calls = [
+            (receipt_file.file_path, ocr_options, validation_settings, receipt_file.content_hash)
+            for receipt_file in batch
+        ]
+        position = [batch[-1].created_at.isoformat(), batch[-1].id]
+        return [receipt_file.id for receipt_file in batch], calls, [submit_file(args) for args in calls], position
+
+    def settle(submitted):
+        """
+        Wait for a submitted batch. A worker that dies (for example out of
+        memory) takes every file in the pool down with it, this batch's and the
+        next one's; those files are run once more in a fresh pool, and a file
+        that breaks the pool again is counted as failed.
+        """
+        file_ids, calls, running, position = submitted
+        for retry in (True, False):
+            wait([future for _, future in running])
+            broken = [
+                index for index, (_, future) in enumerate(running) if isinstance(future.exception(), BrokenProcessPool)
+            ]
+            if not broken or not retry:
+                break
+            for index in broken:
+                replace_pool(running[index][0])
+                running[index] = submit_file(calls[index])
+        return file_ids, [future for _, future in running], position
+
+    def outcome(future):
+        error = future.exception()
+        return (None, error) if error is not None else (future.result(), None)
+
+    click.echo(f"Reprocessing {total} receipt files with {workers} workers{' (dry run)' if dry_run else ''}")
+    try:
+        pending = deque()
+        for batch in batches():
+            # Keep the next batch running in the pool while the previous one is written
+            pending.append(submit(batch))
+            if len(pending) < 2:
+                continue
+            done += _finish_batch(settle(pending.popleft()), outcome, dry_run, changed_fields, checkpoint,
+                                  checkpoint_path)
+            _report_progress(done, total, started)
+        while pending:
+            done += _finish_batch(settle(pending.popleft()), outcome, dry_run, changed_fields, checkpoint,
+                                  checkpoint_path)
+            _report_progress(done, total, started)
+    finally:
+        pool['executor'].shutdown(wait=False, cancel_futures=True)
+
+    if dry_run:
+        click.echo('Dry run; no receipts were updated. Receipts that would change, by field:')
+        for field, count in changed_fields.most_common():
+            click.echo(f"  {field:<16} {count}")
+        if not changed_fields:
+            click.echo('  none')
+        return
+    checkpoint['position'] = None
+    _save_checkpoint(checkpoint_path, checkpoint)
+    click.echo(f"Done: {checkpoint['processed']} reprocessed, {checkpoint['invalid']} invalid, "
+               f"{checkpoint['failed']} failed")
+    if checkpoint['failed']:
+        click.echo('Rerun failed files with --file-id once their cause is fixed')
+
+
+def _finish_batch(settled, outcome, dry_run, changed_fields, checkpoint, checkpoint_path):
+    file_ids, futures, position = settled
+    # Writing the previous batch cleared the session the files were loaded in
+    receipt_files = {receipt_file.id: receipt_file for receipt_file in ReceiptFile.query.filter(ReceiptFile.id.in_(file_ids))}
+    batch, outcomes = [], []
+    for file_id, future in zip(file_ids, futures):
+        if file_id in receipt_files:  # deleted while it was being processed
+            batch.append(receipt_files[file_id])
+            outcomes.append(outcome(future))
+    processed, invalid, failed = _store_reprocessed(batch, outcomes, dry_run, changed_fields)
+    if not dry_run:
+        checkpoint['position'] = position
+        checkpoint['processed'] += processed
+        checkpoint['invalid'] += invalid
+        checkpoint['failed'] += failed
+        _save_checkpoint(checkpoint_path, checkpoint)
+    return len(file_ids)
+
+
+def _report_progress(done, total, started):
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed else 0
+    eta = _format_duration((total - done) / rate) if rate else 'unknown'
+    click.echo(f"{done}/{total} files ({done / total:.1%}), {rate:.2f} files/s, "
+               f"elapsed {_format_duration(elapsed)}, ETA {eta}")
@@ -0,0 +1,66 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URI = 'sqlite:///receipts.db'
+
+# Database settings read from the Flask config
+DATABASE_DEFAULTS = {
+    'DB_POOL_SIZE': 10,  # connections kept open per process (server databases)
+    'DB_MAX_OVERFLOW': 20,  # extra connections allowed under bursts
+    'DB_POOL_TIMEOUT': 30,  # seconds to wait for a free connection
+    'DB_POOL_RECYCLE': 1800,  # seconds before a connection is replaced, ahead of server-side idle timeouts
+    'DB_BUSY_TIMEOUT': 30,  # seconds a SQLite writer waits for the lock before "database is locked"
+    'SQLITE_JOURNAL_MODE': 'WAL',  # readers no longer block the writer, or the writer the readers
+    'SQLITE_SYNCHRONOUS': 'NORMAL',  # NORMAL is durable in WAL mode except on power loss
+}
+
+
+def database_uri():
+    """Read the database URL from the DATABASE_URL environment variable, defaulting to a local SQLite file."""
+    uri = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+    # Some hosting platforms hand out postgres:// URLs, which SQLAlchemy no longer accepts
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    """SQLAlchemy engine options for the configured database."""
+    if is_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        return {'connect_args': {'timeout': config['DB_BUSY_TIMEOUT']}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True
+    }
+
+
+def configure_engine(engine, config):
+    """
+    Tune new SQLite connections for concurrent writers: WAL lets readers run
+    alongside a writer, and the busy timeout makes writers queue for the lock
+    instead of failing. Engines are disposed in forked children (gunicorn
+    workers, for example) so processes never share pooled connections.
+    """
+    if engine.dialect.name == 'sqlite':
+        journal_mode = config['SQLITE_JOURNAL_MODE']
+        synchronous = config['SQLITE_SYNCHRONOUS']
+        busy_timeout_ms = int(config['DB_BUSY_TIMEOUT'] * 1000)
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+            cursor.execute(f'PRAGMA synchronous={synchronous}')
+            cursor.execute(f'PRAGMA busy_timeout={busy_timeout_ms}')
+            cursor.close()
+
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
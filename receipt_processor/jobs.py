@@ -0,0 +1,413 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from receipt_processor import db
+from receipt_processor.metrics import JOBS_TOTAL, observe_pages, observe_stage_timings, timed
+from receipt_processor.models.job import (
+    EVENT_COMPLETED, EVENT_FAILED, EVENT_QUEUED, EVENT_STARTED, JOB_ACTIVE_STATUSES, JOB_COMPLETED, JOB_FAILED,
+    JOB_QUEUED, JOB_RUNNING, ProcessingJob, ProcessingJobEvent
+)
+from receipt_processor.models.receipt import Receipt, ReceiptFile
+from receipt_processor.pipeline import run_pipeline, store_receipts
+from receipt_processor.progress import report_progress
+from receipt_processor.routes.utils import get_ocr_options
+
+logger = logging.getLogger(__name__)
+
+REQUEUE_CHECK_INTERVAL = 60  # seconds between scans for abandoned jobs and expired job events
+
+# Set in each OCR worker process by _init_worker
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _run_job(job_id, file_path, ocr_options, content_hash):
+    """Run the pipeline for a job in an OCR worker, sending its progress events to the dispatcher."""
+    with report_progress(lambda event, data: _progress_queue.put((job_id, event, data))):
+        return run_pipeline(file_path, ocr_options, content_hash)
+
+
+def add_job_events(events):
+    """Add (job id, event, data) rows to the session's transaction. The caller commits."""
+    if events:
+        now = datetime.utcnow()
+        db.session.execute(
+            db.insert(ProcessingJobEvent),
+            [{'job_id': job_id, 'event': event, 'data': data, 'created_at': now} for job_id, event, data in events]
+        )
+
+
+class JobQueue:
+    """
+    Processing jobs persisted in the database and drained by a pool of OCR
+    worker processes. A dispatcher thread claims queued jobs, hands OCR and
+    parsing to the pool and stores the results when they come back. Workers
+    send the progress of their jobs back through a queue, which the
+    dispatcher alone reads and records as job events.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.worker_id = None
+        self._executor = None
+        self._progress_queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._inflight = {}  # future -> job id
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._next_requeue_check = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('OCR_WORKERS', os.cpu_count() or 1)
+        app.config.setdefault('JOB_POLL_INTERVAL', 1.0)
+        app.config.setdefault('JOB_STALE_AFTER', 15 * 60)
+        app.config.setdefault('JOB_PROGRESS_INTERVAL', 0.25)  # seconds between progress checks while jobs run
+        app.config.setdefault('JOB_EVENT_RETENTION', 24 * 60 * 60)  # seconds job events are kept after a job ends
+        app.config.setdefault('JOB_EVENTS_POLL_INTERVAL', 0.5)  # seconds between checks for new events per stream
+        app.config.setdefault('JOB_EVENTS_TIMEOUT', 300)  # seconds an event stream stays open before the client reconnects
+        app.config.setdefault('JOBS_AUTOSTART', True)
+        app.config.setdefault('JOBS_EAGER', False)  # run jobs inline on enqueue (scripts, benchmarks)
+
+        app.extensions['job_queue'] = self
+        self.app = app
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        # OCR worker processes import the application too; only the parent drains the queue
+        if app.config['JOBS_AUTOSTART'] and not app.config['JOBS_EAGER'] and multiprocessing.parent_process() is None:
+            if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+                # Under the flask command, only a server started by `flask run` drains it, not `flask receipts ...`
+                app.before_request(self._start_serving)
+            else:
+                self.start()
+
+    def start(self):
+        """Start the dispatcher thread and the OCR worker pool."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+            self._stopping.clear()
+            self._executor = self._create_executor()
+            self._thread = threading.Thread(target=self._dispatch_forever, name='job-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _start_serving(self):
+        if self._thread is None:
+            self.start()
+
+    def stop(self, wait=True):
+        """Stop the dispatcher; jobs still running are requeued by the next start."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._executor = None
+
+    def enqueue(self, receipt_file):
+        """Create a queued job for a receipt file and wake the dispatcher."""
+        return self.enqueue_many([receipt_file])[0]
+
+    def enqueue_many(self, receipt_files):
+        """
+        Create queued jobs for many receipt files in one transaction. A file
+        that already has a queued or running job gets that job rather than a
+        second OCR run. Returns the jobs in order.
+        """
+        requested_ids = [receipt_file.id for receipt_file in receipt_files]
+        file_ids = list(dict.fromkeys(requested_ids))
+        if not file_ids:
+            return []
+        for attempt in range(2):
+            job_ids = dict(
+                db.session.query(ProcessingJob.receipt_file_id, ProcessingJob.id)
+                .filter(ProcessingJob.receipt_file_id.in_(file_ids), ProcessingJob.status.in_(JOB_ACTIVE_STATUSES))
+            )
+            now = datetime.utcnow()
+            rows = [
+                {
+                    'id': str(uuid.uuid4()),
+                    'receipt_file_id': file_id,
+                    'status': JOB_QUEUED,
+                    'created_at': now,
+                    'updated_at': now
+                }
+                for file_id in file_ids if file_id not in job_ids
+            ]
+            try:
+                if rows:
+                    db.session.execute(db.insert(ProcessingJob), rows)
+                    add_job_events([(row['id'], EVENT_QUEUED, None) for row in rows])
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Another request queued some of the same files concurrently and committed first
+                db.session.rollback()
+                if attempt:
+                    raise
+        job_ids.update((row['receipt_file_id'], row['id']) for row in rows)
+
+        if rows:
+            if self.app.config['JOBS_EAGER']:
+                self._run_inline([row['id'] for row in rows])
+            else:
+                self._wakeup.set()
+
+        jobs = {job.id: job for job in ProcessingJob.query.filter(ProcessingJob.id.in_(job_ids.values()))}
+        return [jobs[job_ids[file_id]] for file_id in requested_ids]
+
+    def _create_executor(self):
+        # Workers are spawned rather than forked because the parent runs threads
+        context = multiprocessing.get_context('spawn')
+        # A SimpleQueue's put has written the event to the pipe by the time it returns, so a job's
+        # events are all readable once its result is; a fresh one per pool in case a worker died mid-write
+        self._progress_queue = context.SimpleQueue()
+        return ProcessPoolExecutor(
+            max_workers=self.app.config['OCR_WORKERS'],
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._progress_queue,)
+        )
+
+    def _dispatch_forever(self):
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                self._wakeup.clear()
+                try:
+                    if time.monotonic() >= self._next_requeue_check:
+                        self._requeue_abandoned()
+                        self._delete_expired_events()
+                        self._next_requeue_check = time.monotonic() + REQUEUE_CHECK_INTERVAL
+                    self._collect_finished()
+                    self._submit_queued()
+                except Exception:
+                    logger.exception("Job dispatcher iteration failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+                # Check for progress more often while workers have jobs
+                interval = self.app.config['JOB_POLL_INTERVAL']
+                if self._inflight:
+                    interval = min(interval, self.app.config['JOB_PROGRESS_INTERVAL'])
+                self._wakeup.wait(interval)
+
+    def _submit_queued(self):
+        free_slots = self.app.config['OCR_WORKERS'] - len(self._inflight)
+        if free_slots <= 0:
+            return
+
+        job_ids = [
+            row.id for row in db.session.query(ProcessingJob.id)
+            .filter_by(status=JOB_QUEUED)
+            .order_by(ProcessingJob.created_at)
+            .limit(free_slots)
+        ]
+        for job_id in job_ids:
+            receipt_file = self._claim(job_id)
+            if receipt_file is None:
+                continue
+            future = self._executor.submit(
+                _run_job, job_id, receipt_file.file_path, get_ocr_options(self.app.config), receipt_file.content_hash
+            )
+            future.add_done_callback(lambda _: self._wakeup.set())
+            self._inflight[future] = job_id
+
+    def _collect_progress(self):
+        """Add the progress events workers have sent to the session. Returns how many there were."""
+        events = []
+        while not self._progress_queue.empty():
+            events.append(self._progress_queue.get())
+        add_job_events(events)
+        return len(events)
+
+    def _collect_finished(self):
+        finished = [future for future in self._inflight if future.done()]
+        # Workers send events before returning, so this also collects every event of the finished jobs
+        progress = self._collect_progress()
+        outcomes = []
+        for future in finished:
+            job_id = self._inflight.pop(future)
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                # A worker died (for example out of memory); start a fresh pool for the remaining jobs
+                logger.error(f"OCR worker pool broke while running job {job_id}")
+                self._executor.shutdown(wait=False)
+                self._executor = self._create_executor()
+            result = None if error else future.result()
+            if result is not None:
+                # Stage histograms of the worker process are never scraped, so record them here
+                observe_stage_timings(result['timings'])
+            outcomes.append((job_id, result, error))
+        if outcomes:
+            self._finish_all(outcomes)
+        elif progress:
+            db.session.commit()
+
+    def _run_inline(self, job_ids):
+        outcomes = []
+        events = []
+        for job_id in job_ids:
+            receipt_file = self._claim(job_id)
+            if receipt_file is None:
+                continue
+            try:
+                with report_progress(lambda event, data: events.append((job_id, event, data))):
+                    result = run_pipeline(
+                        receipt_file.file_path, get_ocr_options(self.app.config), receipt_file.content_hash
+                    )
+            except Exception as e:
+                outcomes.append((job_id, None, e))
+            else:
+                outcomes.append((job_id, result, None))
+        if outcomes:
+            add_job_events(events)
+            self._finish_all(outcomes)
+
+    def _claim(self, job_id):
+        """Atomically move a queued job to running. Returns the receipt file to process, or None if taken."""
+        now = datetime.utcnow()
+        result = db.session.execute(
+            db.update(ProcessingJob)
+            .where(ProcessingJob.id == job_id, ProcessingJob.status == JOB_QUEUED)
+            .values(
+                status=JOB_RUNNING,
+                worker_id=self.worker_id,
+                attempts=ProcessingJob.attempts + 1,
+                started_at=now,
+                updated_at=now
+            )
+        )
+        if result.rowcount != 1:
+            db.session.commit()
+            return None
+        add_job_events([(job_id, EVENT_STARTED, None)])
+        db.session.commit()
+
+        job = db.session.get(ProcessingJob, job_id)
+        receipt_file = db.session.get(ReceiptFile, job.receipt_file_id)
+        if receipt_file is None or not os.path.exists(receipt_file.file_path):
+            self._finish(job_id, None, "File does not exist")
+            return None
+        return receipt_file
+
+    def _finish(self, job_id, result, error):
+        self._finish_all([(job_id, result, error)])
+
+    def _finish_all(self, outcomes):
+        """
+        Record (job id, result, error) outcomes, storing all new receipts and
+        the jobs' final events in one transaction.
+        """
+        jobs = {job.id: job for job in ProcessingJob.query.filter(ProcessingJob.id.in_([o[0] for o in outcomes]))}
+        finished_at = datetime.utcnow()
+        completed = []
+        events = []
+        for job_id, result, error in outcomes:
+            job = jobs.get(job_id)
+            if job is None or job.status != JOB_RUNNING or job.worker_id != self.worker_id:
+                # The job was requeued and picked up elsewhere while this run was in flight
+                continue
+            if error is not None:
+                logger.error(f"Processing job {job_id} failed: {error}")
+                job.status = JOB_FAILED
+                job.error = str(error)[:255]
+                events.append((job_id, EVENT_FAILED, {'error': job.error}))
+            else:
+                job.pages = result['pages']
+                job.status = JOB_COMPLETED
+                completed.append((job, result))
+                observe_pages(result['pages'])
+            job.finished_at = finished_at
+            JOBS_TOTAL.inc(status=job.status)
+
+        if completed:
+            file_ids = {job.receipt_file_id for job, _ in completed}
+            receipt_ids = dict(
+                db.session.query(Receipt.receipt_file_id, Receipt.id).filter(Receipt.receipt_file_id.in_(file_ids))
+            )
+            receipt_files = {rf.id: rf for rf in ReceiptFile.query.filter(ReceiptFile.id.in_(file_ids))}
+
+            # Store one receipt per file that does not have one yet
+            to_store = {}
+            for job, result in completed:
+                if job.receipt_file_id not in receipt_ids:
+                    to_store.setdefault(
+                        job.receipt_file_id, dict(result['parsed'], timings=result['timings'], text=result['text'])
+                    )
+            with timed('db_store'):
+                new_ids = store_receipts([(receipt_files[file_id], parsed) for file_id, parsed in to_store.items()])
+            receipt_ids.update(zip(to_store, new_ids))
+
+            for job, result in completed:
+                job.receipt_id = receipt_ids[job.receipt_file_id]
+                if result.get('ocr_path'):
+                    receipt_files[job.receipt_file_id].ocr_path = result['ocr_path']
+                events.append((job.id, EVENT_COMPLETED, {'receipt_id': job.receipt_id, 'pages': job.pages}))
+
+        add_job_events(events)
+        with timed('db_commit'):
+            db.session.commit()
+
+    def _requeue_abandoned(self):
+        """Put back running jobs whose dispatcher has exited or stopped making progress."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['JOB_STALE_AFTER'])
+        requeued = 0
+        for job in ProcessingJob.query.filter_by(status=JOB_RUNNING).all():
+            if job.worker_id == self.worker_id:
+                continue
+            if job.started_at is None or job.started_at < cutoff or _is_dead_local_worker(job.worker_id):
+                job.status = JOB_QUEUED
+                job.worker_id = None
+                add_job_events([(job.id, EVENT_QUEUED, {'requeued': True})])
+                requeued += 1
+        if requeued:
+            db.session.commit()
+            logger.info(f"Requeued {requeued} abandoned processing jobs")
+
+    def _delete_expired_events(self):
+        """Delete the events of jobs that finished longer ago than JOB_EVENT_RETENTION."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['JOB_EVENT_RETENTION'])
+        finished_jobs = db.select(ProcessingJob.id).where(ProcessingJob.finished_at < cutoff)
+        db.session.execute(
+            db.delete(ProcessingJobEvent).where(ProcessingJobEvent.job_id.in_(finished_jobs))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+
+def _is_dead_local_worker(worker_id):
+    """Check whether a host:pid worker id names a process on this host that no longer exists."""
+    if not worker_id:
+        return True
+    host, _, pid = worker_id.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+job_queue = JobQueue()
@@ -0,0 +1,254 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+
+# Latency buckets in seconds, from fast parses to slow multi-page OCR
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (10 * 1024, 100 * 1024, 500 * 1024, 1024 ** 2, 5 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 512 * 1024 ** 2)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+UPLOAD_ENDPOINTS = ('receipt.upload_receipt', 'receipt.upload_receipts_batch')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """A metric family with labelled series, rendered in the Prometheus text format."""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            for key, value in sorted(self._series.items()):
+                lines.extend(self._render_series(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def _render_series(self, key, series):
+        lines = []
+        for bound, count in zip(self.buckets, series['counts']):
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {series['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'receipt_http_request_duration_seconds', 'Time spent handling requests.', ['method', 'endpoint', 'status']
+)
+REQUEST_DB_QUERIES = Histogram(
+    'receipt_http_request_db_queries', 'Database queries issued per request.', ['endpoint'], buckets=COUNT_BUCKETS
+)
+UPLOAD_BYTES = Histogram('receipt_upload_bytes', 'Size of upload request bodies.', ['endpoint'], buckets=SIZE_BUCKETS)
+STAGE_SECONDS = Histogram('receipt_stage_duration_seconds', 'Time spent in each processing stage.', ['stage'])
+RECEIPT_PAGES = Histogram('receipt_pages', 'Pages per processed receipt.', buckets=COUNT_BUCKETS)
+PAGES_TOTAL = Counter('receipt_pages_total', 'Pages processed, by where their text came from.', ['source'])
+JOBS_TOTAL = Counter('receipt_jobs_total', 'Processing jobs finished, by outcome.', ['status'])
+OCR_CACHE = Gauge('receipt_ocr_cache', 'OCR cache entries, bytes and counters across all processes.', ['field'])
+RESPONSE_CACHE = Gauge('receipt_response_cache', 'Response cache entries, bytes and counters of this process.', ['field'])
+
+REGISTRY = [
+    REQUEST_SECONDS, REQUEST_DB_QUERIES, UPLOAD_BYTES, STAGE_SECONDS,
+    RECEIPT_PAGES, PAGES_TOTAL, JOBS_TOTAL, OCR_CACHE, RESPONSE_CACHE
+]
+
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class StageTimings:
+    """Seconds spent per stage and database queries issued within one request or job."""
+
+    def __init__(self):
+        self.stages = {}
+        self.db_queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count_query(self):
+        with self._lock:
+            self.db_queries += 1
+
+    def merge(self, other):
+        for stage, seconds in other.stages.items():
+            self.add(stage, seconds)
+        with self._lock:
+            self.db_queries += other.db_queries
+
+    def as_dict(self):
+        with self._lock:
+            return {stage: round(seconds, 6) for stage, seconds in self.stages.items()}
+
+
+_current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+@contextmanager
+def collect_timings():
+    """Collect stage timings within the block; they are merged into any enclosing collection."""
+    timings = StageTimings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+        parent = _current_timings.get()
+        if parent is not None:
+            parent.merge(timings)
+
+
+@contextmanager
+def timed(stage):
+    """Time a processing stage into the stage histogram and the current collection."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+def observe_stage_timings(stages):
+    """Record stage timings measured in another process, such as an OCR worker."""
+    for stage, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def observe_pages(pages):
+    """Record the pages of a processed receipt and where their text came from."""
+    RECEIPT_PAGES.observe(len(pages))
+    for page in pages:
+        PAGES_TOTAL.inc(source=page['source'])
+
+
+def _count_query(*args):
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.count_query()
+
+
+def _profiling_requested():
+    return request.args.get('profile', '').lower() in ('1', 'true', 'yes') or request.headers.get('X-Profile') == '1'
+
+
+def init_app(app):
+    """Count the database queries of each request and job."""
+    from sqlalchemy import event
+
+    from receipt_processor import db
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _count_query)
+
+
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.request_timings = StageTimings()
+    _current_timings.set(g.request_timings)
+
+
+def record_request_timing(response):
+    """Record request metrics and, when profiling is requested, add a stage breakdown to JSON responses."""
+    if 'request_timings' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unknown'
+
+    REQUEST_SECONDS.observe(elapsed, method=request.method, endpoint=endpoint, status=response.status_code)
+    REQUEST_DB_QUERIES.observe(g.request_timings.db_queries, endpoint=endpoint)
+    if endpoint in UPLOAD_ENDPOINTS and request.content_length:
+        UPLOAD_BYTES.observe(request.content_length, endpoint=endpoint)
+
+    if _profiling_requested() and response.is_json and not response.is_streamed:
+        body = response.get_json()
+        if isinstance(body, dict):
+            body['profile'] = {
+                'total_ms': round(elapsed * 1000, 3),
+                'db_queries': g.request_timings.db_queries,
+                'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in g.request_timings.stages.items()}
+            }
+            response.set_data(current_app.json.dumps(body))
+    return response
+
+
+def stop_request_timing(exc):
+    _current_timings.set(None)
@@ -0,0 +1,202 @@
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from receipt_processor import db
+from receipt_processor.models.migration import SchemaMigration
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; avoid starting several processes on a new database there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 500
+MIGRATION_LOCK_ID = 72_801_339  # PostgreSQL advisory lock key held while migrating
+# Indexes on existing tables that older rows may violate; only the migration that fixes the rows creates them
+DEFERRED_INDEXES = {'uq_processing_job_active_file'}
+
+
+def upgrade_schema(deferred_indexes=False):
+    """
+    Bring tables created by an older version of the models up to date.
+    db.create_all() only creates missing tables, so new columns and indexes
+    on existing tables are added here. Indexes in DEFERRED_INDEXES are only
+    added with deferred_indexes.
+    """
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                logger.info(f"Adding column {table.name}.{column.name}")
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {column_type}"
+                ))
+            for index in table.indexes:
+                if index.name in DEFERRED_INDEXES and not deferred_indexes:
+                    continue
+                index.create(conn, checkfirst=True)
+
+
+def backfill_content_hashes():
+    """Compute content digests for receipt files stored before digests were recorded."""
+    from receipt_processor.models.receipt import ReceiptFile
+    from receipt_processor.routes.utils import hash_file
+
+    missing_ids = [row.id for row in db.session.query(ReceiptFile.id).filter(ReceiptFile.content_hash.is_(None))]
+    if not missing_ids:
+        return 0
+
+    known_hashes = {row.content_hash for row in db.session.query(ReceiptFile.content_hash).filter(ReceiptFile.content_hash.isnot(None))}
+    backfilled = 0
+    for start in range(0, len(missing_ids), BACKFILL_BATCH_SIZE):
+        batch = ReceiptFile.query.filter(ReceiptFile.id.in_(missing_ids[start:start + BACKFILL_BATCH_SIZE])).all()
+        for receipt_file in batch:
+            if not os.path.exists(receipt_file.file_path):
+                continue
+            content_hash = hash_file(receipt_file.file_path)
+            if content_hash in known_hashes:
+                # Duplicates stored before deduplication worked keep a NULL digest
+                logger.warning(f"Receipt file {receipt_file.id} duplicates an existing upload; leaving its digest empty")
+                continue
+            receipt_file.content_hash = content_hash
+            known_hashes.add(content_hash)
+            backfilled += 1
+        db.session.commit()
+
+    if backfilled:
+        logger.info(f"Backfilled content digests for {backfilled} receipt files")
+    return backfilled
+
+
+def supersede_duplicate_jobs():
+    """
+    Keep one queued or running job per receipt file, the running one if any
+    and else the oldest, and fail the others, which databases from before
+    jobs were coalesced may hold, so the index allowing one such job per file
+    can be created.
+    """
+    from receipt_processor.models.job import JOB_ACTIVE_STATUSES, JOB_FAILED, JOB_RUNNING, ProcessingJob
+
+    rows = (
+        db.session.query(ProcessingJob.id, ProcessingJob.receipt_file_id)
+        .filter(ProcessingJob.status.in_(JOB_ACTIVE_STATUSES))
+        .order_by(ProcessingJob.status != JOB_RUNNING, ProcessingJob.created_at, ProcessingJob.id)
+    )
+    kept = {}
+    superseded = 0
+    for job_id, receipt_file_id in rows.all():
+        if receipt_file_id not in kept:
+            kept[receipt_file_id] = job_id
+            continue
+        db.session.execute(
+            db.update(ProcessingJob).where(ProcessingJob.id == job_id)
+            .values(status=JOB_FAILED, error=f"Superseded by job {kept[receipt_file_id]}", finished_at=datetime.utcnow())
+        )
+        superseded += 1
+    db.session.commit()
+    if superseded:
+        logger.info(f"Failed {superseded} processing jobs that duplicated another job of the same file")
+
+
+def create_schema():
+    """Create missing tables and bring older ones up to date."""
+    db.create_all()
+    upgrade_schema()
+
+
+def add_search_index():
+    """Create the full-text search tables and index the receipts already stored."""
+    from receipt_processor.search import backfill_search_index, create_search_index
+
+    create_schema()
+    create_search_index()
+    backfill_search_index()
+
+
+def add_receipt_rollups():
+    """Create the rollup table and compute it from the receipts already stored."""
+    from receipt_processor.stats import rebuild_rollups
+
+    create_schema()
+    receipts = rebuild_rollups()
+    logger.info(f"Computed rollups over {receipts} receipts")
+
+
+def add_job_events():
+    """Create the job event table, then allow one active job per file once older duplicates are failed."""
+    create_schema()
+    supersede_duplicate_jobs()
+    upgrade_schema(deferred_indexes=True)
+
+
+# Versioned migrations, applied in order and recorded in schema_migration.
+# Append new entries; never renumber or edit one that has shipped. Each step
+# must be safe to re-run, since databases from before versioning start at 0.
+MIGRATIONS = [
+    (1, 'create tables, columns and indexes', create_schema),
+    (2, 'backfill receipt file content digests', backfill_content_hashes),
+    (3, 'add receipt_file.ocr_path', create_schema),
+    (4, 'full-text search index', add_search_index),
+    (5, 'receipt rollups for /stats', add_receipt_rollups),
+    (6, 'processing job events and one active job per file', add_job_events),
+]
+
+
+@contextmanager
+def migration_lock():
+    """Keep concurrent processes (several gunicorn workers starting at once) from migrating together."""
+    url = db.engine.url
+    if url.get_backend_name() == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_ID})
+            conn.commit()
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_ID})
+                conn.commit()
+    elif url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:' and fcntl:
+        with open(f"{url.database}.migrate.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+
+def applied_migrations():
+    """Versions recorded in schema_migration, mapped to when they were applied."""
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        return {}
+    return {row.version: row.applied_at for row in SchemaMigration.query.all()}
+
+
+def run_migrations():
+    """Apply pending migrations in order and return the versions applied."""
+    applied = []
+    with migration_lock():
+        done = applied_migrations()
+        for version, name, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            logger.info(f"Applying migration {version}: {name}")
+            migrate()
+            db.session.add(SchemaMigration(version=version, name=name))
+            db.session.commit()
+            applied.append(version)
+    return applied
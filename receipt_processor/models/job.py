@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from receipt_processor import db
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+EVENT_QUEUED = 'queued'
+EVENT_STARTED = 'started'
+EVENT_COMPLETED = 'completed'  # written in the transaction that stores the receipt
+EVENT_FAILED = 'failed'
+TERMINAL_EVENTS = (EVENT_COMPLETED, EVENT_FAILED)
+
+_ACTIVE_JOB = db.text(f"status IN ('{JOB_QUEUED}', '{JOB_RUNNING}')")
+
+
+class ProcessingJob(db.Model):
+    __tablename__ = 'processing_job'
+    __table_args__ = (
+        # At most one queued or running job per file, so retried /process calls share it
+        db.Index('uq_processing_job_active_file', 'receipt_file_id', unique=True,
+                 sqlite_where=_ACTIVE_JOB, postgresql_where=_ACTIVE_JOB),
+    )
+
+    id = db.Column(db.String(36), primary_key=True)
+    receipt_file_id = db.Column(db.String(36), db.ForeignKey('receipt_file.id'), nullable=False, index=True)
+    receipt_id = db.Column(db.String(36), db.ForeignKey('receipt.id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default=JOB_QUEUED, index=True)
+    error = db.Column(db.String(255), nullable=True)
+    worker_id = db.Column(db.String(100), nullable=True)  # host:pid of the dispatcher running the job
+    pages = db.Column(db.JSON, nullable=True)  # extraction path of each page: text_layer, ocr or ocr_cache
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True, index=True)  # job events expire after it
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'receipt_file_id': self.receipt_file_id,
+            'receipt_id': self.receipt_id,
+            'status': self.status,
+            'error': self.error,
+            'pages': self.pages,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+class ProcessingJobEvent(db.Model):
+    """A step in the life of a processing job, streamed to clients by /jobs/<job_id>/events."""
+    __tablename__ = 'processing_job_event'
+
+    id = db.Column(db.Integer, primary_key=True)  # event id; streams resume after the last one seen
+    job_id = db.Column(db.String(36), db.ForeignKey('processing_job.id'), nullable=False, index=True)
+    event = db.Column(db.String(20), nullable=False)
+    data = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,11 @@
+from datetime import datetime
+
+from receipt_processor import db
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migration'
+
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
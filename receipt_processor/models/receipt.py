@@ -5,10 +5,15 @@ from receipt_processor import db
 
 class ReceiptFile(db.Model):
     __tablename__ = 'receipt_file'
+    __table_args__ = (
+        db.Index('ix_receipt_file_created_at_id', 'created_at', 'id'),  # listing order and cursor
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     file_name = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(255), nullable=False, unique=True)
+    content_hash = db.Column(db.String(64), nullable=True, unique=True, index=True)  # SHA-256 of the file contents
+    ocr_path = db.Column(db.String(255), nullable=True)  # stored page text and word boxes, for reparsing
     is_valid = db.Column(db.Boolean, default=False)
     invalid_reason = db.Column(db.String(255), nullable=True)
     is_processed = db.Column(db.Boolean, default=False)
@@ -20,6 +25,8 @@ class ReceiptFile(db.Model):
             'id': self.id,
             'file_name': self.file_name,
             'file_path': self.file_path,
+            'content_hash': self.content_hash,
+            'has_ocr_output': self.ocr_path is not None,
             'is_valid': self.is_valid,
             'invalid_reason': self.invalid_reason,
             'is_processed': self.is_processed,
@@ -29,21 +36,28 @@ class ReceiptFile(db.Model):
 
 class Receipt(db.Model):
     __tablename__ = 'receipt'
+    __table_args__ = (
+        db.Index('ix_receipt_created_at_id', 'created_at', 'id'),  # listing order and cursor
+        db.Index('ix_receipt_updated_at_id', 'updated_at', 'id'),  # export order and watermark
+    )
     
     id = db.Column(db.String(36), primary_key=True)
-    receipt_file_id = db.Column(db.String(36), db.ForeignKey('receipt_file.id'), nullable=False)
-    purchased_at = db.Column(db.DateTime, nullable=True)
-    merchant_name = db.Column(db.String(255), nullable=True)
-    total_amount = db.Column(db.Float, nullable=True)
+    receipt_file_id = db.Column(db.String(36), db.ForeignKey('receipt_file.id'), nullable=False, index=True)
+    purchased_at = db.Column(db.DateTime, nullable=True, index=True)
+    merchant_name = db.Column(db.String(255), nullable=True, index=True)
+    total_amount = db.Column(db.Float, nullable=True, index=True)
     file_path = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Additional fields for transaction details
-    currency = db.Column(db.String(10), nullable=True)
+    currency = db.Column(db.String(10), nullable=True, index=True)
     payment_method = db.Column(db.String(50), nullable=True)
     tax_amount = db.Column(db.Float, nullable=True)
     receipt_number = db.Column(db.String(50), nullable=True)
+    timings = db.Column(db.JSON, nullable=True)  # seconds spent in each processing stage
+    
+    items = db.relationship('ReceiptItem', lazy='select')
     
     def to_dict(self):
         return {
@@ -57,6 +71,7 @@ class Receipt(db.Model):
             'tax_amount': self.tax_amount,
             'receipt_number': self.receipt_number,
             'file_path': self.file_path,
+            'timings': self.timings,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
@@ -66,7 +81,7 @@ class ReceiptItem(db.Model):
     __tablename__ = 'receipt_item'
     
     id = db.Column(db.String(36), primary_key=True)
-    receipt_id = db.Column(db.String(36), db.ForeignKey('receipt.id'), nullable=False)
+    receipt_id = db.Column(db.String(36), db.ForeignKey('receipt.id'), nullable=False, index=True)
     item_name = db.Column(db.String(255), nullable=True)
     quantity = db.Column(db.Float, nullable=True)
     unit_price = db.Column(db.Float, nullable=True)
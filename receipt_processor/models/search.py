@@ -0,0 +1,13 @@
+from receipt_processor import db
+
+
+class SearchDocument(db.Model):
+    """The searchable text of a receipt; on SQLite an FTS5 index over this table is kept in sync by triggers."""
+    __tablename__ = 'receipt_search_document'
+
+    id = db.Column(db.Integer, primary_key=True)  # rowid of the full-text index entry
+    receipt_id = db.Column(db.String(36), db.ForeignKey('receipt.id'), nullable=False, unique=True, index=True)
+    merchant_name = db.Column(db.String(255), nullable=True)
+    receipt_number = db.Column(db.String(50), nullable=True)
+    items = db.Column(db.Text, nullable=True)  # item names, one per line
+    text = db.Column(db.Text, nullable=True)  # extracted text of the receipt file
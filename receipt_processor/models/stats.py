@@ -0,0 +1,36 @@
+from receipt_processor import db
+
+
+class ReceiptRollup(db.Model):
+    """
+    Running totals of the receipts in one group of a dimension (a merchant, a
+    month, a currency or a payment method), per currency. Unknown values are
+    stored as an empty key or currency.
+    """
+    __tablename__ = 'receipt_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('dimension', 'key', 'currency', name='uq_receipt_rollup_group'),
+        db.Index('ix_receipt_rollup_dimension_total', 'dimension', 'total_amount'),  # largest groups first
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(20), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    currency = db.Column(db.String(10), nullable=False)
+    receipt_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    tax_amount = db.Column(db.Float, nullable=False, default=0.0)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    item_total = db.Column(db.Float, nullable=False, default=0.0)  # sum of the items' total_price
+
+    def to_dict(self):
+        return {
+            'key': self.key or None,
+            'currency': self.currency or None,
+            'receipt_count': self.receipt_count,
+            # Sums kept by adding and subtracting floats pick up rounding noise
+            'total_amount': round(self.total_amount, 2) or 0.0,
+            'tax_amount': round(self.tax_amount, 2) or 0.0,
+            'item_count': self.item_count,
+            'item_total': round(self.item_total, 2) or 0.0
+        }
@@ -0,0 +1,243 @@
+import re
+from collections import namedtuple
+
+from dateutil import parser as date_parser
+
+# A named field, its patterns in priority order and a converter from a match to
+# result values. A converter returning None moves on to the next pattern.
+FieldRule = namedtuple('FieldRule', ['name', 'patterns', 'convert'])
+
+# A per-line item pattern and its converter from a match to an item dictionary.
+ItemRule = namedtuple('ItemRule', ['pattern', 'convert'])
+
+CURRENCY_MAP = {
+    '$': 'USD',
+    '€': 'EUR',
+    '£': 'GBP',
+    '¥': 'JPY'
+}
+
+AMOUNT_RE = re.compile(r'(?:[$€£¥]|\d)\s*[\d,.]+')
+NUMBER_RE = re.compile(r'[\d.]+')
+CURRENCY_SYMBOL_RE = re.compile(r'[$€£¥]')
+MERCHANT_DATE_RE = re.compile(r'\d{2}/\d{2}/\d{4}')
+RECEIPT_NUMBER_TAIL_RE = re.compile(r'[\w\d-]+$')
+
+# Every item pattern needs a price such as 10.99, so lines without one are skipped
+PRICE_HINT_RE = re.compile(r'\d\.\d{2}')
+
+
+def _compile_all(patterns, flags=0):
+    return tuple(re.compile(pattern, flags) for pattern in patterns)
+
+
+def _convert_date(match):
+    try:
+        return {'purchased_at': date_parser.parse(match.group(0))}
+    except Exception:
+        return None
+
+
+def _parse_amount(match):
+    """Pull the first amount out of a matched phrase, e.g. 'Total: $1,50' -> ('$1.50', 1.5)."""
+    amount_str = AMOUNT_RE.search(match.group(0))
+    if not amount_str:
+        return None
+    # Clean the amount string
+    amount_text = amount_str.group(0).replace(',', '.')
+    # Extract numeric part
+    numeric_part = NUMBER_RE.search(amount_text)
+    if not numeric_part:
+        return None
+    try:
+        return amount_text, float(numeric_part.group(0))
+    except ValueError:
+        return None  # OCR noise such as 1.2.3
+
+
+def _convert_total(match):
+    parsed = _parse_amount(match)
+    if parsed is None:
+        return None
+    amount_text, amount = parsed
+    values = {'total_amount': amount}
+    # Check for currency
+    currency_match = CURRENCY_SYMBOL_RE.search(amount_text)
+    if currency_match:
+        values['currency'] = CURRENCY_MAP.get(currency_match.group(0), 'USD')
+    return values
+
+
+def _convert_tax(match):
+    parsed = _parse_amount(match)
+    if parsed is None:
+        return None
+    return {'tax_amount': parsed[1]}
+
+
+def _convert_payment(match):
+    payment_text = match.group(0).lower()
+    payment_method = None
+    if 'cash' in payment_text:
+        payment_method = 'Cash'
+    elif 'credit' in payment_text or 'visa' in payment_text or 'mastercard' in payment_text or 'amex' in payment_text:
+        payment_method = 'Credit Card'
+    elif 'debit' in payment_text:
+        payment_method = 'Debit Card'
+    elif 'paypal' in payment_text:
+        payment_method = 'PayPal'
+    return {'payment_method': payment_method}
+
+
+def _convert_receipt_number(match):
+    number_part = RECEIPT_NUMBER_TAIL_RE.search(match.group(0))
+    if not number_part:
+        return None
+    return {'receipt_number': number_part.group(0)}
+
+
+# Matches what (?:[$€£¥]|\d)\s*[\d,.]+\s*(?:keywords) matches, in linear time on long runs of
+# digits, commas and dots. A match that continues inside the run it starts in can only
+# start at the run's first digit (any later start ends in the same place), so that case
+# is entered once per run; it may then include the run's leading separators, which the
+# amount parsing skips. A digit that ends its run can still start a match across spaces.
+# The possessive runs only drop backtracking that could not succeed.
+AMOUNT_BEFORE_KEYWORD = r'(?:[$€£¥]|(?<![\d,.])[,.]*+\d(?=[\d,.])|\d(?![\d,.]))\s*+[\d,.]++\s*+(?:{keywords})'
+
+# Several of these patterns can match across line breaks (for example 'Total $\n12.50'),
+# so they are searched over the whole text rather than line by line.
+FIELD_RULES = (
+    FieldRule('purchased_at', _compile_all([
+        r'\d{2}/\d{2}/\d{4}',  # DD/MM/YYYY
+        r'\d{2}-\d{2}-\d{4}',  # DD-MM-YYYY
+        r'\d{4}/\d{2}/\d{2}',  # YYYY/MM/DD
+        r'\d{4}-\d{2}-\d{2}',  # YYYY-MM-DD
+        r'\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{4}',  # DD Month YYYY
+    ]), _convert_date),
+    FieldRule('total_amount', _compile_all([
+        r'(?:total|amount|sum|balance).{0,20}(?:[$€£¥]|\d)\s*[\d,.]+',
+        AMOUNT_BEFORE_KEYWORD.format(keywords='total|amount'),
+        r'total\s*(?:[$€£¥]|\d)\s*[\d,.]+',
+    ], re.IGNORECASE), _convert_total),
+    FieldRule('payment_method', _compile_all([
+        r'(?:paid|payment|method).{0,15}(?:cash|credit|debit|visa|mastercard|amex|paypal)',
+        r'(?:cash|credit|debit|visa|mastercard|amex|paypal)',
+    ], re.IGNORECASE), _convert_payment),
+    FieldRule('tax_amount', _compile_all([
+        r'(?:tax|vat|gst).{0,15}(?:[$€£¥]|\d)\s*[\d,.]+',
+        AMOUNT_BEFORE_KEYWORD.format(keywords='tax|vat|gst'),
+    ], re.IGNORECASE), _convert_tax),
+    FieldRule('receipt_number', _compile_all([
+        r'(?:receipt|invoice|order|transaction).{0,5}(?:#|no|num|number).{0,5}[\w\d-]+',
+        r'(?:#|no|num|number).{0,5}[\w\d-]+',
+    ], re.IGNORECASE), _convert_receipt_number),
+)
+
+
+def _convert_item_with_quantity(match):
+    quantity_str, item_name, price_str = match.groups()
+    quantity = float(quantity_str) if quantity_str else 1
+    if not quantity:
+        return None  # "0 x Item 1.99" has no unit price; the plain item rule still reads the line
+    try:
+        price = float(price_str.replace('$', '').strip())
+        return {
+            'item_name': item_name.strip(),
+            'quantity': quantity,
+            'unit_price': price / quantity,
+            'total_price': price
+        }
+    except ValueError:
+        return None
+
+
+def _convert_item(match):
+    item_name, price_str = match.groups()
+    try:
+        price = float(price_str.replace('$', '').strip())
+        return {
+            'item_name': item_name.strip(),
+            'quantity': 1,
+            'unit_price': price,
+            'total_price': price
+        }
+    except ValueError:
+        return None
+
+
+# Item lines look like "1 x Item $10.99" or "Item............$10.99". Both patterns
+# are applied to every line, so a matching line yields one item from each.
+#
+# They match exactly what the plain forms (\d+)?\s*[xX]?\s*([a-zA-Z\s]+)[-\s.]*(\$?\d+\.\d{2})
+# and ([a-zA-Z\s]+)[-\s.]*(\$?\d+\.\d{2}) match, but without their catastrophic
+# backtracking on long runs of letters and spaces:
+# - the name and separator runs are possessive; giving characters back can never
+#   reach a price, because the next character would be a letter or a space
+# - the quantity/"x" prefix is atomic once a name character follows it
+# - a match never starts just after a name character (unless at a digit) or just after
+#   a digit, since a match starting one character earlier ends in the same place
+ITEM_RULES = (
+    ItemRule(
+        re.compile(r'(?:(?<![a-zA-Z\s\d])|(?<=[a-zA-Z\s])(?=\d))(\d+)?+(?>\s*[xX]?\s*(?=[a-zA-Z\s]))([a-zA-Z\s]++)[-\s.]*+(\$?\d+\.\d{2})'),
+        _convert_item_with_quantity
+    ),
+    ItemRule(
+        re.compile(r'(?<![a-zA-Z\s])([a-zA-Z\s]++)[-\s.]*+(\$?\d+\.\d{2})'),
+        _convert_item
+    ),
+)
+
+
+class ReceiptExtractor:
+    """Extracts receipt fields from text with precompiled field and item rules."""
+
+    def __init__(self, field_rules=FIELD_RULES, item_rules=ITEM_RULES):
+        self.field_rules = field_rules
+        self.item_rules = item_rules
+
+    def extract(self, text):
+        result = {
+            'merchant_name': self.extract_merchant(text),
+            'purchased_at': None,
+            'total_amount': None,
+            'currency': None,
+            'payment_method': None,
+            'tax_amount': None,
+            'receipt_number': None,
+            'items': []
+        }
+
+        for rule in self.field_rules:
+            for pattern in rule.patterns:
+                match = pattern.search(text)
+                if match:
+                    values = rule.convert(match)
+                    if values is not None:
+                        result.update(values)
+                        break
+
+        # Single pass over the lines for item rows
+        for line in text.split('\n'):
+            line = line.strip()
+            if len(line) <= 5 or not PRICE_HINT_RE.search(line):
+                continue
+            for rule in self.item_rules:
+                match = rule.pattern.search(line)
+                if match:
+                    item = rule.convert(match)
+                    if item is not None:
+                        result['items'].append(item)
+
+        return result
+
+    @staticmethod
+    def extract_merchant(text):
+        """The merchant name is usually on one of the first 3 lines of the receipt."""
+        for line in text.strip().split('\n', 3)[:3]:
+            line = line.strip()
+            if line and len(line) > 3 and not line.startswith('http') and not MERCHANT_DATE_RE.search(line):
+                return line
+        return None
+
+
+receipt_extractor = ReceiptExtractor()
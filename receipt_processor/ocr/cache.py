@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DB_NAME = 'ocr_cache.sqlite3'
+EVICT_TO_RATIO = 0.9  # evict down to this share of the size limit so puts don't evict every time
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class OCRCache:
+    """
+    On-disk cache of OCR output with least-recently-used eviction.
+    Entries, their sizes and last access times live in a SQLite file, so the
+    OCR worker processes share one cache and one set of hit/miss counters.
+    """
+
+    def __init__(self, directory, max_bytes):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(directory, CACHE_DB_NAME), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries '
+            '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_last_access ON entries (last_access)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    @staticmethod
+    def make_key(content_hash, page_number, settings):
+        """Build the key for one page of a document OCR'd with the given settings."""
+        payload = json.dumps([content_hash, page_number, settings], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached value for a key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            self._conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._count('hits')
+        return row[0]
+
+    def put(self, key, value):
+        """Store an encoded value under a key, evicting least recently used entries beyond the size limit."""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+                (key, value, len(value), time.time())
+            )
+            if self._total_bytes() > self.max_bytes:
+                self._evict(int(self.max_bytes * EVICT_TO_RATIO))
+
+    def stats(self):
+        """Return entry count, stored bytes and hit/miss counters across all processes."""
+        with self._lock:
+            entries, stored_bytes = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            counters = dict(self._conn.execute('SELECT name, value FROM counters').fetchall())
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {
+            'entries': entries,
+            'bytes': stored_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'hit_ratio': hits / (hits + misses) if hits + misses else None
+        }
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute('DELETE FROM counters')
+
+    def _total_bytes(self):
+        return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _evict(self, target_bytes):
+        excess = self._total_bytes() - target_bytes
+        evicted = 0
+        rows = self._conn.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall()
+        for key, size in rows:
+            if excess <= 0:
+                break
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            excess -= size
+            evicted += 1
+        self._count('evictions', evicted)
+
+    def _count(self, name, amount=1):
+        self._conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value',
+            (name, amount)
+        )
+
+
+def get_ocr_cache(directory, max_bytes):
+    """Return the process-wide cache for a directory, opening it on first use."""
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = _caches[directory] = OCRCache(directory, max_bytes)
+        cache.max_bytes = max_bytes
+        return cache
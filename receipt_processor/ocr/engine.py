@@ -0,0 +1,189 @@
+"""
+OCR engines behind extract_text_from_pdf.
+
+pytesseract runs the tesseract binary once per page: every call starts a
+process, loads the language model and passes the image and results through
+temporary files, which on a small receipt takes longer than recognizing it.
+When tesserocr (bindings to the Tesseract C API) is installed, pages go to a
+pool of Tesseract instances that stay loaded for the life of the process and
+are handed images in memory. pytesseract remains the fallback when tesserocr
+is missing or cannot start.
+
+Both engines return words in the shape of pytesseract.image_to_data's
+Output.DICT, which ocr.store.words_from_data turns into word columns.
+"""
+import logging
+import queue
+import shlex
+import threading
+from functools import lru_cache
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # optional; pages are OCR'd with the tesseract binary instead
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+ENGINE_AUTO = 'auto'
+ENGINE_TESSEROCR = 'tesserocr'
+ENGINE_PYTESSERACT = 'pytesseract'
+OCR_ENGINES = (ENGINE_AUTO, ENGINE_TESSEROCR, ENGINE_PYTESSERACT)
+DEFAULT_PSM = 3  # what the tesseract binary uses when no --psm is given
+WORD_LEVEL = 5  # image_to_data's level of a word row
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def tesseract_config(options):
+    """Command line options of the tesseract binary for the OCR_* options."""
+    config = []
+    if options['OCR_PSM'] is not None:
+        config.append(f"--psm {options['OCR_PSM']}")
+    if options['OCR_CHAR_WHITELIST']:
+        config.append(f"-c tessedit_char_whitelist={shlex.quote(options['OCR_CHAR_WHITELIST'])}")
+    return ' '.join(config)
+
+
+@lru_cache(maxsize=1)
+def _binary_version():
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return 'unknown'
+
+
+class PytesseractEngine:
+    """Runs the tesseract binary for each page."""
+
+    name = ENGINE_PYTESSERACT
+
+    def __init__(self, options):
+        self.lang = options['OCR_LANG']
+        self.config = tesseract_config(options)
+
+    @property
+    def version(self):
+        return _binary_version()
+
+    def image_to_data(self, image):
+        return pytesseract.image_to_data(image, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT)
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """
+    A pool of Tesseract API instances with the language model loaded. Each
+    page borrows an instance for its recognition, so up to size pages are
+    OCR'd at once; tesserocr releases the GIL while Tesseract works. Instances
+    are created as concurrent pages need them, the first one straight away so
+    a Tesseract that cannot start is noticed before any page is given to it.
+    """
+
+    name = ENGINE_TESSEROCR
+
+    def __init__(self, options, size):
+        self.lang = options['OCR_LANG']
+        self.psm = options['OCR_PSM'] if options['OCR_PSM'] is not None else DEFAULT_PSM
+        self.whitelist = options['OCR_CHAR_WHITELIST']
+        self.size = max(1, size)
+        self.version = tesserocr.tesseract_version().split('\n', 1)[0].replace('tesseract', '').strip() or 'unknown'
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._idle.put(self._create_api())
+
+    def _create_api(self):
+        api = tesserocr.PyTessBaseAPI(lang=self.lang, psm=self.psm)
+        if self.whitelist:
+            api.SetVariable('tessedit_char_whitelist', self.whitelist)
+        self._created += 1
+        return api
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                return self._create_api()
+        return self._idle.get()
+
+    def image_to_data(self, image):
+        api = self._acquire()
+        try:
+            api.SetImage(image)
+            api.Recognize()
+            return self._words(api)
+        finally:
+            # Drop the page's image and results but keep the model loaded
+            api.Clear()
+            self._idle.put(api)
+
+    @staticmethod
+    def _words(api):
+        data = {key: [] for key in ('level', 'block_num', 'par_num', 'line_num', 'word_num',
+                                    'left', 'top', 'width', 'height', 'conf', 'text')}
+        iterator = api.GetIterator()
+        if iterator is None:
+            return data
+        block = par = line = word = 0
+        for result in tesserocr.iterate_level(iterator, tesserocr.RIL.WORD):
+            if result.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                block, par, line = block + 1, 0, 0
+            if result.IsAtBeginningOf(tesserocr.RIL.PARA):
+                par, line = par + 1, 0
+            if result.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                line, word = line + 1, 0
+            word += 1
+            box = result.BoundingBox(tesserocr.RIL.WORD)
+            text = result.GetUTF8Text(tesserocr.RIL.WORD)
+            if box is None or not text:
+                continue
+            left, top, right, bottom = box
+            for key, value in (('level', WORD_LEVEL), ('block_num', block), ('par_num', par), ('line_num', line),
+                               ('word_num', word), ('left', left), ('top', top), ('width', right - left),
+                               ('height', bottom - top), ('conf', result.Confidence(tesserocr.RIL.WORD)),
+                               ('text', text)):
+                data[key].append(value)
+        return data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().End()
+            except queue.Empty:
+                break
+
+
+def _create_engine(options):
+    engine = options['OCR_ENGINE']
+    if engine not in OCR_ENGINES:
+        raise ValueError(f"Unknown OCR engine {engine!r}; expected one of {', '.join(OCR_ENGINES)}")
+    if engine == ENGINE_PYTESSERACT:
+        return PytesseractEngine(options)
+    if tesserocr is None:
+        if engine == ENGINE_TESSEROCR:
+            logger.warning("OCR_ENGINE is tesserocr but tesserocr is not installed; using the tesseract binary")
+        return PytesseractEngine(options)
+    try:
+        return TesserocrEngine(options, options['OCR_CONCURRENCY'])
+    except Exception as e:
+        logger.warning(f"Could not start tesserocr, using the tesseract binary: {str(e)}")
+        return PytesseractEngine(options)
+
+
+def get_ocr_engine(options):
+    """Return this process's engine for the OCR_* options, starting it on first use."""
+    key = (options['OCR_ENGINE'], options['OCR_LANG'], options['OCR_PSM'], options['OCR_CHAR_WHITELIST'])
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = _create_engine(options)
+        return engine
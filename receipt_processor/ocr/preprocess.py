@@ -0,0 +1,265 @@
+"""
+Preparation of rendered pages for Tesseract.
+
+A scanned receipt is a narrow strip of thermal paper in the middle of a page
+of blank margins, often a little crooked. Before OCR each page is converted
+to grayscale, cropped to the ink, deskewed, scaled down until its text lines
+are about OCR_TARGET_TEXT_HEIGHT pixels tall and binarized with a local
+threshold, which leaves Tesseract a fraction of the pixels and clean black
+text on white. Everything here uses Pillow alone.
+
+Word boxes Tesseract reports on the prepared image are mapped back onto the
+rendered page with PageTransform, so stored boxes do not depend on the
+preprocessing settings.
+"""
+import math
+import statistics
+
+from PIL import Image, ImageChops, ImageFilter
+
+ANALYSIS_WIDTH = 400  # pixels across the reduced copy used to find margins and skew
+DESKEW_STEP = 1.0  # degrees between the candidate skew angles tried first, then halved once around the best
+DESKEW_MIN_ANGLE = 0.3  # smaller skews are left alone, rotating costs more than it gains
+CROP_PADDING = 0.02  # share of the page kept around the ink on every side, at least MIN_CROP_PADDING pixels
+MIN_CROP_PADDING = 8
+DARK_BORDER_LEVEL = 96  # mean brightness below which an edge row or column is scanner background, not paper
+DARK_REGION_RADIUS = 4  # dark areas over twice this wide on the reduced copy are background or shadow, not print
+MIN_INK_ROWS = 2  # rows of ink a text line needs on the reduced copy to count towards the line height
+DOWNSCALE_MARGIN = 1.2  # text this much taller than the target is scaled down, smaller overshoots are kept
+THRESHOLD_OFFSET = 12  # how much darker than its neighbourhood a pixel must be to count as ink
+
+
+class PageTransform:
+    """The crops, rotations and scalings applied to a page, in order, so coordinates can be mapped back."""
+
+    def __init__(self, size):
+        self.size = size
+        self.steps = []
+
+    def crop(self, box):
+        self.steps.append(('crop', box[0], box[1]))
+
+    def rotate(self, angle, source_size, size):
+        self.steps.append(('rotate', angle, source_size, size))
+
+    def scale(self, factor):
+        self.steps.append(('scale', factor))
+
+    def to_page(self, x, y):
+        """Map a point of the prepared image onto the rendered page."""
+        for step in reversed(self.steps):
+            if step[0] == 'crop':
+                x, y = x + step[1], y + step[2]
+            elif step[0] == 'scale':
+                x, y = x / step[1], y / step[1]
+            else:
+                # Image.rotate turns the picture counter-clockwise about its centre
+                angle, (source_width, source_height), (width, height) = step[1:]
+                radians = math.radians(angle)
+                dx, dy = x - width / 2, y - height / 2
+                x = dx * math.cos(radians) - dy * math.sin(radians) + source_width / 2
+                y = dx * math.sin(radians) + dy * math.cos(radians) + source_height / 2
+        return x, y
+
+    def map_words(self, words):
+        """Move word boxes (columns as in ocr.store) from the prepared image onto the rendered page, in place."""
+        if not self.steps:
+            return words
+        width, height = self.size
+        for index in range(len(words['text'])):
+            left, top = words['left'][index], words['top'][index]
+            right, bottom = left + words['width'][index], top + words['height'][index]
+            corners = [self.to_page(x, y) for x in (left, right) for y in (top, bottom)]
+            left = max(0, min(width, int(min(x for x, _ in corners))))
+            top = max(0, min(height, int(min(y for _, y in corners))))
+            right = max(left, min(width, int(math.ceil(max(x for x, _ in corners)))))
+            bottom = max(top, min(height, int(math.ceil(max(y for _, y in corners)))))
+            words['left'][index], words['top'][index] = left, top
+            words['width'][index], words['height'][index] = right - left, bottom - top
+        return words
+
+
+def otsu_threshold(image):
+    """The gray level that best separates the histogram of an 'L' image into ink and paper."""
+    histogram = image.histogram()
+    total = sum(histogram)
+    level_sum = sum(level * count for level, count in enumerate(histogram))
+    best_level, best_variance = 127, -1.0
+    background_count = background_sum = 0
+    for level, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += level * count
+        mean_difference = background_sum / background_count - (level_sum - background_sum) / foreground_count
+        variance = background_count * foreground_count * mean_difference ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def _ink_mask(image, threshold=None):
+    """
+    255 where an 'L' image has print, 0 elsewhere: pixels darker than the
+    threshold (Otsu's by default), less dark regions too broad to be strokes,
+    such as the scanner background showing around a crooked receipt.
+    """
+    if threshold is None:
+        threshold = otsu_threshold(image)
+    dark = image.point(lambda value: 255 if value <= threshold else 0)
+    # An opening by box blurs, far cheaper than MinFilter and MaxFilter: keep the
+    # pixels whose whole neighbourhood is dark, then grow them back a little
+    # further than they shrank so the ragged edges of the region go too
+    core = dark.filter(ImageFilter.BoxBlur(DARK_REGION_RADIUS)).point(lambda value: 255 if value >= 250 else 0)
+    broad = core.filter(ImageFilter.BoxBlur(DARK_REGION_RADIUS + 2)).point(lambda value: 255 if value > 0 else 0)
+    return ImageChops.subtract(dark, broad)
+
+
+def _profile(image, axis):
+    """Mean value of every row (axis 0) or column (axis 1) of an 'L' image."""
+    width, height = image.size
+    if axis == 0:
+        return list(image.resize((1, height), Image.BOX).getdata())
+    return list(image.resize((width, 1), Image.BOX).getdata())
+
+
+def _reduced(image):
+    """A copy at most ANALYSIS_WIDTH wide and its reduction factor."""
+    factor = max(1, -(-image.width // ANALYSIS_WIDTH))
+    return (image.reduce(factor) if factor > 1 else image.copy()), factor
+
+
+def _paper_span(profile):
+    """The first and last index of a brightness profile that are not dark scanner background."""
+    start, end = 0, len(profile)
+    while start < end and profile[start] < DARK_BORDER_LEVEL:
+        start += 1
+    while end > start and profile[end - 1] < DARK_BORDER_LEVEL:
+        end -= 1
+    return start, end
+
+
+def content_box(image):
+    """
+    The box of an 'L' image holding the receipt's ink, with a little padding,
+    or None if the page is blank. Dark scanner background along the edges is
+    cut away first, and specks are filtered out so a stray dot in the margin
+    does not widen the crop.
+    """
+    small, factor = _reduced(image)
+    left, right = _paper_span(_profile(small, 1))
+    top, bottom = _paper_span(_profile(small, 0))
+    if right - left < 2 or bottom - top < 2:
+        return None
+    # Threshold on the paper alone, but find broad dark regions on the whole
+    # page, where the corners of background around a crooked scan are wide
+    threshold = otsu_threshold(small.crop((left, top, right, bottom)))
+    ink = _ink_mask(small, threshold).crop((left, top, right, bottom)).filter(ImageFilter.MedianFilter(3))
+    box = ink.getbbox()
+    if box is None:
+        return None
+    padding = max(MIN_CROP_PADDING, int(max(image.size) * CROP_PADDING))
+    return (
+        max(0, (left + box[0]) * factor - padding),
+        max(0, (top + box[1]) * factor - padding),
+        min(image.width, (left + box[2]) * factor + padding),
+        min(image.height, (top + box[3]) * factor + padding),
+    )
+
+
+def skew_angle(image, max_angle):
+    """
+    Estimate the skew of text lines in an 'L' image, in degrees
+    counter-clockwise, by projection profiles: rotated by the right angle the
+    lines line up with the rows and the row sums of ink change most sharply
+    between lines and gaps.
+    """
+    small, _ = _reduced(image)
+    ink = _ink_mask(small)
+
+    def score(angle):
+        profile = _profile(ink.rotate(angle, Image.NEAREST, expand=True, fillcolor=0), 0)
+        return sum((b - a) ** 2 for a, b in zip(profile, profile[1:]))
+
+    steps = int(max_angle / DESKEW_STEP)
+    best_angle = max((step * DESKEW_STEP for step in range(-steps, steps + 1)), key=score)
+    return max((best_angle - DESKEW_STEP / 2, best_angle, best_angle + DESKEW_STEP / 2), key=score)
+
+
+def text_height(image):
+    """
+    The median height in pixels of the text lines of an 'L' image, measured
+    as runs of rows holding ink, or None if no lines were found.
+    """
+    small, factor = _reduced(image)
+    ink = _ink_mask(small)
+    # A row belongs to a line if a little of it is ink; 255 * 1% as a mean
+    rows = [mean > 2.5 for mean in _profile(ink, 0)]
+    runs = []
+    length = 0
+    for is_ink in rows + [False]:
+        if is_ink:
+            length += 1
+        elif length:
+            if length >= MIN_INK_ROWS:
+                runs.append(length)
+            length = 0
+    if not runs:
+        return None
+    return statistics.median(runs) * factor
+
+
+def binarize(image, window):
+    """
+    Threshold an 'L' image against the mean of each pixel's window x window
+    neighbourhood, which copes with the uneven lighting and faded print of
+    scanned thermal paper where one global threshold would not. Returns a
+    bilevel image.
+    """
+    background = image.filter(ImageFilter.BoxBlur(max(1, window // 2)))
+    darkness = ImageChops.subtract(background, image)
+    return darkness.point(lambda value: 0 if value > THRESHOLD_OFFSET else 255, '1')
+
+
+def preprocess_page(image, options):
+    """
+    Prepare a rendered page for OCR as the OCR_* options ask. Returns the
+    prepared image and the PageTransform from it back to the page. The
+    caller keeps ownership of the image passed in.
+    """
+    transform = PageTransform(image.size)
+    page = image.convert('L') if image.mode != 'L' else image.copy()
+
+    if options['OCR_AUTOCROP']:
+        box = content_box(page)
+        if box is not None and box != (0, 0) + page.size:
+            page = page.crop(box)
+            transform.crop(box)
+
+    if options['OCR_DESKEW'] and options['OCR_DESKEW_MAX_ANGLE']:
+        angle = skew_angle(page, options['OCR_DESKEW_MAX_ANGLE'])
+        if abs(angle) >= DESKEW_MIN_ANGLE:
+            rotated = page.rotate(angle, Image.BICUBIC, expand=True, fillcolor=255)
+            transform.rotate(angle, page.size, rotated.size)
+            page = rotated
+            if options['OCR_AUTOCROP']:
+                # Rotation leaves white corners and moves the margins
+                box = content_box(page)
+                if box is not None:
+                    page = page.crop(box)
+                    transform.crop(box)
+
+    target = options['OCR_TARGET_TEXT_HEIGHT']
+    height = text_height(page) if target else None
+    if height and height > target * DOWNSCALE_MARGIN:
+        factor = target / height
+        page = page.resize((max(1, round(page.width * factor)), max(1, round(page.height * factor))), Image.LANCZOS)
+        transform.scale(factor)
+
+    if options['OCR_BINARIZE']:
+        page = binarize(page, 2 * (target or text_height(page) or 20))
+
+    return page, transform
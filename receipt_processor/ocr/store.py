@@ -0,0 +1,232 @@
+"""
+Compact storage of the extracted text and OCR word boxes of a document.
+
+A stored document is a small JSON header followed by zlib-compressed column
+segments: per page, the words, their boxes, confidences and paragraph/line
+numbers as packed little-endian arrays, and the text of pages that came from
+the PDF text layer. OCR page text is rebuilt from the words, so it is not
+stored twice. Files are memory-mapped on read and only the segments needed
+are decompressed, so reparsing an archive touches the text columns and never
+the boxes.
+
+    magic (8 bytes) | header length (uint32) | header JSON | segments
+"""
+import array
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+MAGIC = b'RCPTOCR1'
+FORMAT_VERSION = 1
+HEADER_LENGTH = struct.Struct('<I')
+COMPRESSION_LEVEL = 6
+
+# Numeric word columns and their array typecodes
+WORD_COLUMNS = {
+    'left': 'H',
+    'top': 'H',
+    'width': 'H',
+    'height': 'H',
+    'conf': 'b',  # Tesseract confidence 0-100, -1 where it has none
+    'par': 'H',  # paragraph number within the page
+    'line': 'H',  # line number within the page
+}
+# Columns stored as signed differences from the previous word, which are mostly 0
+# and compress far better: words run down the page and paragraphs and lines count up
+DELTA_COLUMNS = {'top', 'par', 'line'}
+DELTA_TYPECODE = 'i'
+UINT16_MAX = 0xFFFF
+PAGE_SEPARATOR = '\f'  # the tesseract binary ends each page's plain text with a form feed
+
+
+def words_from_data(data):
+    """
+    Turn pytesseract.image_to_data output (Output.DICT) into word columns,
+    numbering paragraphs and lines from 0 across the page.
+    """
+    words = {'text': [], **{name: [] for name in WORD_COLUMNS}}
+    paragraphs = {}
+    lines = {}
+    for index, text in enumerate(data.get('text', [])):
+        text = text.strip()
+        if data['level'][index] != 5 or not text:
+            continue
+        par_key = (data['block_num'][index], data['par_num'][index])
+        line_key = par_key + (data['line_num'][index],)
+        words['text'].append(text)
+        words['par'].append(paragraphs.setdefault(par_key, len(paragraphs)))
+        words['line'].append(lines.setdefault(line_key, len(lines)))
+        words['conf'].append(max(-1, min(100, int(data['conf'][index]))))
+        for name in ('left', 'top', 'width', 'height'):
+            words[name].append(max(0, min(UINT16_MAX, int(data[name][index]))))
+    return words
+
+
+def text_from_words(words):
+    """
+    Lay words out as Tesseract's plain text output (image_to_string) does: one
+    line per line, paragraphs separated by a blank line and a form feed ending
+    the page. The one difference is that Tesseract also puts a blank line
+    after the last paragraph when a paragraph without words follows it, which
+    image_to_data does not report.
+    """
+    if not words['text']:
+        return PAGE_SEPARATOR
+    lines = []
+    current = None
+    for text, par, line in zip(words['text'], words['par'], words['line']):
+        if current is not None and line == current[1]:
+            lines[-1].append(text)
+            continue
+        if current is not None and par != current[0]:
+            lines.append([])
+        lines.append([text])
+        current = (par, line)
+    return '\n'.join(' '.join(line) for line in lines) + '\n' + PAGE_SEPARATOR
+
+
+def _pack(name, values):
+    if name in DELTA_COLUMNS:
+        packed = array.array(DELTA_TYPECODE, (b - a for a, b in zip([0] + values, values)))
+    else:
+        packed = array.array(WORD_COLUMNS[name], values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(name, data):
+    unpacked = array.array(DELTA_TYPECODE if name in DELTA_COLUMNS else WORD_COLUMNS[name])
+    unpacked.frombytes(data)
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    if name in DELTA_COLUMNS:
+        return list(itertools.accumulate(unpacked))
+    return unpacked.tolist()
+
+
+def encode_pages(pages, settings=None):
+    """
+    Encode {'page', 'source', 'text', 'words'} page dictionaries, where words
+    holds word columns for OCR pages and is None for text layer pages.
+    """
+    segments = []
+    offset = 0
+
+    def add_segment(data):
+        nonlocal offset
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        segments.append(compressed)
+        location = [offset, len(compressed)]
+        offset += len(compressed)
+        return location
+
+    header_pages = []
+    for page in pages:
+        entry = {'page': page['page'], 'source': page['source'], 'columns': {}}
+        words = page.get('words')
+        if words is None:
+            entry['columns']['text'] = add_segment(page['text'].encode('utf-8'))
+        else:
+            entry['words'] = len(words['text'])
+            # Tesseract words never contain whitespace, so a space separates them
+            entry['columns']['words'] = add_segment(' '.join(words['text']).encode('utf-8'))
+            for name in WORD_COLUMNS:
+                entry['columns'][name] = add_segment(_pack(name, words[name]))
+        header_pages.append(entry)
+
+    header = json.dumps(
+        {'version': FORMAT_VERSION, 'settings': settings, 'pages': header_pages}, separators=(',', ':')
+    ).encode('utf-8')
+    return b''.join([MAGIC, HEADER_LENGTH.pack(len(header)), header] + segments)
+
+
+class OCRDocument:
+    """Read access to encoded pages in a buffer such as a memory-mapped file."""
+
+    def __init__(self, buffer):
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a stored OCR document')
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        (header_length,) = HEADER_LENGTH.unpack(buffer[len(MAGIC):header_start])
+        header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported OCR document version {header['version']}")
+        self.buffer = buffer
+        self.settings = header['settings']
+        self.page_entries = header['pages']
+        self._data_start = header_start + header_length
+
+    def _segment(self, entry, name):
+        offset, length = entry['columns'][name]
+        start = self._data_start + offset
+        return zlib.decompress(self.buffer[start:start + length])
+
+    def words(self, index):
+        """Word columns of the page at an index, or None for a text layer page."""
+        entry = self.page_entries[index]
+        if 'words' not in entry['columns']:
+            return None
+        words = {'text': self._segment(entry, 'words').decode('utf-8').split(' ') if entry['words'] else []}
+        for name in WORD_COLUMNS:
+            words[name] = _unpack(name, self._segment(entry, name))
+        return words
+
+    def page_text(self, index):
+        entry = self.page_entries[index]
+        if 'text' in entry['columns']:
+            return self._segment(entry, 'text').decode('utf-8')
+        if not entry['words']:
+            return PAGE_SEPARATOR
+        words = {
+            'text': self._segment(entry, 'words').decode('utf-8').split(' '),
+            'par': _unpack('par', self._segment(entry, 'par')),
+            'line': _unpack('line', self._segment(entry, 'line')),
+        }
+        return text_from_words(words)
+
+    def pages(self, with_words=True):
+        """Decode every page into {'page', 'source', 'text', 'words'} dictionaries."""
+        return [
+            {
+                'page': entry['page'],
+                'source': entry['source'],
+                'text': self.page_text(index),
+                'words': self.words(index) if with_words else None
+            }
+            for index, entry in enumerate(self.page_entries)
+        ]
+
+
+def decode_pages(data):
+    return OCRDocument(data).pages()
+
+
+def document_path(directory, content_hash):
+    """Where the stored OCR output of a document lives, fanned out by digest prefix."""
+    return os.path.join(directory, content_hash[:2], f"{content_hash}.ocr")
+
+
+def save_document(path, pages, settings=None):
+    """Write encoded pages to a file atomically."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(encode_pages(pages, settings))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def load_pages(path, with_words=False):
+    """Memory-map a stored document and decode its pages, skipping the word boxes unless asked."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return OCRDocument(mapped).pages(with_words)
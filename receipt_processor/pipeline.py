@@ -0,0 +1,185 @@
+import os
+import uuid
+from datetime import datetime
+
+from receipt_processor import db
+from receipt_processor.metrics import collect_timings, timed
+from receipt_processor.models.receipt import Receipt, ReceiptItem
+from receipt_processor.ocr.store import load_pages
+from receipt_processor.progress import PROGRESS_PARSED, report
+from receipt_processor.search import index_receipts
+from receipt_processor.stats import add_receipt, apply_rollup_deltas, item_sums, subtract_stored_receipts
+from receipt_processor.routes.utils import (
+    extract_pages_from_pdf, get_ocr_options, join_page_texts, parse_receipt_text, save_extracted_pages
+)
+from receipt_processor.validation import is_valid_pdf
+
+
+class PipelineError(Exception):
+    """Raised when a receipt cannot be turned into structured data."""
+
+
+def run_pipeline(file_path, ocr_options=None, content_hash=None):
+    """
+    Run text extraction and parsing for a receipt file.
+    This runs inside OCR worker processes, so it must not touch the database
+    or depend on an application context; OCR settings are passed in as a dict.
+    Pages and parsing are reported to the progress listener as they finish.
+    Returns the parsed data, the extracted text, the extraction path each page
+    took, where the extracted pages were stored for reparsing and the seconds
+    spent in each stage.
+    """
+    ocr_options = ocr_options or get_ocr_options()
+    with collect_timings() as timings, timed('pipeline'):
+        try:
+            pages = extract_pages_from_pdf(file_path, ocr_options, content_hash)
+        except Exception as e:
+            raise PipelineError(f"Failed to extract text from PDF: {str(e)}") from e
+
+        extracted_text = join_page_texts(pages)
+        if not extracted_text:
+            raise PipelineError("Failed to extract text from PDF")
+
+        ocr_path = save_extracted_pages(file_path, pages, ocr_options, content_hash)
+        parsed = parse_receipt_text(extracted_text)
+        report(PROGRESS_PARSED, **parsed_summary(parsed))
+
+    return {
+        'parsed': parsed,
+        'text': extracted_text,
+        'pages': [{'page': page['page'], 'source': page['source']} for page in pages],
+        'ocr_path': ocr_path,
+        'timings': timings.as_dict()
+    }
+
+
+def reprocess_file(file_path, ocr_options, validation_settings, content_hash=None):
+    """
+    Validate a stored receipt file and, if it is a valid PDF, run the pipeline
+    on it. Runs in the reprocess command's worker processes, under the same
+    constraints as run_pipeline. Returns {'is_valid', 'invalid_reason',
+    'result'}, where result is run_pipeline's and None for invalid files.
+    """
+    if not os.path.exists(file_path):
+        return {'is_valid': False, 'invalid_reason': "File does not exist", 'result': None}
+    is_valid, invalid_reason = is_valid_pdf(file_path, options=validation_settings)
+    if not is_valid:
+        return {'is_valid': False, 'invalid_reason': invalid_reason, 'result': None}
+    return {'is_valid': True, 'invalid_reason': None, 'result': run_pipeline(file_path, ocr_options, content_hash)}
+
+
+def load_stored_text(receipt_file):
+    """Return the text stored for a receipt file by the OCR store, or None if there is none."""
+    if not receipt_file.ocr_path:
+        return None
+    try:
+        with timed('ocr_load'):
+            return join_page_texts(load_pages(receipt_file.ocr_path))
+    except (OSError, ValueError):
+        return None
+
+
+def receipt_fields(parsed_data):
+    return {
+        'purchased_at': parsed_data.get('purchased_at'),
+        'merchant_name': parsed_data.get('merchant_name'),
+        'total_amount': parsed_data.get('total_amount'),
+        'currency': parsed_data.get('currency'),
+        'payment_method': parsed_data.get('payment_method'),
+        'tax_amount': parsed_data.get('tax_amount'),
+        'receipt_number': parsed_data.get('receipt_number')
+    }
+
+
+def parsed_summary(parsed_data):
+    """The receipt fields and item count of parsed data, as JSON-ready values."""
+    fields = receipt_fields(parsed_data)
+    if fields['purchased_at'] is not None:
+        fields['purchased_at'] = fields['purchased_at'].isoformat()
+    return dict(fields, items=len(parsed_data.get('items', [])))
+
+
+def _item_rows(receipt_id, parsed_data):
+    return [
+        {
+            'id': str(uuid.uuid4()),
+            'receipt_id': receipt_id,
+            'item_name': item_data.get('item_name'),
+            'quantity': item_data.get('quantity'),
+            'unit_price': item_data.get('unit_price'),
+            'total_price': item_data.get('total_price')
+        }
+        for item_data in parsed_data.get('items', [])
+    ]
+
+
+def store_receipts(entries):
+    """
+    Bulk insert receipts, their items and their search documents for
+    (receipt_file, parsed_data) pairs, add them to the rollups and mark the
+    files processed. The parsed data may carry the extracted 'text' to index.
+    The caller commits. Returns the new receipt ids.
+    """
+    receipt_rows = []
+    item_rows = []
+    rollup_deltas = {}
+    for receipt_file, parsed_data in entries:
+        receipt_id = str(uuid.uuid4())
+        fields = receipt_fields(parsed_data)
+        receipt_rows.append({
+            'id': receipt_id,
+            'receipt_file_id': receipt_file.id,
+            **fields,
+            'file_path': receipt_file.file_path,
+            'timings': parsed_data.get('timings')
+        })
+
+        # Add receipt items if extracted
+        item_rows.extend(_item_rows(receipt_id, parsed_data))
+        add_receipt(rollup_deltas, fields, *item_sums(parsed_data.get('items', [])))
+
+        # Mark the receipt file as processed
+        receipt_file.is_processed = True
+
+    if receipt_rows:
+        db.session.execute(db.insert(Receipt), receipt_rows)
+    if item_rows:
+        db.session.execute(db.insert(ReceiptItem), item_rows)
+    receipt_ids = [row['id'] for row in receipt_rows]
+    index_receipts([(receipt_id, parsed_data) for receipt_id, (_, parsed_data) in zip(receipt_ids, entries)])
+    apply_rollup_deltas(rollup_deltas)
+
+    return receipt_ids
+
+
+def update_receipts(entries):
+    """
+    Overwrite the parsed fields, items and search documents of existing
+    receipts with newly parsed data, for (receipt, parsed_data) pairs, moving
+    their contributions to the rollups. The caller commits.
+    """
+    if not entries:
+        return
+    updated_at = datetime.utcnow()
+    receipt_rows = [
+        {'id': receipt.id, **receipt_fields(parsed_data), 'updated_at': updated_at}
+        for receipt, parsed_data in entries
+    ]
+    item_rows = [row for receipt, parsed_data in entries for row in _item_rows(receipt.id, parsed_data)]
+
+    receipt_ids = [receipt.id for receipt, _ in entries]
+    rollup_deltas = {}
+    subtract_stored_receipts(rollup_deltas, receipt_ids)
+    for row, (_, parsed_data) in zip(receipt_rows, entries):
+        add_receipt(rollup_deltas, row, *item_sums(parsed_data.get('items', [])))
+    db.session.execute(
+        db.delete(ReceiptItem).where(ReceiptItem.receipt_id.in_(receipt_ids)).execution_options(synchronize_session=False)
+    )
+    db.session.execute(db.update(Receipt), receipt_rows)
+    if item_rows:
+        db.session.execute(db.insert(ReceiptItem), item_rows)
+    index_receipts([(receipt.id, parsed_data) for receipt, parsed_data in entries], replace=True)
+    apply_rollup_deltas(rollup_deltas)
+    # Loaded receipts would otherwise keep their old fields and items
+    for receipt, _ in entries:
+        db.session.expire(receipt)
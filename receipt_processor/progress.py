@@ -0,0 +1,29 @@
+import contextvars
+from contextlib import contextmanager
+
+PROGRESS_EXTRACTING = 'extracting'  # the document's page count is known
+PROGRESS_PAGE = 'page'  # a page's text has been read, from its text layer, OCR or the OCR cache
+PROGRESS_PARSED = 'parsed'  # the receipt fields have been extracted from the text
+
+_current_listener = contextvars.ContextVar('progress_listener', default=None)
+
+
+@contextmanager
+def report_progress(listener):
+    """
+    Call listener(event, data) for the progress reported within the block,
+    including from OCR threads running in a copy of this context. The
+    listener must be thread-safe.
+    """
+    token = _current_listener.set(listener)
+    try:
+        yield
+    finally:
+        _current_listener.reset(token)
+
+
+def report(event, **data):
+    """Report a pipeline event to the current listener, if anyone is listening."""
+    listener = _current_listener.get()
+    if listener is not None:
+        listener(event, data)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+from werkzeug.http import is_resource_modified
+
+from receipt_processor.metrics import timed
+
+RECEIPT = 'receipt'
+RECEIPTS = 'receipts'
+RECEIPT_FILE = 'receipt_file'
+RECEIPT_FILES = 'receipt_files'
+
+_cache_lock = threading.Lock()
+
+
+class ResponseCache:
+    """
+    In-process LRU of serialized JSON bodies, bounded by their total size.
+    Entries are keyed by (kind, resource) and hold the ETag they were built
+    for, so an entry whose rows have changed since is rebuilt rather than
+    served. Each server process keeps its own.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, etag):
+        """Return the body cached for a key if it was built for this ETag, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, etag, body):
+        """Store a body, evicting least recently used entries beyond the size limit."""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (etag, body)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, kind, resources=None):
+        """Drop the entries of some resources of a kind, or every entry of the kind."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == kind and (resources is None or key[1] in resources)]:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+def get_response_cache():
+    """Return this process's response cache for the app, creating it on first use."""
+    with _cache_lock:
+        cache = current_app.extensions.get('response_cache')
+        if cache is None:
+            cache = current_app.extensions['response_cache'] = ResponseCache(current_app.config['RESPONSE_CACHE_MAX_BYTES'])
+        return cache
+
+
+def forget_receipt_files(receipt_file_ids):
+    """Drop cached responses that show these receipt files once a route has added or changed them."""
+    cache = get_response_cache()
+    cache.invalidate(RECEIPT_FILE, set(receipt_file_ids))
+    cache.invalidate(RECEIPT_FILES)
+
+
+def forget_receipts(receipt_ids):
+    """Drop cached responses that show these receipts once a route has changed them."""
+    cache = get_response_cache()
+    cache.invalidate(RECEIPT, set(receipt_ids))
+    cache.invalidate(RECEIPTS)
+
+
+def make_etag(kind, versions):
+    """
+    ETag of a resource from its versions: the (id, updated_at) of the rows it
+    is built from, in order, and any other value the response holds.
+    """
+    payload = json.dumps([kind, versions], default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def cached_json(kind, resource, versions, build, last_modified=None):
+    """
+    Respond with the JSON that build() returns for a resource, given its
+    versions as make_etag takes them. Returns 304 when the client's
+    If-None-Match (or If-Modified-Since) shows it has this version already,
+    and otherwise serves the body from the response cache when it was built
+    for the same version. Clients are asked to revalidate on every use.
+    """
+    etag = make_etag(kind, versions)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        cache = get_response_cache()
+        key = (kind, resource)
+        body = cache.get(key, etag)
+        if body is None:
+            with timed('serialize'):
+                response = jsonify(build())
+            cache.put(key, etag, response.get_data())
+        else:
+            response = current_app.response_class(body, mimetype=current_app.json.mimetype)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,86 @@
+import json
+import time
+
+from receipt_processor import db
+from receipt_processor.models.job import (
+    EVENT_COMPLETED, EVENT_FAILED, JOB_COMPLETED, JOB_FAILED, TERMINAL_EVENTS, ProcessingJob, ProcessingJobEvent
+)
+
+EVENT_BATCH_SIZE = 100  # events read per query
+HEARTBEAT_INTERVAL = 15  # seconds of silence before a comment line keeps proxies from closing the stream
+RECONNECT_DELAY_MS = 1000  # how soon EventSource reconnects after the stream ends
+
+
+def parse_event_id(value):
+    """Read the id of the last event a client has seen. Raises ValueError on bad values."""
+    try:
+        event_id = int(value)
+    except ValueError:
+        raise ValueError("Invalid Last-Event-ID, expected an event id")
+    if event_id < 0:
+        raise ValueError("Invalid Last-Event-ID, expected an event id")
+    return event_id
+
+
+def format_event(event_id, event, data):
+    """One Server-Sent Event; JSON has no raw newlines, so the data fits on one line."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data or {})}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def _events_after(job_id, after):
+    return (
+        db.session.query(ProcessingJobEvent.id, ProcessingJobEvent.event, ProcessingJobEvent.data)
+        .filter(ProcessingJobEvent.job_id == job_id, ProcessingJobEvent.id > after)
+        .order_by(ProcessingJobEvent.id)
+        .limit(EVENT_BATCH_SIZE)
+        .all()
+    )
+
+
+def _final_event(job):
+    """The final event of a job whose events have expired, rebuilt from the job."""
+    if job.status == JOB_COMPLETED:
+        return format_event(None, EVENT_COMPLETED, {'receipt_id': job.receipt_id, 'pages': job.pages})
+    return format_event(None, EVENT_FAILED, {'error': job.error})
+
+
+def generate_job_events(job_id, after, poll_interval, timeout):
+    """
+    Yield the events of a job recorded after the event id given, as
+    Server-Sent Events, polling for new ones until the job completes or
+    fails or the timeout passes. Clients reconnect with the last id they saw
+    to carry on. The database connection is returned to the pool between polls.
+    """
+    yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+    deadline = time.monotonic() + timeout
+    last_write = time.monotonic()
+    while True:
+        events = _events_after(job_id, after)
+        if not events:
+            job = db.session.get(ProcessingJob, job_id)
+            if job.status in (JOB_COMPLETED, JOB_FAILED):
+                # The final event is committed with the job's status, possibly since the query above
+                events = _events_after(job_id, after)
+                if not events:
+                    yield _final_event(job)
+                    return
+        db.session.close()
+
+        for event_id, event, data in events:
+            after = event_id
+            yield format_event(event_id, event, data)
+            if event in TERMINAL_EVENTS:
+                return
+        now = time.monotonic()
+        if events:
+            last_write = now
+            continue
+        if now >= deadline:
+            return
+        if now - last_write >= HEARTBEAT_INTERVAL:
+            yield ": keep-alive\n\n"
+            last_write = now
+        time.sleep(poll_interval)
@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+
+from sqlalchemy.orm import selectinload
+
+from receipt_processor.models.receipt import Receipt
+
+EXPORT_CHUNK_SIZE = 1000  # receipts fetched per round trip and written per response chunk
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+RECEIPT_COLUMNS = [
+    'id', 'receipt_file_id', 'purchased_at', 'merchant_name', 'total_amount', 'currency',
+    'payment_method', 'tax_amount', 'receipt_number', 'created_at', 'updated_at'
+]
+ITEM_COLUMNS = ['id', 'item_name', 'quantity', 'unit_price', 'total_price']
+
+
+def export_query(query):
+    """
+    Order a receipt query for export and stream it in chunks from a server-side
+    cursor, loading the items of each chunk with one query.
+    """
+    return (
+        query.options(selectinload(Receipt.items))
+        .order_by(Receipt.updated_at, Receipt.id)
+        .yield_per(EXPORT_CHUNK_SIZE)
+    )
+
+
+def generate_ndjson(query):
+    """Yield one JSON line per receipt, with its items nested."""
+    lines = []
+    for receipt in query:
+        receipt_dict = receipt.to_dict()
+        receipt_dict['items'] = [item.to_dict() for item in receipt.items]
+        lines.append(json.dumps(receipt_dict))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def generate_csv(query):
+    """Yield CSV with one row per receipt item; receipts without items get a single row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(RECEIPT_COLUMNS + [f'item_{column}' for column in ITEM_COLUMNS])
+
+    for count, receipt in enumerate(query, 1):
+        receipt_dict = receipt.to_dict()
+        receipt_row = [receipt_dict[column] for column in RECEIPT_COLUMNS]
+        if receipt.items:
+            for item in receipt.items:
+                writer.writerow(receipt_row + [getattr(item, column) for column in ITEM_COLUMNS])
+        else:
+            writer.writerow(receipt_row + [None] * len(ITEM_COLUMNS))
+
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,112 @@
+import base64
+import json
+from datetime import datetime
+
+from receipt_processor import db
+from receipt_processor.models.receipt import Receipt, ReceiptFile
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+TRUE_VALUES = ('1', 'true', 'yes')
+FALSE_VALUES = ('0', 'false', 'no')
+
+
+def _parse_datetime(args, name):
+    try:
+        return datetime.fromisoformat(args[name])
+    except ValueError:
+        raise ValueError(f"Invalid {name} parameter, expected an ISO 8601 date or datetime")
+
+
+def _parse_float(args, name):
+    try:
+        return float(args[name])
+    except ValueError:
+        raise ValueError(f"Invalid {name} parameter, expected a number")
+
+
+def _parse_bool(args, name):
+    value = args[name].lower()
+    if value not in TRUE_VALUES + FALSE_VALUES:
+        raise ValueError(f"Invalid {name} parameter, expected true or false")
+    return value in TRUE_VALUES
+
+
+def filter_receipts(query, args):
+    """
+    Apply the receipt filters in request args to a query: merchant_name, currency,
+    purchased_from/purchased_to and min_total/max_total. Raises ValueError on bad values.
+    """
+    if 'merchant_name' in args:
+        query = query.filter(Receipt.merchant_name == args['merchant_name'])
+    if 'currency' in args:
+        query = query.filter(Receipt.currency == args['currency'].upper())
+    if 'purchased_from' in args:
+        query = query.filter(Receipt.purchased_at >= _parse_datetime(args, 'purchased_from'))
+    if 'purchased_to' in args:
+        query = query.filter(Receipt.purchased_at <= _parse_datetime(args, 'purchased_to'))
+    if 'min_total' in args:
+        query = query.filter(Receipt.total_amount >= _parse_float(args, 'min_total'))
+    if 'max_total' in args:
+        query = query.filter(Receipt.total_amount <= _parse_float(args, 'max_total'))
+    return query
+
+
+def filter_updated_since(query, model, args):
+    """
+    Keep rows updated at or after the updated_since watermark in request args,
+    if given. Rows at the watermark itself are returned again, since rows
+    sharing a timestamp may have committed after the export that set it.
+    """
+    if 'updated_since' in args:
+        query = query.filter(model.updated_at >= _parse_datetime(args, 'updated_since'))
+    return query
+
+
+def filter_receipt_files(query, args):
+    """Apply the is_valid and is_processed filters in request args to a receipt file query."""
+    for name in ('is_valid', 'is_processed'):
+        if name in args:
+            query = query.filter(getattr(ReceiptFile, name) == _parse_bool(args, name))
+    return query
+
+
+def parse_limit(args, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Read the page size from request args. Raises ValueError on bad values."""
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        raise ValueError("Invalid limit parameter, expected an integer")
+    if not 1 <= limit <= maximum:
+        raise ValueError(f"Invalid limit parameter, expected 1 to {maximum}")
+    return limit
+
+
+def encode_cursor(row):
+    """Encode the position after a row as an opaque cursor."""
+    payload = json.dumps([row.created_at.isoformat(), row.id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor parameter")
+
+
+def paginate(query, model, args):
+    """
+    Return one page of a query and the cursor of the next page (None on the last page).
+    Rows are ordered by (created_at, id) and the cursor is the last row's position, so
+    each page is an index range scan however deep the client pages.
+    """
+    limit = parse_limit(args)
+    if args.get('cursor'):
+        query = query.filter(db.tuple_(model.created_at, model.id) > db.tuple_(*decode_cursor(args['cursor'])))
+
+    rows = query.order_by(model.created_at, model.id).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -1,64 +1,252 @@
+import contextvars
 import os
 import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from receipt_processor import db
-from flask import request, jsonify,Blueprint, current_app
-from receipt_processor.models.receipt import Receipt, ReceiptFile, ReceiptItem
-from receipt_processor.routes.utils import extract_text_from_pdf, generate_unique_filename, is_valid_pdf, parse_receipt_text
+from receipt_processor import db, metrics
+from flask import request, jsonify,Blueprint, current_app, Response, stream_with_context
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import RequestEntityTooLarge
+from receipt_processor.jobs import job_queue
+from receipt_processor.models.job import JOB_COMPLETED, ProcessingJob
+from receipt_processor.models.receipt import Receipt, ReceiptFile
+from receipt_processor.routes.caching import (
+    RECEIPT, RECEIPT_FILE, RECEIPT_FILES, RECEIPTS, cached_json, forget_receipt_files, forget_receipts,
+    get_response_cache
+)
+from receipt_processor.routes.events import generate_job_events, parse_event_id
+from receipt_processor.routes.export import EXPORT_FORMATS, export_query, generate_csv, generate_ndjson
+from receipt_processor.routes.listing import (
+    filter_receipt_files, filter_receipts, filter_updated_since, paginate, parse_limit
+)
+from receipt_processor.ocr.cache import get_ocr_cache
+from receipt_processor.pipeline import load_stored_text, update_receipts
+from receipt_processor.search import (
+    SEARCH_SORTS, SORT_RELEVANCE, build_match_query, decode_search_cursor, encode_search_cursor, search_enabled,
+    search_receipts
+)
+from receipt_processor.stats import (
+    DIMENSION_CURRENCY, DIMENSIONS, MAX_STATS_PAGE_SIZE, STATS_PAGE_SIZE, query_rollups
+)
+from receipt_processor.metrics import timed
+from receipt_processor.routes.utils import (
+    generate_unique_filename, get_ocr_options, iter_batch_uploads, parse_flag, parse_receipt_text, receive_upload
+)
+from receipt_processor.validation import VALIDATION_MODES, is_valid_pdf, validation_options
 
 receipt_bp = Blueprint('receipt', __name__)
 
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+# Time every route, count its queries and add a stage breakdown to the response when ?profile=1
+receipt_bp.before_request(metrics.start_request_timing)
+receipt_bp.after_request(metrics.record_request_timing)
+receipt_bp.teardown_request(metrics.stop_request_timing)
+
+
+@receipt_bp.app_errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    """Report bodies over the configured size limit as JSON, like every other error."""
+    return jsonify({"error": f"Request body is larger than the limit of {request.max_content_length} bytes"}), 413
 
 @receipt_bp.route('/upload', methods=['POST'])
 def upload_receipt():
-    """Upload a receipt file (PDF only)."""
-    if 'file' not in request.files:
+    """Upload a receipt file (PDF only), optionally validating it."""
+    # Parsing the body streams the file to the upload folder, hashing it as it is written
+    with timed('save_upload'):
+        files = request.files
+    if 'file' not in files:
         return jsonify({"error": "No file part"}), 400
     
-    file = request.files['file']
+    file = files['file']
     
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
     
-    if file and file.filename.lower().endswith('.pdf'):
-        # Generate a unique filename
-        filename = generate_unique_filename(file.filename)
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        
-        # Save the file
-        file.save(file_path)
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    upload = receive_upload(file, upload_folder)
+    if file and file.filename.lower().endswith('.pdf') and upload.is_pdf():
+        validate = parse_flag(request.form.get('validate'), default=False)
+        content_hash = upload.content_hash
         
-        # Check if this file has been uploaded before (by comparing content)
-        # This is a simplistic approach and might need improvement
-        file_hash = hash(open(file_path, 'rb').read())
+        # Check if this file has been uploaded before (by comparing content digests)
+        existing_file = ReceiptFile.query.filter_by(content_hash=content_hash).first()
+        if existing_file:
+            return _existing_upload_response(existing_file, upload, validate)
         
-        existing_files = ReceiptFile.query.all()
-        for existing_file in existing_files:
-            existing_path = existing_file.file_path
-            if os.path.exists(existing_path):
-                existing_hash = hash(open(existing_path, 'rb').read())
-                if existing_hash == file_hash:
-                    # Update the existing record
-                    existing_file.updated_at = datetime.utcnow()
-                    db.session.commit()
-                    return jsonify({"message": "File already exists", "receipt_file": existing_file.to_dict()}), 200
+        # Move the file into place under a unique filename
+        file_path = os.path.join(upload_folder, generate_unique_filename(file.filename))
+        upload.save(file_path)
+        is_valid, invalid_reason = is_valid_pdf(file_path) if validate else (False, None)
         
         # Create a new record
         receipt_file = ReceiptFile(
             id=str(uuid.uuid4()),
             file_name=os.path.basename(file.filename),
             file_path=file_path,
-            is_valid=False,
+            content_hash=content_hash,
+            is_valid=is_valid,
+            invalid_reason=invalid_reason,
             is_processed=False
         )
         
         db.session.add(receipt_file)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # The same content was uploaded concurrently and committed first
+            db.session.rollback()
+            existing_file = ReceiptFile.query.filter_by(content_hash=content_hash).first()
+            if not existing_file:
+                raise
+            os.remove(file_path)
+            return _existing_upload_response(existing_file, None, validate)
+        forget_receipt_files([receipt_file.id])
         
         return jsonify({"message": "File uploaded successfully", "receipt_file": receipt_file.to_dict()}), 201
     
     return jsonify({"error": "Invalid file format. Only PDF files are allowed."}), 400
 
+def _existing_upload_response(existing_file, upload, validate):
+    """Respond to a duplicate upload, discarding the new copy unless the stored one has gone missing."""
+    if upload is not None and not os.path.exists(existing_file.file_path):
+        # Keep the new copy in place of the missing one
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], generate_unique_filename(existing_file.file_name))
+        upload.save(file_path)
+        existing_file.file_path = file_path
+    if validate and not existing_file.is_valid and os.path.exists(existing_file.file_path):
+        existing_file.is_valid, existing_file.invalid_reason = is_valid_pdf(existing_file.file_path)
+    # Update the existing record
+    existing_file.updated_at = datetime.utcnow()
+    db.session.commit()
+    forget_receipt_files([existing_file.id])
+    return jsonify({"message": "File already exists", "receipt_file": existing_file.to_dict()}), 200
+
+@receipt_bp.route('/upload/batch', methods=['POST'])
+def upload_receipts_batch():
+    """Upload many receipt files (PDFs, or zip archives of PDFs) and validate them in one transaction."""
+    # Parsing the body streams each file to the upload folder, hashing it as it is written
+    with timed('save_upload'):
+        files = request.files.getlist('files')
+    if not files:
+        return jsonify({"error": "No files part"}), 400
+    
+    validate = parse_flag(request.form.get('validate'), default=True)
+    max_files = current_app.config['BATCH_MAX_FILES']
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    
+    # Move every PDF into place; zip archive members are copied out and hashed on the way
+    results = []
+    saved = []
+    batch_uploads = iter_batch_uploads(
+        files, current_app.config['UPLOAD_MAX_CONTENT_LENGTH'], current_app.config['BATCH_MAX_CONTENT_LENGTH']
+    )
+    for file, error in batch_uploads:
+        result = {"file_name": os.path.basename(file.filename or '')}
+        results.append(result)
+        if error is None and len(saved) >= max_files:
+            error = f"Batch is limited to {max_files} files"
+        upload = None
+        if error is None:
+            try:
+                upload = receive_upload(file, upload_folder)
+            except zipfile.BadZipFile as e:
+                # A member that is corrupt or inflates past its recorded size
+                error = f"Invalid zip archive: {str(e)}"
+        if upload is not None and not upload.is_pdf():
+            upload.close()
+            error = "File is not a PDF"
+        if error is not None:
+            result.update(status="rejected", error=error)
+            continue
+        file_path = os.path.join(upload_folder, generate_unique_filename(file.filename))
+        upload.save(file_path)
+        saved.append((result, file_path, upload.content_hash))
+    
+    # Deduplicate against stored files and within the batch, then insert the rest in one statement
+    pending = saved
+    for attempt in range(2):
+        existing = {
+            rf.content_hash: rf for rf in
+            ReceiptFile.query.filter(ReceiptFile.content_hash.in_({content_hash for _, _, content_hash in pending}))
+        }
+        rows = {}
+        for result, file_path, content_hash in pending:
+            existing_file = existing.get(content_hash)
+            if existing_file is not None:
+                if os.path.exists(existing_file.file_path):
+                    os.remove(file_path)
+                else:
+                    # The stored copy has gone missing, so keep the new one in its place
+                    existing_file.file_path = file_path
+                existing_file.updated_at = datetime.utcnow()
+                result['status'] = "duplicate"
+            elif content_hash in rows:
+                os.remove(file_path)
+                result['status'] = "duplicate"
+            else:
+                is_valid, invalid_reason = is_valid_pdf(file_path) if validate else (False, None)
+                rows[content_hash] = {
+                    'id': str(uuid.uuid4()),
+                    'file_name': result['file_name'],
+                    'file_path': file_path,
+                    'content_hash': content_hash,
+                    'is_valid': is_valid,
+                    'invalid_reason': invalid_reason,
+                    'is_processed': False
+                }
+                result['status'] = "created"
+        
+        try:
+            if rows:
+                db.session.execute(db.insert(ReceiptFile), list(rows.values()))
+            db.session.commit()
+            break
+        except IntegrityError:
+            # Some of the same content was uploaded concurrently and committed first
+            db.session.rollback()
+            if attempt:
+                raise
+            pending = [entry for entry in saved if entry[0]['status'] == "created"]
+    
+    receipt_files = {
+        rf.content_hash: rf.to_dict() for rf in
+        ReceiptFile.query.filter(ReceiptFile.content_hash.in_({content_hash for _, _, content_hash in saved}))
+    }
+    for result, _, content_hash in saved:
+        result['receipt_file'] = receipt_files[content_hash]
+    forget_receipt_files([receipt_file['id'] for receipt_file in receipt_files.values()])
+    
+    return jsonify({
+        "message": "Batch uploaded",
+        "summary": _batch_summary(results),
+        "results": results
+    }), 200
+
+def _batch_summary(results):
+    """Count batch results by status."""
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return summary
+
+def _page_versions(query, model, args):
+    """
+    Page through a query reading only each row's id and updated_at. Returns
+    the page's ids, the next cursor and the versions its ETag is made of.
+    """
+    rows, next_cursor = paginate(query.with_entities(model.id, model.created_at, model.updated_at), model, args)
+    return [row.id for row in rows], next_cursor, [*((row.id, row.updated_at) for row in rows), next_cursor]
+
+def _receipt_with_items(receipt):
+    """A receipt's fields with its items nested, as the receipt routes return it."""
+    receipt_dict = receipt.to_dict()
+    receipt_dict['items'] = [item.to_dict() for item in receipt.items]
+    return receipt_dict
+
 @receipt_bp.route('/validate', methods=['POST'])
 def validate_receipt():
     """Validate if the uploaded file is a valid PDF."""
@@ -67,6 +255,10 @@ def validate_receipt():
     if not data or 'receipt_file_id' not in data:
         return jsonify({"error": "Missing receipt_file_id parameter"}), 400
     
+    mode = data.get('mode')
+    if mode is not None and mode not in VALIDATION_MODES:
+        return jsonify({"error": f"Invalid mode parameter, expected one of: {', '.join(VALIDATION_MODES)}"}), 400
+    
     receipt_file = ReceiptFile.query.get(data['receipt_file_id'])
     
     if not receipt_file:
@@ -76,13 +268,15 @@ def validate_receipt():
         receipt_file.is_valid = False
         receipt_file.invalid_reason = "File does not exist"
         db.session.commit()
+        forget_receipt_files([receipt_file.id])
         return jsonify({"error": "File does not exist", "receipt_file": receipt_file.to_dict()}), 400
     
-    is_valid, invalid_reason = is_valid_pdf(receipt_file.file_path)
+    is_valid, invalid_reason = is_valid_pdf(receipt_file.file_path, mode)
     
     receipt_file.is_valid = is_valid
     receipt_file.invalid_reason = invalid_reason
     db.session.commit()
+    forget_receipt_files([receipt_file.id])
     
     return jsonify({
         "message": "File validated",
@@ -91,6 +285,58 @@ def validate_receipt():
         "receipt_file": receipt_file.to_dict()
     }), 200
 
+@receipt_bp.route('/validate/batch', methods=['POST'])
+def validate_receipts_batch():
+    """Validate many receipt files in one transaction."""
+    data = request.json
+    
+    if not data or not isinstance(data.get('receipt_file_ids'), list):
+        return jsonify({"error": "Missing receipt_file_ids parameter"}), 400
+    
+    mode = data.get('mode')
+    if mode is not None and mode not in VALIDATION_MODES:
+        return jsonify({"error": f"Invalid mode parameter, expected one of: {', '.join(VALIDATION_MODES)}"}), 400
+    
+    receipt_file_ids = list(dict.fromkeys(data['receipt_file_ids']))
+    if len(receipt_file_ids) > current_app.config['BATCH_MAX_FILES']:
+        return jsonify({"error": f"Batch is limited to {current_app.config['BATCH_MAX_FILES']} files"}), 400
+    
+    receipt_files = {rf.id: rf for rf in ReceiptFile.query.filter(ReceiptFile.id.in_(receipt_file_ids))}
+    to_check = [rf for rf in receipt_files.values() if os.path.exists(rf.file_path)]
+    
+    # Full parses run in child processes, so threads check files in parallel
+    options = validation_options()
+    checks = {}
+    if to_check:
+        with ThreadPoolExecutor(max_workers=min(len(to_check), os.cpu_count() or 1)) as executor:
+            futures = {
+                rf.id: executor.submit(contextvars.copy_context().run, is_valid_pdf, rf.file_path, mode, options)
+                for rf in to_check
+            }
+            checks = {receipt_file_id: future.result() for receipt_file_id, future in futures.items()}
+    
+    results = []
+    for receipt_file_id in receipt_file_ids:
+        result = {"receipt_file_id": receipt_file_id}
+        results.append(result)
+        receipt_file = receipt_files.get(receipt_file_id)
+        if not receipt_file:
+            result.update(status="rejected", error="Receipt file not found")
+            continue
+        receipt_file.is_valid, receipt_file.invalid_reason = checks.get(receipt_file_id, (False, "File does not exist"))
+        result['status'] = "valid" if receipt_file.is_valid else "invalid"
+    db.session.commit()
+    forget_receipt_files(receipt_files)
+    for result in results:
+        if result['status'] != "rejected":
+            result['receipt_file'] = receipt_files[result['receipt_file_id']].to_dict()
+    
+    return jsonify({
+        "message": "Batch validated",
+        "summary": _batch_summary(results),
+        "results": results
+    }), 200
+
 @receipt_bp.route('/process', methods=['POST'])
 def process_receipt():
     """Process a receipt file to extract information using OCR."""
@@ -116,105 +362,267 @@ def process_receipt():
         # Update the existing receipt
         receipt_file.is_processed = True
         db.session.commit()
+        forget_receipt_files([receipt_file.id])
         return jsonify({
             "message": "Receipt already processed",
             "receipt": existing_receipt.to_dict(),
             "receipt_file": receipt_file.to_dict()
         }), 200
-    # Extract text from PDF
-    extracted_text = extract_text_from_pdf(receipt_file.file_path)
-    if not extracted_text:
-        return jsonify({"error": "Failed to extract text from PDF"}), 500
-    
-    # Parse the extracted text
-    parsed_data = parse_receipt_text(extracted_text)
-    
-    # Create a new receipt record
-    receipt_id = str(uuid.uuid4())
-    receipt = Receipt(
-        id=receipt_id,
-        receipt_file_id=receipt_file.id,
-        purchased_at=parsed_data.get('purchased_at'),
-        merchant_name=parsed_data.get('merchant_name'),
-        total_amount=parsed_data.get('total_amount'),
-        currency=parsed_data.get('currency'),
-        payment_method=parsed_data.get('payment_method'),
-        tax_amount=parsed_data.get('tax_amount'),
-        receipt_number=parsed_data.get('receipt_number'),
-        file_path=receipt_file.file_path
-    )
+    # Queue the OCR and parsing work for the worker pool
+    job = job_queue.enqueue(receipt_file)
+    forget_receipt_files([receipt_file.id])
     
-    db.session.add(receipt)
+    response = jsonify({
+        "message": "Receipt queued for processing",
+        "job": job.to_dict(),
+        "receipt_file": receipt_file.to_dict()
+    })
+    response.headers['Location'] = f"/jobs/{job.id}"
+    return response, 202
+
+@receipt_bp.route('/process/batch', methods=['POST'])
+def process_receipts_batch():
+    """Queue many receipt files for processing in one transaction."""
+    data = request.json
     
-    # Add receipt items if extracted
-    for item_data in parsed_data.get('items', []):
-        item = ReceiptItem(
-            id=str(uuid.uuid4()),
-            receipt_id=receipt_id,
-            item_name=item_data.get('item_name'),
-            quantity=item_data.get('quantity'),
-            unit_price=item_data.get('unit_price'),
-            total_price=item_data.get('total_price')
-        )
-        db.session.add(item)
+    if not data or not isinstance(data.get('receipt_file_ids'), list):
+        return jsonify({"error": "Missing receipt_file_ids parameter"}), 400
+    
+    receipt_file_ids = list(dict.fromkeys(data['receipt_file_ids']))
+    if len(receipt_file_ids) > current_app.config['BATCH_MAX_FILES']:
+        return jsonify({"error": f"Batch is limited to {current_app.config['BATCH_MAX_FILES']} files"}), 400
+    
+    receipt_files = {rf.id: rf for rf in ReceiptFile.query.filter(ReceiptFile.id.in_(receipt_file_ids))}
+    existing_receipts = {
+        receipt.receipt_file_id: receipt for receipt in
+        Receipt.query.filter(Receipt.receipt_file_id.in_(receipt_files.keys()))
+    }
+    
+    results = []
+    to_enqueue = []
+    for receipt_file_id in receipt_file_ids:
+        result = {"receipt_file_id": receipt_file_id}
+        results.append(result)
+        receipt_file = receipt_files.get(receipt_file_id)
+        if not receipt_file:
+            result.update(status="rejected", error="Receipt file not found")
+        elif not receipt_file.is_valid:
+            result.update(status="rejected", error="Cannot process invalid file")
+        elif not os.path.exists(receipt_file.file_path):
+            result.update(status="rejected", error="File does not exist")
+        elif receipt_file.id in existing_receipts:
+            receipt_file.is_processed = True
+            result.update(status="processed", receipt=existing_receipts[receipt_file.id].to_dict())
+        else:
+            result['status'] = "queued"
+            to_enqueue.append((result, receipt_file))
+    db.session.commit()
+    forget_receipt_files(receipt_files)
     
-    # Mark the receipt file as processed
-    receipt_file.is_processed = True
+    # Queue the OCR and parsing work for the worker pool
+    jobs = job_queue.enqueue_many([receipt_file for _, receipt_file in to_enqueue])
+    for (result, _), job in zip(to_enqueue, jobs):
+        result['job'] = job.to_dict()
     
-    db.session.commit()
+    return jsonify({
+        "message": "Batch queued for processing",
+        "summary": _batch_summary(results),
+        "results": results
+    }), 202
+
+@receipt_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status of a processing job, with the receipt once it has completed."""
+    job = ProcessingJob.query.get(job_id)
     
-    # Get the items for the response
-    items = [item.to_dict() for item in ReceiptItem.query.filter_by(receipt_id=receipt_id).all()]
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
     
-    receipt_dict = receipt.to_dict()
-    receipt_dict['items'] = items
+    response = {"job": job.to_dict()}
+    if job.status == JOB_COMPLETED and job.receipt_id:
+        receipt = Receipt.query.get(job.receipt_id)
+        if receipt:
+            response["receipt"] = _receipt_with_items(receipt)
     
-    return jsonify({
-        "message": "Receipt processed successfully",
-        "receipt": receipt_dict,
-        "receipt_file": receipt_file.to_dict()
-    }), 201
+    return jsonify(response), 200
+
+@receipt_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Stream the progress of a processing job as Server-Sent Events until it completes or fails."""
+    if not db.session.query(ProcessingJob.id).filter(ProcessingJob.id == job_id).first():
+        return jsonify({"error": "Job not found"}), 404
+    try:
+        after = parse_event_id(request.headers.get('Last-Event-ID', request.args.get('after', '0')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    events = generate_job_events(
+        job_id, after, current_app.config['JOB_EVENTS_POLL_INTERVAL'], current_app.config['JOB_EVENTS_TIMEOUT']
+    )
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # keep nginx from buffering the stream
+    return response
 
 @receipt_bp.route('/receipts', methods=['GET'])
 def get_receipts():
-    """List all receipts."""
-    receipts = Receipt.query.all()
-    receipts_with_items = []
-    
-    for receipt in receipts:
-        receipt_dict = receipt.to_dict()
-        items = [item.to_dict() for item in ReceiptItem.query.filter_by(receipt_id=receipt.id).all()]
-        receipt_dict['items'] = items
-        receipts_with_items.append(receipt_dict)
-    
-    return jsonify({"receipts": receipts_with_items}), 200
+    """List receipts a page at a time, optionally filtered."""
+    try:
+        receipt_ids, next_cursor, versions = _page_versions(filter_receipts(Receipt.query, request.args), Receipt, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def build():
+        receipts = Receipt.query.options(selectinload(Receipt.items)).filter(Receipt.id.in_(receipt_ids))
+        receipts = {receipt.id: receipt for receipt in receipts}
+        return {
+            "receipts": [_receipt_with_items(receipts[receipt_id]) for receipt_id in receipt_ids if receipt_id in receipts],
+            "next_cursor": next_cursor
+        }
+    
+    return cached_json(RECEIPTS, request.query_string, versions, build)
 
 @receipt_bp.route('/receipts/<receipt_id>', methods=['GET'])
 def get_receipt(receipt_id):
     """Get details of a specific receipt."""
+    row = db.session.query(Receipt.updated_at).filter(Receipt.id == receipt_id).first()
+    
+    if not row:
+        return jsonify({"error": "Receipt not found"}), 404
+    
+    def build():
+        return {"receipt": _receipt_with_items(Receipt.query.get(receipt_id))}
+    
+    return cached_json(RECEIPT, receipt_id, [(receipt_id, row.updated_at)], build, last_modified=row.updated_at)
+
+@receipt_bp.route('/receipts/<receipt_id>/reparse', methods=['POST'])
+def reparse_receipt(receipt_id):
+    """Rerun extraction on the stored text of a receipt, without OCR."""
     receipt = Receipt.query.get(receipt_id)
     
     if not receipt:
         return jsonify({"error": "Receipt not found"}), 404
     
-    receipt_dict = receipt.to_dict()
-    items = [item.to_dict() for item in ReceiptItem.query.filter_by(receipt_id=receipt.id).all()]
-    receipt_dict['items'] = items
+    text = load_stored_text(ReceiptFile.query.get(receipt.receipt_file_id))
+    if not text:
+        return jsonify({"error": "No stored text for this receipt; process its file again"}), 409
+    
+    update_receipts([(receipt, dict(parse_receipt_text(text), text=text))])
+    db.session.commit()
+    forget_receipts([receipt.id])
     
-    return jsonify({"receipt": receipt_dict}), 200
+    return jsonify({"message": "Receipt reparsed", "receipt": _receipt_with_items(receipt)}), 200
+
+@receipt_bp.route('/search', methods=['GET'])
+def search():
+    """Full-text search over merchant names, receipt numbers, item names and receipt text."""
+    if not search_enabled():
+        return jsonify({"error": "Full-text search requires a SQLite database with FTS5"}), 501
+    
+    match_query = build_match_query(request.args.get('q', ''))
+    if match_query is None:
+        return jsonify({"error": "Missing q parameter"}), 400
+    sort = request.args.get('sort', SORT_RELEVANCE)
+    if sort not in SEARCH_SORTS:
+        return jsonify({"error": f"Invalid sort parameter, expected one of: {', '.join(SEARCH_SORTS)}"}), 400
+    try:
+        limit = parse_limit(request.args, default=SEARCH_PAGE_SIZE, maximum=MAX_SEARCH_PAGE_SIZE)
+        offset = decode_search_cursor(request.args['cursor']) if request.args.get('cursor') else 0
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    hits = search_receipts(match_query, limit, offset, sort, current_app.config['SEARCH_RANK_WINDOW'])
+    next_cursor = encode_search_cursor(offset + limit) if len(hits) > limit else None
+    hits = hits[:limit]
+    
+    receipts = Receipt.query.options(selectinload(Receipt.items)).filter(Receipt.id.in_([hit[0] for hit in hits]))
+    receipts = {receipt.id: receipt for receipt in receipts}
+    results = []
+    for receipt_id, score, snippet in hits:
+        if receipt_id not in receipts:
+            continue
+        results.append({"receipt": _receipt_with_items(receipts[receipt_id]), "score": score, "snippet": snippet})
+    
+    return jsonify({"results": results, "next_cursor": next_cursor}), 200
+
+@receipt_bp.route('/stats', methods=['GET'])
+def get_stats():
+    """Receipt and item totals per currency, read from the rollups."""
+    totals = query_rollups(DIMENSION_CURRENCY, {})
+    return jsonify({"totals": [row.to_dict() for row in totals], "dimensions": list(DIMENSIONS)}), 200
+
+@receipt_bp.route('/stats/<dimension>', methods=['GET'])
+def get_stats_by(dimension):
+    """Receipt and item totals per merchant, month, currency or payment method, read from the rollups."""
+    if dimension not in DIMENSIONS:
+        return jsonify({"error": f"Unknown dimension, expected one of: {', '.join(DIMENSIONS)}"}), 404
+    try:
+        limit = parse_limit(request.args, default=STATS_PAGE_SIZE, maximum=MAX_STATS_PAGE_SIZE)
+        groups = query_rollups(dimension, request.args).limit(limit).all()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({"dimension": dimension, "groups": [row.to_dict() for row in groups]}), 200
+
+@receipt_bp.route('/export', methods=['GET'])
+def export_receipts():
+    """Stream receipts and their items as NDJSON or CSV, optionally filtered."""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Invalid format parameter, expected ndjson or csv"}), 400
+    
+    try:
+        query = filter_updated_since(filter_receipts(Receipt.query, request.args), Receipt, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    generate = generate_csv if export_format == 'csv' else generate_ndjson
+    response = Response(stream_with_context(generate(export_query(query))), mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f"attachment; filename=receipts.{export_format}"
+    return response
 
 @receipt_bp.route('/receipt-files', methods=['GET'])
 def get_receipt_files():
-    """List all receipt files."""
-    receipt_files = ReceiptFile.query.all()
-    return jsonify({"receipt_files": [rf.to_dict() for rf in receipt_files]}), 200
+    """List receipt files a page at a time, optionally filtered."""
+    try:
+        query = filter_receipt_files(ReceiptFile.query, request.args)
+        receipt_file_ids, next_cursor, versions = _page_versions(query, ReceiptFile, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def build():
+        receipt_files = {rf.id: rf for rf in ReceiptFile.query.filter(ReceiptFile.id.in_(receipt_file_ids))}
+        return {
+            "receipt_files": [receipt_files[rf_id].to_dict() for rf_id in receipt_file_ids if rf_id in receipt_files],
+            "next_cursor": next_cursor
+        }
+    
+    return cached_json(RECEIPT_FILES, request.query_string, versions, build)
 
 @receipt_bp.route('/receipt-files/<receipt_file_id>', methods=['GET'])
 def get_receipt_file(receipt_file_id):
     """Get details of a specific receipt file."""
-    receipt_file = ReceiptFile.query.get(receipt_file_id)
+    row = db.session.query(ReceiptFile.updated_at).filter(ReceiptFile.id == receipt_file_id).first()
     
-    if not receipt_file:
+    if not row:
         return jsonify({"error": "Receipt file not found"}), 404
     
-    return jsonify({"receipt_file": receipt_file.to_dict()}), 200
\ No newline at end of file
+    def build():
+        return {"receipt_file": ReceiptFile.query.get(receipt_file_id).to_dict()}
+    
+    return cached_json(RECEIPT_FILE, receipt_file_id, [(receipt_file_id, row.updated_at)], build,
+                       last_modified=row.updated_at)
+
+@receipt_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose request, stage, page, OCR cache and response cache metrics in the Prometheus text format."""
+    stats = get_response_cache().stats()
+    for field in ('entries', 'bytes', 'hits', 'misses', 'evictions'):
+        metrics.RESPONSE_CACHE.set(stats[field], field=field)
+    options = get_ocr_options()
+    if options['OCR_CACHE_DIR']:
+        stats = get_ocr_cache(options['OCR_CACHE_DIR'], options['OCR_CACHE_MAX_BYTES']).stats()
+        for field in ('entries', 'bytes', 'hits', 'misses', 'evictions'):
+            metrics.OCR_CACHE.set(stats[field], field=field)
+    
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
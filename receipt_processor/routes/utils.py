@@ -1,25 +1,159 @@
+import contextvars
+import hashlib
+import logging
+import os
+import tempfile
 import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from flask import current_app
+from flask import current_app, has_app_context
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 import pdf2image
-import pytesseract
 import re
 import PyPDF2
-from dateutil import parser as date_parser
-from receipt_processor.nlp.spacy_model import nlp
+from receipt_processor.metrics import timed
+from receipt_processor.nlp.extractor import receipt_extractor
+from receipt_processor.ocr.cache import get_ocr_cache
+from receipt_processor.ocr.engine import ENGINE_AUTO, get_ocr_engine
+from receipt_processor.ocr.preprocess import preprocess_page
+from receipt_processor.progress import PROGRESS_EXTRACTING, PROGRESS_PAGE, report
+from receipt_processor.validation import PDF_HEADER, PDF_SNIFF_SIZE
+from receipt_processor.ocr.store import (
+    FORMAT_VERSION, decode_pages, document_path, encode_pages, save_document, text_from_words, words_from_data
+)
 
-def is_valid_pdf(file_path):
-    """Check if a file is a valid PDF."""
+# Shares the Flask app logger's handlers; usable in OCR worker processes without an app context
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+class UploadFile:
+    """
+    A temporary file in the upload folder that hashes the bytes written to it
+    and keeps the first of them, so an upload is stored, hashed and sniffed in
+    one pass. Werkzeug streams multipart file parts straight into it (see
+    ReceiptRequest), and save() renames it into place. A file that was never
+    saved is removed when closed.
+    """
+
+    def __init__(self, directory):
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.head = b''
+        self.size = 0
+
+    def write(self, data):
+        self._digest.update(data)
+        if len(self.head) < PDF_SNIFF_SIZE:
+            self.head += bytes(data[:PDF_SNIFF_SIZE - len(self.head)])
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read, seek and the rest of the file interface werkzeug expects
+        return getattr(self._file, name)
+
+    @property
+    def content_hash(self):
+        return self._digest.hexdigest()
+
+    def is_pdf(self):
+        """Whether the content starts like a PDF."""
+        return PDF_HEADER in self.head
+
+    def save(self, file_path):
+        """Move the file to its final path; the rename is atomic within the upload folder."""
+        self._file.close()
+        os.replace(self.temp_path, file_path)
+        self.temp_path = None
+
+    def close(self):
+        self._file.close()
+        if self.temp_path is not None:
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
+            self.temp_path = None
+
+def receive_upload(file, directory, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Return an uploaded file as an UploadFile. Request files were already
+    streamed into one while the request was parsed; other streams, such as
+    zip archive members, are copied into one here. Copying stops once the
+    first bytes show the content is not a PDF, so check is_pdf() before
+    using the file.
+    """
+    if isinstance(file.stream, UploadFile):
+        return file.stream
+    upload = UploadFile(directory)
     try:
-        with open(file_path, 'rb') as f:
-            reader = PyPDF2.PdfReader(f)
-            if len(reader.pages) > 0:
-                return True, None
-            else:
-                return False, "PDF has no pages"
-    except Exception as e:
-        return False, str(e)
+        with timed('save_upload'):
+            for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+                upload.write(chunk)
+                if len(upload.head) >= PDF_SNIFF_SIZE and not upload.is_pdf():
+                    break
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+def hash_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a file on disk, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def iter_batch_uploads(files, max_member_size, max_extracted_size):
+    """
+    Yield (file, error) for every PDF in a batch upload. Zip archives are opened
+    and each PDF inside them is yielded as its own file; anything else is yielded
+    with an error so it appears in the batch report. Once the members extracted
+    from the batch's archives would exceed max_extracted_size bytes in all,
+    the remaining members are rejected without being read.
+    """
+    extracted = 0
+    for file in files:
+        name = file.filename or ''
+        if name.lower().endswith('.pdf'):
+            yield file, None
+        elif name.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile as e:
+                yield file, f"Invalid zip archive: {str(e)}"
+                continue
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                        continue
+                    member = FileStorage(filename=info.filename)
+                    if not info.filename.lower().endswith('.pdf'):
+                        yield member, "Invalid file format. Only PDF files are allowed."
+                    elif info.file_size > max_member_size:
+                        yield member, "File is too large"
+                    elif extracted + info.file_size > max_extracted_size:
+                        # zipfile never inflates a member past its recorded size, so this bounds what is written
+                        extracted = max_extracted_size + 1
+                        yield member, f"Zip archives in the batch extract to more than {max_extracted_size} bytes"
+                    else:
+                        extracted += info.file_size
+                        with archive.open(info) as stream:
+                            member.stream = stream
+                            yield member, None
+        else:
+            yield file, "Invalid file format. Only PDF or zip files are allowed."
+
+def parse_flag(value, default=False):
+    """Read a boolean form or query parameter such as validate=true."""
+    if value is None or value == '':
+        return default
+    return value.lower() not in ('0', 'false', 'no', 'off')
 
 def generate_unique_filename(original_filename):
     """Generate a unique filename to avoid overwrites."""
@@ -28,200 +162,292 @@ def generate_unique_filename(original_filename):
     unique_filename = f"{uuid.uuid4().hex}.{ext}"
     return unique_filename
 
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF using OCR."""
+# Letters, digits, the punctuation printed on receipts and the space, without which Tesseract 5 runs the words of a line together
+RECEIPT_CHARACTERS = (
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789 '
+    '.,:;!?\'"-/\\()[]#$%&*+=@_€£¥'
+)
+
+# OCR settings read from the Flask config; workers receive a plain dict of them
+OCR_DEFAULTS = {
+    'OCR_DPI': 200,
+    'OCR_CONCURRENCY': None,  # pages OCR'd in parallel per document; None shares the cores among OCR_WORKERS
+    'OCR_PAGE_WINDOW': 2,  # pages rasterized per pdf2image call when streaming
+    'OCR_STREAMING': True,
+    'OCR_TEXT_LAYER': True,  # use the embedded text of digital PDFs where usable
+    'TEXT_LAYER_MIN_CHARS': 20,  # non-whitespace characters a page needs to skip OCR
+    'TEXT_LAYER_MIN_WORD_RATIO': 0.7,  # share of tokens that must look like clean words or amounts
+    'OCR_ENGINE': ENGINE_AUTO,  # tesserocr, pytesseract, or auto for tesserocr where installed (see ocr.engine)
+    'OCR_LANG': 'eng',
+    # The next three change OCR output, so they stay off until bench_preprocess shows a win without losing accuracy
+    'OCR_PSM': None,  # Tesseract page segmentation mode, e.g. 4 to read a single column of lines; None keeps Tesseract's default
+    'OCR_CHAR_WHITELIST': None,  # characters Tesseract may recognize, e.g. RECEIPT_CHARACTERS; None allows all
+    'OCR_PREPROCESS': False,  # prepare pages for Tesseract as below (see ocr.preprocess)
+    'OCR_AUTOCROP': True,  # crop to the receipt, dropping blank margins and dark scanner background
+    'OCR_DESKEW': True,
+    'OCR_DESKEW_MAX_ANGLE': 5,  # degrees either way searched for skew
+    'OCR_TARGET_TEXT_HEIGHT': 40,  # pixels; pages with taller text lines are scaled down, None disables
+    'OCR_BINARIZE': True,  # adaptive threshold to black text on white
+    'OCR_CACHE_DIR': 'ocr_cache',  # None disables the OCR result cache
+    'OCR_CACHE_MAX_BYTES': 512 * 1024 * 1024,
+    'OCR_STORE_DIR': 'ocr_store',  # where page text and word boxes are kept for reparsing; None disables
+}
+
+PAGE_SOURCE_TEXT_LAYER = 'text_layer'
+PAGE_SOURCE_OCR = 'ocr'
+PAGE_SOURCE_OCR_CACHE = 'ocr_cache'
+
+# Words, numbers, amounts and short symbol runs such as '#' or '****1234'. Invisible
+# text layers left by poor scanner OCR are mostly tokens that fail this pattern.
+CLEAN_TOKEN_RE = re.compile(
+    r"[(\"']?(?:[A-Za-z]+(?:['-][A-Za-z]+)*|[$€£¥]?\d+(?:[.,:/-]\d+)*%?|[#*&@%/-]+\d*)[)\"'.,:;!?]*"
+)
+
+def get_ocr_options(config=None):
+    """Collect OCR settings from a config mapping, falling back to the defaults."""
+    if config is None:
+        config = current_app.config if has_app_context() else {}
+    options = {key: config.get(key, default) for key, default in OCR_DEFAULTS.items()}
+    if options['OCR_CONCURRENCY'] is None:
+        # Every OCR worker process runs this many Tesseracts, so together they keep to the number of cores
+        options['OCR_CONCURRENCY'] = max(1, (os.cpu_count() or 1) // max(1, config.get('OCR_WORKERS', 1)))
+    return options
+
+def _ocr_page(image, options, page_number=None):
+    """OCR a single rendered page into {'text', 'words'} and release its pixels, reporting it if numbered."""
+    transform = None
+    try:
+        if options['OCR_PREPROCESS']:
+            with timed('preprocess'):
+                prepared, transform = preprocess_page(image, options)
+            image.close()
+            image = prepared
+        with timed('tesseract'):
+            data = get_ocr_engine(options).image_to_data(image)
+    finally:
+        image.close()
+    # One Tesseract run gives both the word boxes and, laid out from them, the page text
+    words = words_from_data(data)
+    if transform is not None:
+        # Keep boxes in rendered page coordinates whatever the preprocessing did
+        transform.map_words(words)
+    text = text_from_words(words)
+    if page_number is not None:
+        report(PROGRESS_PAGE, page=page_number, source=PAGE_SOURCE_OCR, text=text)
+    return {'text': text, 'words': words}
+
+def _ocr_cache_settings(options):
+    """Everything besides the document and page that changes OCR output, for cache keys."""
+    return {
+        'dpi': options['OCR_DPI'],
+        'lang': options['OCR_LANG'],
+        'psm': options['OCR_PSM'],
+        'whitelist': options['OCR_CHAR_WHITELIST'],
+        'preprocess': options['OCR_PREPROCESS'] and {
+            key: options[key] for key in (
+                'OCR_AUTOCROP', 'OCR_DESKEW', 'OCR_DESKEW_MAX_ANGLE', 'OCR_TARGET_TEXT_HEIGHT', 'OCR_BINARIZE'
+            )
+        },
+        'tesseract': get_ocr_engine(options).version,
+        'format': FORMAT_VERSION,
+    }
+
+def _read_text_layer(file_path):
+    """Return the embedded text of every page, or None if the PDF cannot be read."""
+    try:
+        with timed('text_layer'):
+            reader = PyPDF2.PdfReader(file_path)
+            texts = []
+            for page in reader.pages:
+                try:
+                    texts.append(page.extract_text() or '')
+                except Exception:
+                    texts.append('')
+        return texts
+    except Exception as e:
+        logger.warning(f"Could not read PDF text layer: {str(e)}")
+        return None
+
+def _is_usable_text(text, options):
+    """Decide whether an embedded text layer is good enough to skip OCR for a page."""
+    tokens = text.split()
+    if sum(len(token) for token in tokens) < options['TEXT_LAYER_MIN_CHARS']:
+        return False
+    clean_count = sum(1 for token in tokens if CLEAN_TOKEN_RE.fullmatch(token))
+    return clean_count / len(tokens) >= options['TEXT_LAYER_MIN_WORD_RATIO']
+
+def _page_runs(page_numbers, window):
+    """Group ascending page numbers into contiguous [first, last] runs of at most window pages."""
+    runs = []
+    for page_number in page_numbers:
+        if runs and page_number == runs[-1][1] + 1 and page_number - runs[-1][0] < window:
+            runs[-1][1] = page_number
+        else:
+            runs.append([page_number, page_number])
+    return runs
+
+def _ocr_pages_streaming(file_path, page_numbers, options):
+    """
+    Rasterize a few pages at a time and OCR them across a thread pool.
+    Rendering stops running ahead of OCR once the pool is saturated, so at
+    most a window plus one image per worker is held in memory.
+    """
+    window = max(1, options['OCR_PAGE_WINDOW'])
+    concurrency = max(1, options['OCR_CONCURRENCY'])
+    results = {}
+
+    def collect(futures):
+        for future in futures:
+            page_number = pending.pop(future)
+            results[page_number] = future.result()
+
+    # Tesseract works outside the GIL, in a subprocess or in tesserocr, so threads give real parallelism
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        for first_page, last_page in _page_runs(page_numbers, window):
+            with timed('rasterize'):
+                images = pdf2image.convert_from_path(
+                    file_path, dpi=options['OCR_DPI'], first_page=first_page, last_page=last_page,
+                    grayscale=options['OCR_PREPROCESS']
+                )
+            for offset, image in enumerate(images):
+                # Run in a copy of this context so the OCR threads record into the same stage timings
+                future = executor.submit(contextvars.copy_context().run, _ocr_page, image, options, first_page + offset)
+                pending[future] = first_page + offset
+            while len(pending) >= concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(list(pending))
+
+    return results
+
+def _ocr_pages(file_path, page_numbers, options):
+    """OCR the given 1-based pages and return their {'text', 'words'} keyed by page number."""
+    if options['OCR_STREAMING']:
+        return _ocr_pages_streaming(file_path, page_numbers, options)
+
+    # Convert the whole PDF to images up front
+    wanted = set(page_numbers)
+    results = {}
+    with timed('rasterize'):
+        images = pdf2image.convert_from_path(file_path, dpi=options['OCR_DPI'], grayscale=options['OCR_PREPROCESS'])
+    for page_number, image in enumerate(images, start=1):
+        if page_number in wanted:
+            results[page_number] = _ocr_page(image, options, page_number)
+        else:
+            image.close()
+    return results
+
+def _ocr_pages_cached(file_path, page_numbers, options, content_hash=None):
+    """
+    OCR the given pages, serving pages seen before with the same settings from
+    the OCR cache. Returns ({page number: {'text', 'words'}}, set of page numbers served from cache).
+    """
+    if not options['OCR_CACHE_DIR']:
+        return _ocr_pages(file_path, page_numbers, options), set()
+
+    cache = get_ocr_cache(options['OCR_CACHE_DIR'], options['OCR_CACHE_MAX_BYTES'])
+    content_hash = content_hash or hash_file(file_path)
+    settings = _ocr_cache_settings(options)
+    keys = {page_number: cache.make_key(content_hash, page_number, settings) for page_number in page_numbers}
+
+    results = {}
+    with timed('ocr_cache'):
+        for page_number, key in keys.items():
+            value = cache.get(key)
+            if value is not None:
+                results[page_number] = decode_pages(value)[0]
+                report(PROGRESS_PAGE, page=page_number, source=PAGE_SOURCE_OCR_CACHE, text=results[page_number]['text'])
+    cached_pages = set(results)
+
+    missing = [page_number for page_number in page_numbers if page_number not in cached_pages]
+    if missing:
+        for page_number, result in _ocr_pages(file_path, missing, options).items():
+            with timed('ocr_cache'):
+                cache.put(keys[page_number], encode_pages([dict(result, page=page_number, source=PAGE_SOURCE_OCR)]))
+            results[page_number] = result
+
+    return results, cached_pages
+
+def extract_pages_from_pdf(file_path, options=None, content_hash=None):
+    """
+    Extract the text of each page, taking the embedded text layer where it is
+    usable and falling back to OCR for the other pages.
+    OCR results are cached by content digest (computed if not given) and settings.
+    Returns a list of {'page', 'source', 'text', 'words'} dictionaries in page order,
+    where words holds the OCR word boxes and is None for text layer pages.
+    """
+    options = options or get_ocr_options()
+
+    layer_texts = _read_text_layer(file_path) if options['OCR_TEXT_LAYER'] else None
+    if layer_texts is None:
+        layer_texts = [''] * pdf2image.pdfinfo_from_path(file_path)['Pages']
+
+    pages = []
+    for page_number, text in enumerate(layer_texts, start=1):
+        if options['OCR_TEXT_LAYER'] and _is_usable_text(text, options):
+            pages.append({'page': page_number, 'source': PAGE_SOURCE_TEXT_LAYER, 'text': text, 'words': None})
+        else:
+            pages.append({'page': page_number, 'source': PAGE_SOURCE_OCR, 'text': None, 'words': None})
+
+    ocr_page_numbers = [page['page'] for page in pages if page['source'] == PAGE_SOURCE_OCR]
+    report(PROGRESS_EXTRACTING, pages=len(pages), ocr_pages=len(ocr_page_numbers))
+    for page in pages:
+        if page['source'] == PAGE_SOURCE_TEXT_LAYER:
+            report(PROGRESS_PAGE, page=page['page'], source=PAGE_SOURCE_TEXT_LAYER, text=page['text'])
+    if ocr_page_numbers:
+        ocr_results, cached_pages = _ocr_pages_cached(file_path, ocr_page_numbers, options, content_hash)
+        for page in pages:
+            if page['source'] == PAGE_SOURCE_OCR:
+                page['text'] = ocr_results[page['page']]['text']
+                page['words'] = ocr_results[page['page']]['words']
+                if page['page'] in cached_pages:
+                    page['source'] = PAGE_SOURCE_OCR_CACHE
+
+    return pages
+
+def save_extracted_pages(file_path, pages, options, content_hash=None):
+    """
+    Keep the extracted pages of a document, word boxes included, in the OCR
+    store so it can be reparsed without OCR. Returns the stored file's path,
+    or None if the store is disabled or the write failed.
+    """
+    if not options['OCR_STORE_DIR']:
+        return None
     try:
-        # Convert PDF to images
-        print('here')
-        images = pdf2image.convert_from_path(file_path)
-
-        # Extract text from each image
-        extracted_text = ""
-        for image in images:
-            
-            text = pytesseract.image_to_string(image)
-            extracted_text += text + "\n"
-        
-        return extracted_text
+        with timed('ocr_store'):
+            path = document_path(options['OCR_STORE_DIR'], content_hash or hash_file(file_path))
+            save_document(path, pages, _ocr_cache_settings(options))
+        return path
+    except OSError as e:
+        logger.warning(f"Could not store extracted pages of {file_path}: {str(e)}")
+        return None
+
+def join_page_texts(pages):
+    """Join extracted page texts into a single document."""
+    return "".join(page['text'] + "\n" for page in pages)
+
+def extract_text_from_pdf(file_path, options=None):
+    """Extract text from PDF, using OCR for pages without a usable text layer."""
+    try:
+        return join_page_texts(extract_pages_from_pdf(file_path, options))
     except Exception as e:
-        current_app.logger.error(f"Error extracting text from PDF: {str(e)}")
+        logger.error(f"Error extracting text from PDF: {str(e)}")
         return None
 
 def parse_receipt_text(text):
     """
-    Parse extracted text to find receipt details using regex patterns and NLP.
+    Parse extracted text to find receipt details using regex patterns.
     Returns a dictionary with the extracted information.
     """
     if not text:
         return {}
-    
-    # Initialize result dictionary
-    result = {
-        'merchant_name': None,
-        'purchased_at': None,
-        'total_amount': None,
-        'currency': None,
-        'payment_method': None,
-        'tax_amount': None,
-        'receipt_number': None,
-        'items': []
-    }
-    
-    # Process text with spaCy for named entity recognition
-    doc = nlp(text)
-    
-    # Extract merchant name (usually at the top of the receipt)
-    merchant_lines = text.strip().split('\n')[:3]  # Consider first 3 lines for merchant name
-    for line in merchant_lines:
-        line = line.strip()
-        if line and len(line) > 3 and not line.startswith('http') and not re.search(r'\d{2}/\d{2}/\d{4}', line):
-            result['merchant_name'] = line
-            break
-    
-    # Extract date using regex patterns
-    date_patterns = [
-        r'\d{2}/\d{2}/\d{4}',  # DD/MM/YYYY
-        r'\d{2}-\d{2}-\d{4}',  # DD-MM-YYYY
-        r'\d{4}/\d{2}/\d{2}',  # YYYY/MM/DD
-        r'\d{4}-\d{2}-\d{2}',  # YYYY-MM-DD
-        r'\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{4}',  # DD Month YYYY
-    ]
-    
-    for pattern in date_patterns:
-        date_match = re.search(pattern, text)
-        if date_match:
-            try:
-                result['purchased_at'] = date_parser.parse(date_match.group(0))
-                break
-            except:
-                continue
-    
-    # Extract total amount
-    total_patterns = [
-        r'(?:total|amount|sum|balance).{0,20}(?:[$€£¥]|\d)\s*[\d,.]+',
-        r'(?:[$€£¥]|\d)\s*[\d,.]+\s*(?:total|amount)',
-        r'total\s*(?:[$€£¥]|\d)\s*[\d,.]+',
-    ]
-    
-    for pattern in total_patterns:
-        total_match = re.search(pattern, text, re.IGNORECASE)
-        if total_match:
-            amount_str = re.search(r'(?:[$€£¥]|\d)\s*[\d,.]+', total_match.group(0))
-            if amount_str:
-                # Clean the amount string
-                amount_text = amount_str.group(0).replace(',', '.')
-                # Extract numeric part
-                numeric_part = re.search(r'[\d.]+', amount_text)
-                if numeric_part:
-                    result['total_amount'] = float(numeric_part.group(0))
-                    # Check for currency
-                    currency_match = re.search(r'[$€£¥]', amount_text)
-                    if currency_match:
-                        currency_map = {
-                            '$': 'USD',
-                            '€': 'EUR',
-                            '£': 'GBP',
-                            '¥': 'JPY'
-                        }
-                        result['currency'] = currency_map.get(currency_match.group(0), 'USD')
-                    break
-    
-    # Extract payment method
-    payment_patterns = [
-        r'(?:paid|payment|method).{0,15}(?:cash|credit|debit|visa|mastercard|amex|paypal)',
-        r'(?:cash|credit|debit|visa|mastercard|amex|paypal)',
-    ]
-    
-    for pattern in payment_patterns:
-        payment_match = re.search(pattern, text, re.IGNORECASE)
-        if payment_match:
-            payment_text = payment_match.group(0).lower()
-            if 'cash' in payment_text:
-                result['payment_method'] = 'Cash'
-            elif 'credit' in payment_text or 'visa' in payment_text or 'mastercard' in payment_text or 'amex' in payment_text:
-                result['payment_method'] = 'Credit Card'
-            elif 'debit' in payment_text:
-                result['payment_method'] = 'Debit Card'
-            elif 'paypal' in payment_text:
-                result['payment_method'] = 'PayPal'
-            break
-    
-    # Extract tax amount
-    tax_patterns = [
-        r'(?:tax|vat|gst).{0,15}(?:[$€£¥]|\d)\s*[\d,.]+',
-        r'(?:[$€£¥]|\d)\s*[\d,.]+\s*(?:tax|vat|gst)',
-    ]
-    
-    for pattern in tax_patterns:
-        tax_match = re.search(pattern, text, re.IGNORECASE)
-        if tax_match:
-            tax_str = re.search(r'(?:[$€£¥]|\d)\s*[\d,.]+', tax_match.group(0))
-            if tax_str:
-                # Clean the tax amount string
-                tax_text = tax_str.group(0).replace(',', '.')
-                # Extract numeric part
-                numeric_part = re.search(r'[\d.]+', tax_text)
-                if numeric_part:
-                    result['tax_amount'] = float(numeric_part.group(0))
-                    break
-    
-    # Extract receipt number
-    receipt_patterns = [
-        r'(?:receipt|invoice|order|transaction).{0,5}(?:#|no|num|number).{0,5}[\w\d-]+',
-        r'(?:#|no|num|number).{0,5}[\w\d-]+',
-    ]
-    
-    for pattern in receipt_patterns:
-        receipt_match = re.search(pattern, text, re.IGNORECASE)
-        if receipt_match:
-            receipt_text = receipt_match.group(0)
-            number_part = re.search(r'[\w\d-]+$', receipt_text)
-            if number_part:
-                result['receipt_number'] = number_part.group(0)
-                break
-    
-    # Try to extract item lines (this is very challenging and might need refinement)
-    # Look for patterns like "1 x Item $10.99" or "Item............$10.99"
-    item_patterns = [
-        r'(\d+)?\s*[xX]?\s*([a-zA-Z\s]+)[-\s.]*(\$?\d+\.\d{2})',
-        r'([a-zA-Z\s]+)[-\s.]*(\$?\d+\.\d{2})',
-    ]
-    
-    lines = text.split('\n')
-    for line in lines:
-        line = line.strip()
-        if len(line) > 5:  # Ignore very short lines
-            for pattern in item_patterns:
-                item_match = re.search(pattern, line)
-                if item_match:
-                    groups = item_match.groups()
-                    
-                    if len(groups) == 3:  # Pattern with quantity
-                        quantity = float(groups[0]) if groups[0] else 1
-                        item_name = groups[1].strip()
-                        price_str = groups[2].replace('$', '').strip()
-                        try:
-                            price = float(price_str)
-                            result['items'].append({
-                                'item_name': item_name,
-                                'quantity': quantity,
-                                'unit_price': price / quantity,
-                                'total_price': price
-                            })
-                        except ValueError:
-                            pass
-                    elif len(groups) == 2:  # Pattern without quantity
-                        item_name = groups[0].strip()
-                        price_str = groups[1].replace('$', '').strip()
-                        try:
-                            price = float(price_str)
-                            result['items'].append({
-                                'item_name': item_name,
-                                'quantity': 1,
-                                'unit_price': price,
-                                'total_price': price
-                            })
-                        except ValueError:
-                            pass
-    
-    return result
+
+    with timed('parse'):
+        return receipt_extractor.extract(text)
+
+
+def parse_receipt_texts(texts):
+    """Parse many receipt texts at once. Returns one dictionary per text, in order."""
+    with timed('parse'):
+        return [receipt_extractor.extract(text) if text else {} for text in texts]
@@ -0,0 +1,217 @@
+import base64
+import json
+import re
+from functools import lru_cache
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from receipt_processor import db
+from receipt_processor.metrics import timed
+from receipt_processor.models.search import SearchDocument
+
+SEARCH_TABLE = 'receipt_search'
+# Indexed columns and their bm25 weights: a hit in the merchant name or
+# receipt number counts for more than one in an item name, and far more than
+# one somewhere in the OCR text
+RANK_WEIGHTS = {
+    'merchant_name': 10.0,
+    'receipt_number': 10.0,
+    'items': 4.0,
+    'text': 1.0,
+}
+SEARCH_COLUMNS = list(RANK_WEIGHTS)
+SNIPPET_TOKENS = 12
+SORT_RELEVANCE = 'relevance'
+SORT_RECENT = 'recent'
+SEARCH_SORTS = (SORT_RELEVANCE, SORT_RECENT)
+BACKFILL_BATCH_SIZE = 500
+WORD_RE = re.compile(r'\w')
+
+
+def search_enabled():
+    """Full-text search is built on SQLite FTS5, which not every SQLite build includes."""
+    return db.engine.dialect.name == 'sqlite' and _has_fts5(db.engine)
+
+
+@lru_cache(maxsize=None)
+def _has_fts5(engine):
+    """Probe the engine's SQLite library once by creating a temporary FTS5 table."""
+    with engine.connect() as conn:
+        try:
+            conn.execute(text("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(probe)"))
+        except OperationalError:
+            return False
+        conn.execute(text("DROP TABLE temp.fts5_probe"))
+        return True
+
+
+def create_search_index():
+    """
+    Create the FTS5 index over receipt_search_document and the triggers that
+    keep it in step with inserts, updates and deletes of that table. Prefixes
+    of 2 and 3 characters are indexed so short prefix queries stay fast.
+    """
+    if not search_enabled():
+        return
+    documents = SearchDocument.__tablename__
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join(f"new.{column}" for column in SEARCH_COLUMNS)
+    old_values = ', '.join(f"old.{column}" for column in SEARCH_COLUMNS)
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS.values())
+    insert_entry = f"INSERT INTO {SEARCH_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});"
+    delete_entry = f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values});"
+
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5({columns}, "
+            f"content='{documents}', content_rowid='id', prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+        ))
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON {documents} BEGIN {insert_entry} END"))
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON {documents} BEGIN {delete_entry} END"))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au AFTER UPDATE ON {documents} BEGIN {delete_entry} {insert_entry} END"
+        ))
+        # Make bm25 with the column weights the table's default rank
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25({weights})')"))
+
+
+def index_receipts(entries, replace=False):
+    """
+    Write the search documents of (receipt id, parsed data) pairs, where the
+    parsed data may carry the extracted 'text'. With replace, existing
+    documents of the receipts are dropped first. The caller commits.
+    """
+    if not entries or not search_enabled():
+        return
+    rows = [
+        {
+            'receipt_id': receipt_id,
+            'merchant_name': parsed_data.get('merchant_name'),
+            'receipt_number': parsed_data.get('receipt_number'),
+            'items': '\n'.join(item['item_name'] for item in parsed_data.get('items', []) if item.get('item_name')),
+            'text': parsed_data.get('text')
+        }
+        for receipt_id, parsed_data in entries
+    ]
+    with timed('search_index'):
+        if replace:
+            db.session.execute(
+                db.delete(SearchDocument)
+                .where(SearchDocument.receipt_id.in_([receipt_id for receipt_id, _ in entries]))
+                .execution_options(synchronize_session=False)
+            )
+        db.session.execute(db.insert(SearchDocument), rows)
+
+
+def backfill_search_index():
+    """Index receipts stored before search existed, reading their text from the OCR store where it was kept."""
+    if not search_enabled():
+        return 0
+    from receipt_processor.models.receipt import Receipt, ReceiptFile, ReceiptItem
+    from receipt_processor.pipeline import load_stored_text
+
+    query = (
+        db.session.query(Receipt, ReceiptFile)
+        .join(ReceiptFile, Receipt.receipt_file_id == ReceiptFile.id)
+        .outerjoin(SearchDocument, SearchDocument.receipt_id == Receipt.id)
+        .filter(SearchDocument.id.is_(None))
+        .order_by(Receipt.id)
+    )
+    indexed = 0
+    while True:
+        # Indexed receipts drop out of the query, so each batch is the next one
+        batch = query.limit(BACKFILL_BATCH_SIZE).all()
+        if not batch:
+            break
+        items = {}
+        item_rows = db.session.query(ReceiptItem.receipt_id, ReceiptItem.item_name).filter(
+            ReceiptItem.receipt_id.in_([receipt.id for receipt, _ in batch])
+        )
+        for receipt_id, item_name in item_rows:
+            items.setdefault(receipt_id, []).append({'item_name': item_name})
+        index_receipts([
+            (receipt.id, {
+                'merchant_name': receipt.merchant_name,
+                'receipt_number': receipt.receipt_number,
+                'items': items.get(receipt.id, []),
+                'text': load_stored_text(receipt_file)
+            })
+            for receipt, receipt_file in batch
+        ])
+        db.session.commit()
+        db.session.expunge_all()
+        indexed += len(batch)
+    return indexed
+
+
+def build_match_query(query):
+    """
+    Turn free text into an FTS5 query in which every whitespace-separated term
+    must match and the last one may be a prefix, as in search-as-you-type.
+    Terms are quoted, so FTS5 operators are matched literally, and a term like
+    INV-123 matches those tokens in sequence. Returns None if the query has no
+    searchable terms.
+    """
+    terms = [f'"{term.replace(chr(34), chr(34) * 2)}"' for term in query.split() if WORD_RE.search(term)]
+    if not terms:
+        return None
+    return ' '.join(terms) + '*'
+
+
+def encode_search_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({'offset': offset}).encode('utf-8')).decode('ascii')
+
+
+def decode_search_cursor(cursor):
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['offset']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor parameter")
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid cursor parameter")
+    return offset
+
+
+def search_receipts(match_query, limit, offset=0, sort=SORT_RELEVANCE, rank_window=None):
+    """
+    Return (receipt id, score, snippet) of matches for an FTS5 query, fetching
+    one row more than the limit so the caller can tell whether another page
+    follows.
+
+    By relevance, results are ordered by bm25 score (lower is better) among
+    the rank_window most recently indexed matches. Scoring costs time per
+    matching row, so bounding the candidates keeps queries on very common
+    terms in milliseconds; queries matching fewer receipts are ranked in full.
+    By recency, all matches are returned newest first without a score.
+    """
+    with timed('search'):
+        params = {'match': match_query, 'tokens': SNIPPET_TOKENS, 'limit': limit + 1, 'offset': offset}
+        if sort == SORT_RECENT:
+            hits = (
+                f"SELECT rowid, NULL AS score, snippet({SEARCH_TABLE}, -1, '[', ']', '…', :tokens) AS snippet "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match ORDER BY rowid DESC LIMIT :limit OFFSET :offset"
+            )
+            order = 'hits.rowid DESC'
+        else:
+            window_filter = ''
+            if rank_window:
+                # The oldest match inside the window; FTS5 walks the matches newest first and stops there
+                params['window_start'] = db.session.execute(text(
+                    f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match "
+                    f"ORDER BY rowid DESC LIMIT 1 OFFSET :skip"
+                ), {'match': match_query, 'skip': rank_window - 1}).scalar()
+                if params['window_start'] is not None:
+                    window_filter = 'AND rowid >= :window_start'
+            hits = (
+                f"SELECT rowid, rank AS score, snippet({SEARCH_TABLE}, -1, '[', ']', '…', :tokens) AS snippet "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match {window_filter} "
+                f"ORDER BY rank LIMIT :limit OFFSET :offset"
+            )
+            order = 'hits.score'
+
+        rows = db.session.execute(text(
+            f"SELECT document.receipt_id, hits.score, hits.snippet FROM ({hits}) AS hits "
+            f"JOIN {SearchDocument.__tablename__} AS document ON document.id = hits.rowid ORDER BY {order}"
+        ), params).all()
+        return [tuple(row) for row in rows]
@@ -0,0 +1,217 @@
+from datetime import datetime
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from receipt_processor import db
+from receipt_processor.metrics import timed
+from receipt_processor.models.receipt import Receipt, ReceiptItem
+from receipt_processor.models.stats import ReceiptRollup
+
+DIMENSION_MERCHANT = 'merchant'
+DIMENSION_MONTH = 'month'
+DIMENSION_CURRENCY = 'currency'
+DIMENSION_PAYMENT_METHOD = 'payment_method'
+DIMENSIONS = (DIMENSION_MERCHANT, DIMENSION_MONTH, DIMENSION_CURRENCY, DIMENSION_PAYMENT_METHOD)
+SORT_TOTAL = 'total'
+SORT_COUNT = 'count'
+SORT_KEY = 'key'
+STATS_SORTS = (SORT_TOTAL, SORT_COUNT, SORT_KEY)
+SUM_COLUMNS = ('receipt_count', 'total_amount', 'tax_amount', 'item_count', 'item_total')
+MONTH_FORMAT = '%Y-%m'
+STATS_PAGE_SIZE = 50
+MAX_STATS_PAGE_SIZE = 500
+REBUILD_BATCH_SIZE = 1000
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}  # others update, then insert
+
+
+def _group_keys(fields):
+    """(dimension, key) of each group a receipt with these fields belongs to."""
+    purchased_at = fields.get('purchased_at')
+    return [
+        (DIMENSION_MERCHANT, fields.get('merchant_name') or ''),
+        (DIMENSION_MONTH, purchased_at.strftime(MONTH_FORMAT) if purchased_at else ''),
+        (DIMENSION_CURRENCY, fields.get('currency') or ''),
+        (DIMENSION_PAYMENT_METHOD, fields.get('payment_method') or ''),
+    ]
+
+
+def add_receipt(deltas, fields, item_count, item_total, sign=1):
+    """
+    Add a receipt's contribution to the groups it belongs to, or take it away
+    with sign=-1, in deltas: a dict of (dimension, key, currency) to sums in
+    SUM_COLUMNS order. Fields are the receipt's columns, as receipt_fields
+    returns them.
+    """
+    values = (1, fields.get('total_amount') or 0.0, fields.get('tax_amount') or 0.0, item_count, item_total or 0.0)
+    currency = fields.get('currency') or ''
+    for dimension, key in _group_keys(fields):
+        sums = deltas.setdefault((dimension, key, currency), [0, 0.0, 0.0, 0, 0.0])
+        for index, value in enumerate(values):
+            sums[index] += sign * value
+
+
+def item_sums(items):
+    """(item count, item total) of parsed items."""
+    return len(items), sum(item.get('total_price') or 0.0 for item in items)
+
+
+def _stored_receipts(receipt_ids=None):
+    """Select of the rollup fields of stored receipts with their item count and total."""
+    items = (
+        db.select(
+            ReceiptItem.receipt_id,
+            func.count().label('item_count'),
+            func.coalesce(func.sum(ReceiptItem.total_price), 0.0).label('item_total')
+        )
+        .group_by(ReceiptItem.receipt_id)
+    )
+    if receipt_ids is not None:
+        items = items.where(ReceiptItem.receipt_id.in_(receipt_ids))
+    items = items.subquery()
+    select = db.select(
+        Receipt.merchant_name, Receipt.purchased_at, Receipt.currency, Receipt.payment_method,
+        Receipt.total_amount, Receipt.tax_amount,
+        func.coalesce(items.c.item_count, 0), func.coalesce(items.c.item_total, 0.0)
+    ).outerjoin(items, items.c.receipt_id == Receipt.id)
+    if receipt_ids is not None:
+        select = select.where(Receipt.id.in_(receipt_ids))
+    return select
+
+
+def _add_stored(deltas, rows, sign=1):
+    for merchant_name, purchased_at, currency, payment_method, total_amount, tax_amount, item_count, item_total in rows:
+        fields = {
+            'merchant_name': merchant_name, 'purchased_at': purchased_at, 'currency': currency,
+            'payment_method': payment_method, 'total_amount': total_amount, 'tax_amount': tax_amount
+        }
+        add_receipt(deltas, fields, item_count, item_total, sign)
+
+
+def subtract_stored_receipts(deltas, receipt_ids):
+    """Take the stored receipts' current contributions away in deltas, before they are overwritten."""
+    if receipt_ids:
+        _add_stored(deltas, db.session.execute(_stored_receipts(receipt_ids)), sign=-1)
+
+
+def _update_then_insert(rows):
+    """
+    Add rows to the rollups on backends without an upsert: each group is
+    updated in place, or inserted in a savepoint when it is not stored yet.
+    A group inserted meanwhile by another writer is updated instead.
+    """
+    for row in rows:
+        group = (
+            (ReceiptRollup.dimension == row['dimension'])
+            & (ReceiptRollup.key == row['key'])
+            & (ReceiptRollup.currency == row['currency'])
+        )
+        update = (
+            db.update(ReceiptRollup).where(group)
+            .values({column: getattr(ReceiptRollup, column) + row[column] for column in SUM_COLUMNS})
+            .execution_options(synchronize_session=False)
+        )
+        for attempt in range(2):
+            if db.session.execute(update).rowcount:
+                break
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(db.insert(ReceiptRollup).values(**row))
+                break
+            except IntegrityError:
+                if attempt:
+                    raise
+
+
+def apply_rollup_deltas(deltas):
+    """
+    Add deltas to the rollup rows in the session's transaction, creating
+    groups seen for the first time and dropping those left with no receipts.
+    Each row is changed by a single upsert (an update, or an insert, on
+    backends other than SQLite and PostgreSQL), so writers in other
+    transactions add to it rather than overwrite it. The caller commits.
+    """
+    rows = [
+        {'dimension': dimension, 'key': key, 'currency': currency, **dict(zip(SUM_COLUMNS, sums))}
+        for (dimension, key, currency), sums in sorted(deltas.items())  # a fixed lock order between writers
+        if any(sums)
+    ]
+    if not rows:
+        return
+    with timed('rollup'):
+        dialect_insert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+        if dialect_insert is None:
+            _update_then_insert(rows)
+        else:
+            insert = dialect_insert(ReceiptRollup)
+            upsert = insert.on_conflict_do_update(
+                index_elements=['dimension', 'key', 'currency'],
+                set_={column: getattr(ReceiptRollup, column) + getattr(insert.excluded, column) for column in SUM_COLUMNS}
+            )
+            db.session.execute(upsert, rows)
+        emptied = [(row['dimension'], row['key'], row['currency']) for row in rows if row['receipt_count'] < 0]
+        if emptied:
+            db.session.execute(
+                db.delete(ReceiptRollup)
+                .where(db.tuple_(ReceiptRollup.dimension, ReceiptRollup.key, ReceiptRollup.currency).in_(emptied))
+                .where(ReceiptRollup.receipt_count <= 0)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def rebuild_rollups():
+    """
+    Recompute every rollup row from the receipts and their items. The old rows
+    are deleted first, which holds the write lock on SQLite (and the table
+    lock taken on PostgreSQL) until the caller commits, so receipts stored
+    meanwhile wait and are counted once. Returns the number of receipts.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(f"LOCK TABLE {ReceiptRollup.__tablename__} IN EXCLUSIVE MODE"))
+    db.session.execute(db.delete(ReceiptRollup).execution_options(synchronize_session=False))
+    deltas = {}
+    receipts = 0
+    result = db.session.execute(_stored_receipts().execution_options(yield_per=REBUILD_BATCH_SIZE))
+    for rows in result.partitions():
+        _add_stored(deltas, rows)
+        receipts += len(rows)
+    apply_rollup_deltas(deltas)
+    return receipts
+
+
+def _parse_month(args, name):
+    try:
+        return datetime.strptime(args[name], MONTH_FORMAT).strftime(MONTH_FORMAT)
+    except ValueError:
+        raise ValueError(f"Invalid {name} parameter, expected a month as YYYY-MM")
+
+
+def query_rollups(dimension, args):
+    """
+    Query of the rollup rows of a dimension, filtered and ordered by the
+    currency, from/to (months, for the month dimension) and sort parameters
+    in request args. Raises ValueError on bad values.
+    """
+    query = ReceiptRollup.query.filter(ReceiptRollup.dimension == dimension)
+    if 'currency' in args:
+        query = query.filter(ReceiptRollup.currency == args['currency'].upper())
+    if 'from' in args or 'to' in args:
+        if dimension != DIMENSION_MONTH:
+            raise ValueError("The from and to parameters apply to the month dimension only")
+        query = query.filter(ReceiptRollup.key != '')
+        if 'from' in args:
+            query = query.filter(ReceiptRollup.key >= _parse_month(args, 'from'))
+        if 'to' in args:
+            query = query.filter(ReceiptRollup.key <= _parse_month(args, 'to'))
+
+    sort = args.get('sort', SORT_KEY if dimension == DIMENSION_MONTH else SORT_TOTAL)
+    if sort not in STATS_SORTS:
+        raise ValueError(f"Invalid sort parameter, expected one of: {', '.join(STATS_SORTS)}")
+    if sort == SORT_TOTAL:
+        order = (ReceiptRollup.total_amount.desc(), ReceiptRollup.id)
+    elif sort == SORT_COUNT:
+        order = (ReceiptRollup.receipt_count.desc(), ReceiptRollup.id)
+    else:
+        order = (ReceiptRollup.key, ReceiptRollup.currency)
+    return query.order_by(*order)
@@ -0,0 +1,510 @@
+"""
+Tiered PDF validation.
+
+The fast tier answers "is this a PDF with pages" from the file's structure
+with a handful of small reads, whatever the file size: the %PDF- header in
+the first 1024 bytes, the %%EOF marker and startxref offset in the last
+1024, the cross-reference sections that offset leads to, and the /Count of
+the page tree the trailer's /Root points at. A file with no marker in its
+last 1024 bytes, such as one with trailing padding, is left to the deep
+tier, since PyPDF2 searches the whole file for it. Cross-reference tables,
+cross-reference streams, object streams and incremental updates are
+followed; entries are read one at a time, never whole tables.
+
+The deep tier is a full PyPDF2 parse in a child process that is killed
+after a timeout and limited in memory, so a hostile PDF cannot hang or
+exhaust a web worker. Files whose structure the fast tier cannot follow
+(damaged cross-references, encryption, unusual stream encodings) fall
+through to it.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import zlib
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+
+from receipt_processor.metrics import timed
+
+VALIDATION_FAST = 'fast'
+VALIDATION_DEEP = 'deep'
+VALIDATION_MODES = (VALIDATION_FAST, VALIDATION_DEEP)
+
+# Validation settings read from the Flask config
+VALIDATION_DEFAULTS = {
+    'PDF_VALIDATION': VALIDATION_FAST,
+    'PDF_DEEP_VALIDATION_TIMEOUT': 10,  # seconds a full parse may take before the file is rejected
+    'PDF_DEEP_VALIDATION_MAX_MEMORY': 1024 * 1024 * 1024,  # address space of the parsing process
+}
+
+PDF_HEADER = b'%PDF-'
+PDF_EOF_MARKER = b'%%EOF'
+# Readers look for the header in the first and the end-of-file marker in the last 1024 bytes;
+# PyPDF2 searches further back for the marker, so its absence here is not conclusive
+PDF_SNIFF_SIZE = 1024
+
+OBJECT_READ_SIZE = 16 * 1024  # bytes read for one object's dictionary
+PAGE_TREE_READ_SIZE = 1024 * 1024  # bytes read for the root of the page tree, whose /Kids may list every page
+MAX_STREAM_SIZE = 1024 * 1024  # largest cross-reference or object stream decoded, before and after inflating
+MAX_XREF_SECTIONS = 32  # incremental updates followed through /Prev
+MAX_XREF_SUBSECTIONS = 4096
+MAX_XREF_STREAM_ENTRIES = 250_000  # entries decoded from one cross-reference stream
+XREF_ENTRY_SIZE = 20
+
+_DELIMITERS = rb'\x00\t\n\x0c\r ()<>\[\]{}/%'
+REGULAR_RE = re.compile(rb'[^' + _DELIMITERS + rb']+')
+REFERENCE_RE = re.compile(rb'(\d+)\s+(\d+)\s+R(?![^' + _DELIMITERS + rb'])')
+OBJECT_RE = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+STREAM_RE = re.compile(rb'\s*stream(?:\r\n|\n)')
+STARTXREF_RE = re.compile(rb'startxref\s+(\d+)')
+SUBSECTION_RE = re.compile(rb'\s*(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)')
+XREF_ENTRY_RE = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+TRAILER_RE = re.compile(rb'\s*trailer')
+# A direct /Count, not a reference like /Count 5 0 R
+COUNT_RE = re.compile(rb'/Count\s+(\d+)(?=\s*[/>])')
+EOL_RE = re.compile(rb'[\r\n]')
+WHITESPACE = b'\x00\t\n\x0c\r '
+
+# Errors that mean the fast tier could not follow the file's structure
+UNFOLLOWABLE = (ValueError, KeyError, IndexError, TypeError, AttributeError, RecursionError, zlib.error)
+
+Ref = namedtuple('Ref', 'number generation')
+
+
+class StructureError(Exception):
+    """The file cannot be a valid PDF."""
+
+
+def validation_options(config=None):
+    """Collect validation settings from a config mapping, falling back to the defaults."""
+    if config is None:
+        config = current_app.config if has_app_context() else {}
+    return {key: config.get(key, default) for key, default in VALIDATION_DEFAULTS.items()}
+
+
+def _skip(data, pos):
+    """Skip whitespace and comments."""
+    while pos < len(data):
+        if data[pos] in WHITESPACE:
+            pos += 1
+        elif data[pos] == ord('%'):
+            match = EOL_RE.search(data, pos)
+            pos = match.end() if match else len(data)
+        else:
+            break
+    return pos
+
+
+def parse_object(data, pos=0):
+    """
+    Parse the PDF object at a position, returning (value, end). Dictionaries
+    become dicts keyed by name without the slash, arrays lists, names str,
+    strings bytes and indirect references Ref. Raises ValueError on data that
+    is malformed or ends early.
+    """
+    pos = _skip(data, pos)
+    if pos >= len(data):
+        raise ValueError('Unexpected end of object')
+    if data.startswith(b'<<', pos):
+        dictionary = {}
+        pos += 2
+        while True:
+            pos = _skip(data, pos)
+            if data.startswith(b'>>', pos):
+                return dictionary, pos + 2
+            key, pos = parse_object(data, pos)
+            if not isinstance(key, str):
+                raise ValueError('Dictionary key is not a name')
+            dictionary[key], pos = parse_object(data, pos)
+    first = data[pos:pos + 1]
+    if first == b'[':
+        items = []
+        pos += 1
+        while True:
+            pos = _skip(data, pos)
+            if data.startswith(b']', pos):
+                return items, pos + 1
+            item, pos = parse_object(data, pos)
+            items.append(item)
+    if first == b'<':
+        end = data.index(b'>', pos)
+        return data[pos + 1:end], end + 1
+    if first == b'(':
+        depth = 0
+        end = pos
+        while end < len(data):
+            if data[end] == ord('\\'):
+                end += 2
+                continue
+            if data[end] == ord('('):
+                depth += 1
+            elif data[end] == ord(')'):
+                depth -= 1
+                if depth == 0:
+                    return data[pos + 1:end], end + 1
+            end += 1
+        raise ValueError('Unterminated string')
+    if first == b'/':
+        match = REGULAR_RE.match(data, pos + 1)
+        return (match.group().decode('latin-1'), match.end()) if match else ('', pos + 1)
+    match = REFERENCE_RE.match(data, pos)
+    if match:
+        return Ref(int(match[1]), int(match[2])), match.end()
+    match = REGULAR_RE.match(data, pos)
+    if not match:
+        raise ValueError(f"Unexpected {first!r} in object")
+    token = match.group()
+    keywords = {b'true': True, b'false': False, b'null': None}
+    if token in keywords:
+        return keywords[token], match.end()
+    try:
+        return int(token), match.end()
+    except ValueError:
+        return float(token), match.end()
+
+
+def _png_unpredict(data, columns):
+    """Undo the PNG row filters of predictor 10-15 for one 8-bit component per column."""
+    row_size = columns + 1
+    if len(data) % row_size:
+        raise ValueError('Predicted stream is not a whole number of rows')
+    previous = bytearray(columns)
+    decoded = bytearray()
+    for start in range(0, len(data), row_size):
+        kind = data[start]
+        row = bytearray(data[start + 1:start + row_size])
+        if kind > 4:
+            raise ValueError(f"Unknown PNG filter {kind}")
+        for i in range(columns if kind else 0):
+            left = row[i - 1] if i else 0
+            up = previous[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xFF
+            elif kind == 4:
+                up_left = previous[i - 1] if i else 0
+                estimate = left + up - up_left
+                distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+                row[i] = (row[i] + (left, up, up_left)[distances.index(min(distances))]) & 0xFF
+        decoded += row
+        previous = row
+    return bytes(decoded)
+
+
+def _decode_stream(dictionary, data):
+    """Decode an unfiltered or FlateDecode stream, raising ValueError for anything else."""
+    filters = dictionary.get('Filter')
+    params = dictionary.get('DecodeParms')
+    if isinstance(filters, list):
+        if len(filters) > 1:
+            raise ValueError('Chained stream filters')
+        filters = filters[0] if filters else None
+        params = params[0] if isinstance(params, list) and params else params
+    if filters is None:
+        decoded = data
+    elif filters == 'FlateDecode':
+        decompressor = zlib.decompressobj()
+        decoded = decompressor.decompress(data, MAX_STREAM_SIZE)
+        if decompressor.unconsumed_tail:
+            raise ValueError('Stream is too large')
+    else:
+        raise ValueError(f"Unsupported stream filter {filters}")
+    if params is None:
+        return decoded
+    if not isinstance(params, dict):
+        raise ValueError('Unsupported decode parameters')
+    predictor = params.get('Predictor', 1)
+    if predictor >= 10 and params.get('Colors', 1) == 1 and params.get('BitsPerComponent', 8) == 8:
+        columns = params.get('Columns', 1)
+        if not isinstance(columns, int) or not 0 < columns <= MAX_STREAM_SIZE:
+            raise ValueError('Unsupported predictor columns')
+        return _png_unpredict(decoded, columns)
+    if predictor != 1:
+        raise ValueError(f"Unsupported predictor {predictor}")
+    return decoded
+
+
+def _non_negative_ints(values):
+    return isinstance(values, list) and all(isinstance(value, int) and value >= 0 for value in values)
+
+
+class PDFStructure:
+    """Follows the cross-references of an open PDF with bounded reads."""
+
+    def __init__(self, f, size):
+        self.f = f
+        self.size = size
+        self.sections = []  # (trailer, entry lookup), newest first
+        self._object_streams = {}
+
+    def read(self, offset, length):
+        self.f.seek(offset)
+        return self.f.read(length)
+
+    def page_count(self):
+        """
+        Return the /Count of the page tree if it is positive. Raises StructureError if the file
+        cannot be a valid PDF, and one of UNFOLLOWABLE if its structure cannot
+        be followed with bounded reads.
+        """
+        if PDF_HEADER not in self.read(0, PDF_SNIFF_SIZE):
+            raise StructureError("File is not a PDF")
+        tail = self.read(max(0, self.size - PDF_SNIFF_SIZE), PDF_SNIFF_SIZE)
+        if PDF_EOF_MARKER not in tail:
+            raise ValueError('No end-of-file marker near the end of the file')
+        offsets = STARTXREF_RE.findall(tail)
+        if not offsets:
+            raise ValueError('No startxref offset')
+        self._load_sections(int(offsets[-1]))
+
+        trailer = next((trailer for trailer, _ in self.sections if 'Root' in trailer), None)
+        if trailer is None:
+            raise ValueError('No /Root in the trailer')
+        if 'Encrypt' in trailer:
+            raise ValueError('Encrypted PDF')
+        root = self.resolve(trailer['Root'])
+        if not isinstance(root, dict):
+            raise ValueError('Document catalog is not a dictionary')
+        pages = root['Pages']
+        if isinstance(pages, Ref):
+            # Find the count without parsing the reference to every page in /Kids
+            match = COUNT_RE.search(self._object_bytes(pages, PAGE_TREE_READ_SIZE))
+            count = int(match[1]) if match else None
+        elif isinstance(pages, dict):
+            count = pages.get('Count')
+        else:
+            raise ValueError('Page tree is not a dictionary')
+        if not isinstance(count, int) or count <= 0:
+            # PyPDF2 counts the pages in the tree rather than trusting /Count, so an empty tree is confirmed by a full parse
+            raise ValueError('Missing or zero page count')
+        return count
+
+    def _load_sections(self, offset):
+        """Read the cross-reference section at an offset and those of earlier revisions."""
+        pending = [offset]
+        seen = set()
+        while pending:
+            offset = pending.pop(0)
+            if offset in seen:
+                continue
+            if len(seen) == MAX_XREF_SECTIONS:
+                raise ValueError('Too many cross-reference sections')
+            seen.add(offset)
+            if offset >= self.size:
+                raise ValueError('Cross-reference offset is past the end of the file')
+            if self.read(offset, 4) == b'xref':
+                trailer, lookup = self._xref_table(offset)
+            else:
+                trailer, lookup = self._xref_stream(offset)
+            if not isinstance(trailer, dict):
+                raise ValueError('Trailer is not a dictionary')
+            self.sections.append((trailer, lookup))
+            # A hybrid file's stream section comes before the previous revision
+            pending.extend(trailer[key] for key in ('XRefStm', 'Prev') if isinstance(trailer.get(key), int))
+
+    def _xref_table(self, offset):
+        """Locate the subsections of a cross-reference table; entries are read when looked up."""
+        subsections = []
+        pos = offset + 4
+        for _ in range(MAX_XREF_SUBSECTIONS):
+            match = SUBSECTION_RE.match(self.read(pos, 64))
+            if not match:
+                break
+            start, count = int(match[1]), int(match[2])
+            subsections.append((start, count, pos + match.end()))
+            pos += match.end() + count * XREF_ENTRY_SIZE
+        else:
+            raise ValueError('Too many cross-reference subsections')
+        chunk = self.read(pos, OBJECT_READ_SIZE)
+        match = TRAILER_RE.match(chunk)
+        if not match:
+            raise ValueError('No trailer after the cross-reference table')
+        trailer, _ = parse_object(chunk, match.end())
+
+        def lookup(number):
+            for start, count, entries in subsections:
+                if start <= number < start + count:
+                    entry = XREF_ENTRY_RE.match(self.read(entries + (number - start) * XREF_ENTRY_SIZE, XREF_ENTRY_SIZE))
+                    if not entry:
+                        raise ValueError('Malformed cross-reference entry')
+                    return (1, int(entry[1]), int(entry[2])) if entry[3] == b'n' else (0, 0, 0)
+            return None
+
+        return trailer, lookup
+
+    def _xref_stream(self, offset):
+        """Decode a cross-reference stream into (type, field 2, field 3) entries by object number."""
+        dictionary, data = self._stream_at(offset)
+        if dictionary.get('Type') != 'XRef':
+            raise ValueError('No cross-reference at the startxref offset')
+        rows = _decode_stream(dictionary, data)
+        widths = dictionary['W']
+        index = dictionary.get('Index', [0, dictionary['Size']])
+        if not _non_negative_ints(widths) or len(widths) != 3 or not sum(widths):
+            raise ValueError('Malformed cross-reference stream /W')
+        if not _non_negative_ints(index) or len(index) % 2:
+            raise ValueError('Malformed cross-reference stream /Index')
+        row_size = sum(widths)
+        if sum(index[1::2]) > min(len(rows) // row_size, MAX_XREF_STREAM_ENTRIES):
+            raise ValueError('Cross-reference stream is too short or has too many entries')
+        entries = {}
+        pos = 0
+        for start, count in zip(index[::2], index[1::2]):
+            for number in range(start, start + count):
+                row = rows[pos:pos + row_size]
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(row[:width], 'big'))
+                    row = row[width:]
+                if not widths[0]:
+                    fields[0] = 1
+                entries[number] = tuple(fields)
+                pos += row_size
+        return dictionary, entries.get
+
+    def _parse_indirect(self, chunk, number=None):
+        match = OBJECT_RE.match(chunk)
+        if not match or (number is not None and int(match[1]) != number):
+            raise ValueError('Object not found at its offset')
+        return parse_object(chunk, match.end())
+
+    def _stream_at(self, offset, number=None):
+        """Read the dictionary and raw data of the stream object at an offset."""
+        chunk = self.read(offset, OBJECT_READ_SIZE)
+        dictionary, end = self._parse_indirect(chunk, number)
+        match = STREAM_RE.match(chunk, end)
+        if not isinstance(dictionary, dict) or not match:
+            raise ValueError('Not a stream object')
+        length = self.resolve(dictionary.get('Length'))
+        if not isinstance(length, int) or not 0 <= length <= MAX_STREAM_SIZE:
+            raise ValueError('Stream length is missing or too large')
+        return dictionary, self.read(offset + match.end(), length)
+
+    def _lookup(self, number):
+        for _, lookup in self.sections:
+            entry = lookup(number)
+            if entry is not None:
+                return entry
+        raise ValueError(f"Object {number} is not in the cross-reference table")
+
+    def _object_bytes(self, ref, read_size=OBJECT_READ_SIZE):
+        """The bytes of an indirect object's value, at most read_size of them for an object stored directly."""
+        kind, field2, _ = self._lookup(ref.number)
+        if kind == 1:
+            chunk = self.read(field2, read_size)
+            match = OBJECT_RE.match(chunk)
+            if not match or int(match[1]) != ref.number:
+                raise ValueError('Object not found at its offset')
+            end = chunk.find(b'endobj', match.end())
+            return chunk[match.end():end if end >= 0 else len(chunk)]
+        if kind == 2:
+            return self._compressed_object(field2, ref.number)
+        raise ValueError(f"Object {ref.number} is free")
+
+    def resolve(self, value):
+        """Follow an indirect reference to the object it points to."""
+        if not isinstance(value, Ref):
+            return value
+        return parse_object(self._object_bytes(value))[0]
+
+    def _compressed_object(self, stream_number, number):
+        """The bytes of an object stored in an object stream."""
+        if stream_number not in self._object_streams:
+            kind, offset, _ = self._lookup(stream_number)
+            if kind != 1:
+                raise ValueError('Object stream is not stored directly')
+            dictionary, data = self._stream_at(offset, stream_number)
+            if dictionary.get('Type') != 'ObjStm':
+                raise ValueError('Not an object stream')
+            decoded = _decode_stream(dictionary, data)
+            first = dictionary['First']
+            header = decoded[:first].split()
+            self._object_streams[stream_number] = (
+                decoded, {int(header[i]): first + int(header[i + 1]) for i in range(0, len(header) - 1, 2)}
+            )
+        decoded, offsets = self._object_streams[stream_number]
+        start = offsets[number]
+        end = min((offset for offset in offsets.values() if offset > start), default=len(decoded))
+        return decoded[start:end]
+
+
+def read_page_count(file_path):
+    """
+    Fast tier: the page count of a PDF read from its structure, or None if
+    the structure cannot be followed. Raises StructureError if the file
+    cannot be a valid PDF.
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            return PDFStructure(f, os.fstat(f.fileno()).st_size).page_count()
+        except UNFOLLOWABLE:
+            return None
+
+
+# Run in a fresh interpreter, so the parse imports nothing but PyPDF2 and shares no state with the app
+DEEP_CHECK_SCRIPT = """
+import json, sys
+try:
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (int(sys.argv[2]), int(sys.argv[2])))
+except (ImportError, ValueError, OSError):
+    pass
+import PyPDF2
+try:
+    result = {'pages': len(PyPDF2.PdfReader(sys.argv[1]).pages)}
+except MemoryError:
+    result = {'error': 'PDF needs too much memory to parse'}
+except Exception as e:
+    result = {'error': str(e)}
+print(json.dumps(result))
+"""
+
+
+def parse_page_count(file_path, timeout, max_memory):
+    """Deep tier: count pages with a full PyPDF2 parse in a child process, returning (pages, error)."""
+    try:
+        completed = subprocess.run(
+            [sys.executable, '-c', DEEP_CHECK_SCRIPT, file_path, str(max_memory)],
+            capture_output=True, text=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return None, f"PDF could not be parsed within {timeout} seconds"
+    try:
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return None, f"PDF parser exited with status {completed.returncode}"
+    return result.get('pages'), result.get('error')
+
+
+def is_valid_pdf(file_path, mode=None, options=None):
+    """
+    Check if a file is a valid PDF with at least one page, returning
+    (is_valid, invalid_reason). The fast mode reads the page count from the
+    file's structure and parses in full only what it cannot follow; the deep
+    mode always parses in full.
+    """
+    options = options or validation_options()
+    mode = mode or options['PDF_VALIDATION']
+    pages = None
+    if mode == VALIDATION_FAST:
+        with timed('validate_pdf'):
+            try:
+                pages = read_page_count(file_path)
+            except (StructureError, OSError) as e:
+                return False, str(e)
+    if pages is None:
+        with timed('validate_pdf_deep'):
+            pages, error = parse_page_count(
+                file_path, options['PDF_DEEP_VALIDATION_TIMEOUT'], options['PDF_DEEP_VALIDATION_MAX_MEMORY']
+            )
+        if error:
+            return False, error
+    if not pages:
+        return False, "PDF has no pages"
+    return True, None
@@ -0,0 +1,66 @@
+import io
+import multiprocessing
+import uuid
+
+from synthetic import text_pdf
+
+from receipt_processor.migrations import MIGRATIONS
+
+PROCESSES = 4
+REQUESTS = 10
+
+
+def start_worker(index, config, start_event, results):
+    """Start the app like a server process, migrating on startup, then upload, validate and list receipts."""
+    from receipt_processor import create_app, db
+    from receipt_processor.migrations import run_migrations
+
+    start_event.wait()
+    try:
+        app = create_app(dict(config, AUTO_MIGRATE=False))
+        with app.app_context():
+            applied = run_migrations()
+            db.session.remove()
+    except Exception as e:
+        results.put({'worker': index, 'error': repr(e)})
+        return
+
+    client = app.test_client()
+    failures = []
+    pdf = text_pdf([['CONCURRENCY CHECK', f"Worker {index}", 'Total $1.00']])
+    for _ in range(REQUESTS):
+        data = pdf + f"\n% {uuid.uuid4().hex}\n".encode('ascii')
+        response = client.post('/upload', data={'file': (io.BytesIO(data), 'receipt.pdf'), 'validate': 'true'})
+        if response.status_code != 201:
+            failures.append(('upload', response.status_code))
+            continue
+        response = client.get('/receipt-files?limit=20')
+        if response.status_code != 200:
+            failures.append(('list', response.status_code))
+    results.put({'worker': index, 'error': None, 'applied': applied, 'failures': failures})
+
+
+def test_concurrent_startup_migrates_once_and_writes_without_failures(tmp_path):
+    config = {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'receipts.db'}",
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'JOBS_AUTOSTART': False,
+    }
+    context = multiprocessing.get_context('spawn')
+    start_event = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(target=start_worker, args=(index, config, start_event, results))
+        for index in range(PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    start_event.set()
+    reports = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join()
+
+    assert [report['error'] for report in reports] == [None] * PROCESSES
+    applied = sorted(version for report in reports for version in report['applied'])
+    assert applied == [version for version, _, _ in MIGRATIONS]
+    assert [report['failures'] for report in reports] == [[]] * PROCESSES
@@ -0,0 +1,131 @@
+import random
+import re
+import time
+
+import pytest
+from bench_parser import PATHOLOGICAL_INPUTS, SAMPLE_RECEIPT
+from dateutil import parser as date_parser
+
+from receipt_processor.nlp.extractor import receipt_extractor
+
+# Worst case per pathological input; the patterns take about 20 ms, the ones they replaced seconds to minutes
+PATHOLOGICAL_LIMIT = 0.25
+
+# The patterns the extractor replaced, searched the way the original parse_receipt_text searched them
+OLD_FIELD_PATTERNS = {
+    'total': [
+        r'(?:total|amount|sum|balance).{0,20}(?:[$€£¥]|\d)\s*[\d,.]+',
+        r'(?:[$€£¥]|\d)\s*[\d,.]+\s*(?:total|amount)',
+        r'total\s*(?:[$€£¥]|\d)\s*[\d,.]+',
+    ],
+    'tax': [
+        r'(?:tax|vat|gst).{0,15}(?:[$€£¥]|\d)\s*[\d,.]+',
+        r'(?:[$€£¥]|\d)\s*[\d,.]+\s*(?:tax|vat|gst)',
+    ],
+    'receipt_number': [
+        r'(?:receipt|invoice|order|transaction).{0,5}(?:#|no|num|number).{0,5}[\w\d-]+',
+        r'(?:#|no|num|number).{0,5}[\w\d-]+',
+    ],
+}
+OLD_ITEM_PATTERNS = [
+    r'(\d+)?\s*[xX]?\s*([a-zA-Z\s]+)[-\s.]*(\$?\d+\.\d{2})',
+    r'([a-zA-Z\s]+)[-\s.]*(\$?\d+\.\d{2})',
+]
+CURRENCIES = {'$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY'}
+
+
+def _old_amount(text, pattern):
+    match = re.search(pattern, text, re.IGNORECASE)
+    if not match:
+        return None
+    amount = re.search(r'(?:[$€£¥]|\d)\s*[\d,.]+', match.group(0))
+    amount_text = amount.group(0).replace(',', '.') if amount else ''
+    numeric = re.search(r'[\d.]+', amount_text)
+    try:
+        return (amount_text, float(numeric.group(0))) if numeric else None
+    except ValueError:
+        return None  # the original raised on amounts such as 1.2.3
+
+
+def old_extract(text):
+    """The fields and items the original regexes extract, except for dates, merchants and payment methods, which kept their patterns."""
+    result = {'total_amount': None, 'currency': None, 'tax_amount': None, 'receipt_number': None, 'items': []}
+    for pattern in OLD_FIELD_PATTERNS['total']:
+        amount = _old_amount(text, pattern)
+        if amount:
+            result['total_amount'] = amount[1]
+            symbol = re.search(r'[$€£¥]', amount[0])
+            if symbol:
+                result['currency'] = CURRENCIES[symbol.group(0)]
+            break
+    for pattern in OLD_FIELD_PATTERNS['tax']:
+        amount = _old_amount(text, pattern)
+        if amount:
+            result['tax_amount'] = amount[1]
+            break
+    for pattern in OLD_FIELD_PATTERNS['receipt_number']:
+        match = re.search(pattern, text, re.IGNORECASE)
+        number = re.search(r'[\w\d-]+$', match.group(0)) if match else None
+        if number:
+            result['receipt_number'] = number.group(0)
+            break
+    for line in text.split('\n'):
+        line = line.strip()
+        if len(line) <= 5:
+            continue
+        for pattern in OLD_ITEM_PATTERNS:
+            match = re.search(pattern, line)
+            if not match:
+                continue
+            *quantity, name, price = match.groups()
+            quantity = float(quantity[0]) if quantity and quantity[0] else 1
+            try:
+                price = float(price.replace('$', ''))
+                result['items'].append({
+                    'item_name': name.strip(), 'quantity': quantity, 'unit_price': price / quantity, 'total_price': price
+                })
+            except (ValueError, ZeroDivisionError):
+                pass  # the original raised on a zero quantity
+    return result
+
+
+def random_receipt_text(rng):
+    """Short text from the characters and words the patterns look for."""
+    pieces = ['a', 'B', 'x', 'X', ' ', ' ', '\t', '.', ',', '-', '$', '€', '\n', '1', '2', '0', '9', '12.50', '3.99',
+              'total', 'Tax', 'VAT', 'amount', 'Receipt', 'no', '#', 'order']
+    return ''.join(rng.choice(pieces) for _ in range(rng.randint(1, 30)))
+
+
+def test_sample_receipt():
+    result = receipt_extractor.extract(SAMPLE_RECEIPT)
+    assert result['merchant_name'] == 'CORNER MARKET'
+    assert result['purchased_at'] == date_parser.parse('12/03/2024')
+    assert result['payment_method'] == 'Credit Card'
+    assert {key: result[key] for key in old_extract(SAMPLE_RECEIPT)} == old_extract(SAMPLE_RECEIPT)
+    assert result['receipt_number'] == 'A-10293'
+    assert result['items'][:2] == [
+        {'item_name': 'Whole Milk', 'quantity': 2.0, 'unit_price': 3.49, 'total_price': 6.98},
+        {'item_name': 'x Whole Milk', 'quantity': 1, 'unit_price': 6.98, 'total_price': 6.98},
+    ]
+
+
+def test_matches_old_patterns():
+    rng = random.Random(0)
+    for _ in range(5000):
+        text = random_receipt_text(rng)
+        result = receipt_extractor.extract(text)
+        assert {key: result[key] for key in old_extract(text)} == old_extract(text), repr(text)
+
+
+def test_zero_quantity_item():
+    assert receipt_extractor.extract('0 x Item 1.99')['items'] == [
+        {'item_name': 'x Item', 'quantity': 1, 'unit_price': 1.99, 'total_price': 1.99}
+    ]
+
+
+@pytest.mark.parametrize('name', PATHOLOGICAL_INPUTS)
+def test_pathological_input_runs_in_linear_time(name):
+    text = PATHOLOGICAL_INPUTS[name]
+    start = time.perf_counter()
+    receipt_extractor.extract(text)
+    assert time.perf_counter() - start < PATHOLOGICAL_LIMIT
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+from synthetic import receipt_image, receipt_lines
+
+from receipt_processor.ocr.store import decode_pages, encode_pages, text_from_words, words_from_data
+
+# image_to_data rows of two paragraphs, the first with two lines
+DATA = {
+    'level': [1, 2, 3, 4, 5, 5, 4, 5, 3, 4, 5, 5],
+    'block_num': [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
+    'par_num': [0, 0, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2],
+    'line_num': [0, 0, 0, 1, 1, 1, 2, 2, 0, 1, 1, 1],
+    'text': ['', '', '', '', 'CORNER', 'MARKET', '', 'Milk', '', '', 'Total', '$6.98'],
+    'conf': [-1, -1, -1, -1, 96, 95, -1, 91, -1, -1, 93, 88],
+    **{name: [10] * 12 for name in ('left', 'top', 'width', 'height')},
+}
+
+
+def test_text_is_laid_out_like_image_to_string():
+    assert text_from_words(words_from_data(DATA)) == 'CORNER MARKET\nMilk\n\nTotal $6.98\n\f'
+    assert text_from_words(words_from_data({'text': []})) == '\f'
+
+
+def test_stored_pages_keep_their_text():
+    words = words_from_data(DATA)
+    pages = [
+        {'page': 1, 'source': 'ocr', 'text': text_from_words(words), 'words': words},
+        {'page': 2, 'source': 'text_layer', 'text': 'Thank you\n', 'words': None},
+    ]
+    assert decode_pages(encode_pages(pages)) == pages
+
+
+def test_text_matches_tesseract_plain_text():
+    tesserocr = pytest.importorskip('tesserocr')
+    from receipt_processor.ocr.engine import TesserocrEngine
+
+    try:
+        api = tesserocr.PyTessBaseAPI(lang='eng')
+    except RuntimeError:
+        pytest.skip('Tesseract language data not found')
+    rng = random.Random(1)
+    with api:
+        for _ in range(3):
+            api.SetImage(receipt_image(receipt_lines(rng.randint(3, 12), rng), 200))
+            api.Recognize()
+            assert text_from_words(words_from_data(TesserocrEngine._words(api))) == api.GetUTF8Text() + '\f'
@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import inspect
+
+from receipt_processor import create_app, db
+from receipt_processor import search
+from receipt_processor.search import SEARCH_TABLE, search_enabled
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    def make():
+        return create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'receipts.db'}",
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+            'JOBS_AUTOSTART': False,
+        })
+    return make
+
+
+def test_fts5_is_probed_once(make_app):
+    try:
+        sqlite3.connect(':memory:').execute("CREATE VIRTUAL TABLE fts5_probe USING fts5(probe)")
+    except sqlite3.OperationalError:
+        pytest.skip('SQLite is built without FTS5')
+    app = make_app()
+    with app.app_context():
+        misses = search._has_fts5.cache_info().misses
+        assert search_enabled() and search_enabled()
+        assert search._has_fts5.cache_info().misses == misses
+        assert SEARCH_TABLE in inspect(db.engine).get_table_names()
+
+
+def test_search_without_fts5_is_not_available(make_app, monkeypatch):
+    monkeypatch.setattr(search, '_has_fts5', lambda engine: False)
+    app = make_app()
+    with app.app_context():
+        assert SEARCH_TABLE not in inspect(db.engine).get_table_names()
+    response = app.test_client().get('/search?q=milk')
+    assert response.status_code == 501
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from receipt_processor.validation import VALIDATION_FAST, is_valid_pdf, read_page_count
+
+PAGE_OBJECTS = [
+    b'<< /Type /Catalog /Pages 2 0 R >>',
+    b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+    b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 226 300] >>',
+]
+
+
+def build_pdf(objects, trailer=None):
+    """A PDF of numbered objects with a cross-reference table."""
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    trailer = trailer or b'<< /Size %d /Root 1 0 R >>' % (len(objects) + 1)
+    return data + b'trailer\n%s\nstartxref\n%d\n%%%%EOF\n' % (trailer, xref)
+
+
+def build_xref_stream_pdf(dictionary, rows=b''):
+    """A PDF whose startxref points at a cross-reference stream with the given dictionary entries."""
+    data = b'%PDF-1.5\n'
+    xref = len(data)
+    data += b'1 0 obj\n<< /Type /XRef %s /Length %d >>\nstream\n%s\nendstream\nendobj\n' % (dictionary, len(rows), rows)
+    return data + b'startxref\n%d\n%%%%EOF\n' % xref
+
+
+@pytest.fixture
+def write_pdf(tmp_path):
+    def write(data):
+        path = tmp_path / 'test.pdf'
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+def test_page_count_of_valid_pdf(write_pdf):
+    path = write_pdf(build_pdf(PAGE_OBJECTS))
+    assert read_page_count(path) == 1
+    assert is_valid_pdf(path, VALIDATION_FAST) == (True, None)
+
+
+def test_trailing_garbage_falls_through_to_full_parse(write_pdf):
+    path = write_pdf(build_pdf(PAGE_OBJECTS) + b' ' * 2000)
+    assert read_page_count(path) is None
+    assert is_valid_pdf(path, VALIDATION_FAST) == (True, None)
+
+
+@pytest.mark.parametrize('dictionary', [
+    b'/W [0 0 0] /Size 2000000000',
+    b'/W [1 2 1] /Size 2000000000',
+    b'/W [1 2 1] /Index [0 2000000000]',
+    b'/W [1 2 1] /Index [-5 2]',
+    b'/W [1 -2 1] /Size 1',
+    b'/W [1 /Two 1] /Size 1',
+    b'/W [1 2] /Size 1',
+    b'/W [1 2 1] /Size 1 /DecodeParms << /Predictor 12 /Columns 1000000000000 >>',
+])
+def test_malformed_xref_stream_is_not_followed(write_pdf, dictionary):
+    path = write_pdf(build_xref_stream_pdf(dictionary, rows=b'\x01\x00\x09\x00'))
+    start = time.perf_counter()
+    assert read_page_count(path) is None
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.parametrize('objects, trailer', [
+    ([b'<< /Type /Catalog /Pages 5 >>'], None),
+    ([b'<< /Type /Catalog /Pages [2 0 R] >>'], None),
+    ([b'5'], None),
+    (PAGE_OBJECTS, b'5'),
+    (PAGE_OBJECTS, b'[/Root 1 0 R]'),
+])
+def test_non_dictionary_structure_is_not_followed(write_pdf, objects, trailer):
+    path = write_pdf(build_pdf(objects, trailer))
+    assert read_page_count(path) is None
+    assert is_valid_pdf(path, VALIDATION_FAST)[0] is False